@@ -0,0 +1,92 @@
+"""Measure the validation of a bulk create body.
+
+Compares how long the event loop is blocked by validating the parsed
+body, like the default routes, with the bulk validator validating the
+raw bytes in place, or in chunks in worker processes.
+
+    python -m benchmarks.bulk_validation
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from demo.schemas import ItemModel
+from fastcrud.bulk import BulkValidator
+
+
+def body(size: int) -> bytes:
+    return json.dumps(
+        [
+            {"name": f"name {index}", "des": "description " * 20, "type": "t"}
+            for index in range(size)
+        ]
+    ).encode()
+
+
+async def blocked(func) -> tuple[float, float]:
+    """Total duration of ``func`` and longest stall of the loop."""
+    longest = 0.0
+
+    async def ticker():
+        nonlocal longest
+        while True:
+            tick = time.perf_counter()
+            await asyncio.sleep(0)
+            longest = max(longest, time.perf_counter() - tick)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    await func()
+    duration = time.perf_counter() - started
+    # Let the ticker measure the last stall
+    await asyncio.sleep(0)
+    task.cancel()
+    return duration, longest
+
+
+async def run(args):
+    payload = body(args.items)
+    inline = BulkValidator(threshold=len(payload))
+    chunked = BulkValidator(
+        threshold=0, chunk_size=args.chunk_size, processes=args.processes
+    )
+
+    async def default():
+        [ItemModel(**item) for item in json.loads(payload)]
+
+    def bulk(validator):
+        async def validate():
+            async for _ in validator.validate(ItemModel, "create", payload):
+                pass
+
+        return validate
+
+    print(f"{len(payload)} bytes, {os.cpu_count()} cpus")
+    # Start the workers and build the adapters before measuring
+    await bulk(chunked)()
+    for name, func in (
+        ("default", default),
+        ("in place", bulk(inline)),
+        ("processes", bulk(chunked)),
+    ):
+        duration, longest = await blocked(func)
+        print(
+            f"{name:>9}: {duration * 1e3:.1f} ms, "
+            f"loop blocked up to {longest * 1e3:.1f} ms"
+        )
+    chunked.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=20_000)
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument("--processes", type=int, default=4)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
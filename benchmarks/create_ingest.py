@@ -0,0 +1,112 @@
+"""Measure the creation of a large batch of items.
+
+Compares the previous create path, rebuilding every item as a stored
+model, encoding it twice with ``jsonable_encoder`` and reading the
+inserted documents back, with the current one serializing each item
+once and returning the inserted documents.
+
+Runs against an in-process stand-in of the collection by default, so
+only the work of the storage is measured, or against a server with
+``--mongodb-url``, the round trips included.
+
+    python -m benchmarks.create_ingest
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from demo.schemas import ItemModel
+from fastcrud.storage.mongodb import MongoStorage
+
+
+class Cursor:
+    def __init__(self, docs: list[dict]):
+        self.docs = docs
+
+    async def to_list(self, length):
+        return self.docs
+
+
+class Collection:
+    """Keeps the inserted documents, like a server storing copies."""
+
+    def __init__(self):
+        self.docs: dict = {}
+
+    async def insert_many(self, docs: list[dict], ordered: bool = True):
+        for doc in docs:
+            self.docs[doc["_id"]] = dict(doc)
+
+    def find(self, query: dict, projection: dict | None = None) -> Cursor:
+        return Cursor([dict(self.docs[uid]) for uid in query["_id"]["$in"]])
+
+
+async def previous_create(storage: MongoStorage, items) -> list:
+    """The create of the storage before items were serialized once."""
+    items_in_db = [
+        storage.db_model(
+            **{**item.model_dump(), "created": item.updated},
+            _id=str(uuid.uuid1()),
+        )
+        for item in items
+    ]
+    collection = storage.db[storage.collection]
+    docs = jsonable_encoder(items_in_db)
+    await collection.insert_many(docs)
+    docs = await collection.find(
+        {"_id": {"$in": [doc["_id"] for doc in docs]}}
+    ).to_list(None)
+    return jsonable_encoder([storage.db_model(**doc) for doc in docs])
+
+
+async def measure(func, repeat: int) -> float:
+    """Median duration of ``func``, in seconds."""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await func()
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations)
+
+
+async def run(args):
+    items = [
+        ItemModel(name=f"name {index}", des="description " * 20, type="t")
+        for index in range(args.items)
+    ]
+    if args.mongodb_url:
+        db = AsyncIOMotorClient(args.mongodb_url)["fastcrud_benchmarks"]
+        await db["items"].drop()
+    else:
+        db = {"items": Collection()}
+    storage = MongoStorage(db, ItemModel, "items")
+    read_back = MongoStorage(db, ItemModel, "items", read_back=True)
+
+    print(f"{args.items} items, median of {args.repeat} runs")
+    reference = await measure(
+        lambda: previous_create(storage, items), args.repeat
+    )
+    print(f"   previous: {reference * 1e3:.1f} ms")
+    for name, current in (("read back", read_back), ("current", storage)):
+        duration = await measure(lambda: current.create(items), args.repeat)
+        print(
+            f"{name:>11}: {duration * 1e3:.1f} ms, "
+            f"{reference / duration:.1f}x faster"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--mongodb-url", help="e.g. mongodb://localhost")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
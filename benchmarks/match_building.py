@@ -0,0 +1,68 @@
+"""Measure the cost of building the ``$match`` clauses of a request.
+
+Compares normalizing every query parameter on each request with the
+builders precompiled once per router.
+
+    python -m benchmarks.match_building
+"""
+import argparse
+import logging
+import timeit
+from datetime import datetime
+
+from demo.dependencies import item_query_params
+from fastcrud.dependencies import get_common_match_parameters
+from fastcrud.storage.aggregation import (
+    compile_query_parameters,
+    process_query_parameter_stage,
+)
+from fastcrud.storage.indexes import filter_parameters
+
+QUERY_PARAMETERS = {
+    **{
+        parameter: None
+        for parameter in filter_parameters(get_common_match_parameters)
+    },
+    "created__gte": datetime(2023, 1, 1),
+    "name": ["foo", "bar"],
+    "name__contains": None,
+    "name__icontains": "baz",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=100_000)
+    parser.add_argument(
+        "--debug", action="store_true", help="enable debug logging"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    builders = compile_query_parameters(
+        [
+            *filter_parameters(get_common_match_parameters),
+            *filter_parameters(item_query_params),
+        ]
+    )
+
+    def normalized():
+        process_query_parameter_stage([], QUERY_PARAMETERS)
+
+    def compiled():
+        process_query_parameter_stage([], QUERY_PARAMETERS, builders=builders)
+
+    stages_normalized, stages_compiled = [], []
+    process_query_parameter_stage(stages_normalized, QUERY_PARAMETERS)
+    process_query_parameter_stage(
+        stages_compiled, QUERY_PARAMETERS, builders=builders
+    )
+    assert stages_normalized == stages_compiled
+
+    for name, func in (("normalized", normalized), ("compiled", compiled)):
+        duration = min(timeit.repeat(func, number=args.number, repeat=5))
+        print(f"{name:>10}: {duration / args.number * 1e6:.2f} us/request")
+
+
+if __name__ == "__main__":
+    main()
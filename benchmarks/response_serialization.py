@@ -0,0 +1,69 @@
+"""Measure the serialization of a page of documents.
+
+Compares validating the documents and rendering them through
+``jsonable_encoder`` with the fast response mode, which constructs the
+trusted documents and dumps them with pydantic-core.
+
+    python -m benchmarks.response_serialization
+"""
+import argparse
+import statistics
+import time
+import uuid
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic_core import to_json
+
+from demo.schemas import ItemModel
+from fastcrud.utils import create_in_db_model
+
+
+def documents(size: int) -> list[dict]:
+    now = datetime.now().isoformat()
+    return [
+        {
+            "_id": str(uuid.uuid1()),
+            "name": f"name {index}",
+            "des": "description " * 20,
+            "type": "type",
+            "created": now,
+            "updated": now,
+        }
+        for index in range(size)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    db_model = create_in_db_model(ItemModel)
+    docs = documents(args.page_size)
+
+    def validated() -> bytes:
+        results = jsonable_encoder([db_model(**doc) for doc in docs])
+        return JSONResponse({"results": results}).body
+
+    def fast() -> bytes:
+        results = [db_model.model_construct(**doc) for doc in docs]
+        return to_json({"results": results}, fallback=jsonable_encoder)
+
+    for name, func in (("validated", validated), ("fast", fast)):
+        durations = []
+        for _ in range(args.number):
+            started = time.perf_counter()
+            func()
+            durations.append(time.perf_counter() - started)
+        quantiles = statistics.quantiles(durations, n=100)
+        print(
+            f"{name:>9}: p50 {quantiles[49] * 1e3:.3f} ms, "
+            f"p99 {quantiles[98] * 1e3:.3f} ms per page"
+        )
+
+
+if __name__ == "__main__":
+    main()
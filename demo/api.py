@@ -23,6 +23,7 @@ from fastapi import FastAPI
 
 from demo.router import router
 from demo.settings import SETTINGS
+from fastcrud.storage.clients import MONGODB_CLIENTS
 
 LOGGER = daiquiri.getLogger(__name__)
 
@@ -53,14 +54,14 @@ app.include_router(router, prefix="/api")
 
 async def startup_db_client(application: FastAPI):
     """Connect to MongoDB and create indexes."""
-
-    ...
+    await MONGODB_CLIENTS.startup()
+    await router.provision_indexes()
 
 
 async def shutdown_db_client(application: FastAPI):
-    """Disconnect from MongoDB."""
-    # application.mongodb_client.close()  # type: ignore
-    ...
+    """Disconnect from MongoDB and stop the worker pools."""
+    await MONGODB_CLIENTS.shutdown()
+    router.shutdown()
 
 
 @app.get("/", include_in_schema=False)
@@ -17,9 +17,16 @@ router = CRUDRouter(
     storage_settings={
         "mongodb_url": SETTINGS.mongodb_url,
         "mongodb_name": SETTINGS.mongodb_name,
+        "mongodb_options": {
+            "maxPoolSize": SETTINGS.mongodb_max_pool_size,
+            "minPoolSize": SETTINGS.mongodb_min_pool_size,
+        },
     },
     crud_cls=BaseCrud,
     filters=item_query_params,
+    orderings=["-created", "name"],
+    # The free text description is not worth an index
+    index_settings={"fields": ["name"]},
 )
 
 
@@ -0,0 +1,191 @@
+import asyncio
+import functools
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator
+
+import daiquiri
+import pydantic
+from pydantic_core import from_json, to_json
+
+from fastcrud.utils import create_replace_model, create_update_model
+
+LOGGER = daiquiri.getLogger(__name__)
+
+
+@functools.cache
+def bulk_model(model, kind: str):
+    """Model of the items of a ``create``, ``update`` or ``replace``."""
+    if kind == "create":
+        return model
+    if kind == "update":
+        return create_update_model(model)
+    if kind == "replace":
+        return create_replace_model(model)
+    raise ValueError(f"unknown bulk kind: {kind}")
+
+
+@functools.cache
+def bulk_adapter(model, kind: str) -> pydantic.TypeAdapter:
+    """Adapter validating a list of items, built once per model."""
+    return pydantic.TypeAdapter(list[bulk_model(model, kind)])
+
+
+def request_schema(model, kind: str) -> dict:
+    """OpenAPI schema of a bulk request body.
+
+    The generated models are not in the OpenAPI components, so their
+    definitions are inlined. Recursive references are left open.
+    """
+    schema = bulk_adapter(model, kind).json_schema()
+    definitions = schema.pop("$defs", {})
+
+    def inline(value, expanding: tuple = ()):
+        if isinstance(value, list):
+            return [inline(item, expanding) for item in value]
+        if not isinstance(value, dict):
+            return value
+        inlined = {
+            key: inline(item, expanding)
+            for key, item in value.items()
+            if key != "$ref"
+        }
+        if "$ref" not in value:
+            return inlined
+        name = value["$ref"].rsplit("/", 1)[-1]
+        if name in expanding:
+            return inlined
+        return {**inline(definitions[name], (*expanding, name)), **inlined}
+
+    return inline(schema)
+
+
+def split_array(body: bytes, size: int) -> list[bytes] | None:
+    """JSON arrays of ``size`` items of ``body``, None if not an array."""
+    try:
+        values = from_json(body)
+    except ValueError:
+        return None
+    if not isinstance(values, list):
+        return None
+    return [
+        to_json(values[start : start + size])
+        for start in range(0, len(values), size)
+    ]
+
+
+def validate_chunk(
+    model, kind: str, chunk: bytes
+) -> tuple[list | None, list | None]:
+    """Validate a JSON array of items, in a worker process.
+
+    Returns the pickle state of the validated items, which unlike the
+    generated models can be sent back, or the validation errors.
+    """
+    try:
+        items = bulk_adapter(model, kind).validate_json(chunk)
+    except pydantic.ValidationError as err:
+        return None, json.loads(err.json(include_url=False))
+    return [item.__getstate__() for item in items], None
+
+
+def restore_item(model, state: dict) -> pydantic.BaseModel:
+    """Rebuild a validated item from its state, as unpickling does."""
+    item = model.__new__(model)
+    item.__setstate__(state)
+    return item
+
+
+class BulkValidationError(Exception):
+    def __init__(self, errors: list[dict]):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def _offset_errors(errors: list[dict], offset: int) -> list[dict]:
+    """Locate ``errors`` in the request body, like FastAPI does."""
+    located = []
+    for error in errors:
+        loc = list(error.get("loc", []))
+        if loc and isinstance(loc[0], int):
+            loc[0] += offset
+        located.append({**error, "loc": ["body", *loc]})
+    return located
+
+
+class BulkValidator:
+    """Validate large request bodies off the event loop.
+
+    Bodies are validated from their raw JSON bytes with a
+    ``TypeAdapter`` cached per model. Bodies up to ``threshold`` bytes
+    are validated in place, pydantic-core holds the GIL so a thread
+    would not free the loop. Larger ones are split and validated in
+    chunks of ``chunk_size`` items by a pool of ``processes`` worker
+    processes, so the model must be importable by the workers. Chunks
+    are yielded in order as soon as they are validated.
+    """
+
+    def __init__(
+        self,
+        threshold: int = 256 * 1024,
+        chunk_size: int = 2000,
+        processes: int | None = None,
+    ):
+        self.threshold = threshold
+        self.chunk_size = chunk_size
+        self.processes = processes
+        self._executor: ProcessPoolExecutor | None = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.processes)
+        return self._executor
+
+    async def validate(
+        self, model, kind: str, body: bytes
+    ) -> AsyncIterator[list]:
+        """Validated chunks of the ``kind`` items in ``body``.
+
+        Raises :class:`BulkValidationError` on the first invalid chunk.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = None
+        if len(body) > self.threshold:
+            chunks = await loop.run_in_executor(
+                self.executor, split_array, body, self.chunk_size
+            )
+        if chunks is None:
+            try:
+                items = bulk_adapter(model, kind).validate_json(body)
+            except pydantic.ValidationError as err:
+                raise BulkValidationError(
+                    _offset_errors(json.loads(err.json(include_url=False)), 0)
+                )
+            yield items
+            return
+
+        LOGGER.debug("Validating %s bulk chunks in processes", len(chunks))
+        futures = [
+            loop.run_in_executor(
+                self.executor, validate_chunk, model, kind, chunk
+            )
+            for chunk in chunks
+        ]
+        item_model = bulk_model(model, kind)
+        try:
+            for index, future in enumerate(futures):
+                states, errors = await future
+                if errors is not None:
+                    raise BulkValidationError(
+                        _offset_errors(errors, index * self.chunk_size)
+                    )
+                yield [restore_item(item_model, state) for state in states]
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -1,19 +1,36 @@
+import json
 import uuid
 from datetime import datetime
-from typing import Annotated, Any
+from typing import Annotated, Any, AsyncIterator
 
 import pydantic
-from fastapi import APIRouter, Depends, Query
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic_core import to_json
 
+from fastcrud.bulk import (
+    BulkValidationError,
+    BulkValidator,
+    request_schema,
+)
 from fastcrud.dependencies import (
     get_common_match_parameters,
     get_common_parameters,
+    split_fields,
 )
+from fastcrud.executors import BoundedExecutor
+from fastcrud.singleflight import SingleFlight
+from fastcrud.storage.cache import CachedStorage, QueryCache
+from fastcrud.storage.clients import MONGODB_CLIENTS, MongoClientRegistry
 from fastcrud.storage.commun import BaseStorage
+from fastcrud.storage.facets import MaterializedFacets
+from fastcrud.storage.indexes import derive_index_plan, filter_parameters
 from fastcrud.storage.mongodb import MongoStorage
+from fastcrud.storage.relations import normalize_relations
 from fastcrud.utils import (
     create_in_db_model,
+    create_replace_model,
     create_update_model,
     run_async_or_sync,
 )
@@ -30,40 +47,85 @@ class BaseCrud:
         model: BaseCrudModel,
         storage: MongoStorage,
         filters: Any,
+        export_batch_size: int = 1000,
+        coalesce: bool = True,
+        executor: BoundedExecutor | None = None,
+        default_fields: list[str] | None = None,
+        count_mode: str = "exact",
+        count_cap: int | None = None,
+        facet_counts: MaterializedFacets | None = None,
+        fast_responses: bool = False,
+        bulk_validator: BulkValidator | None = None,
+        offload_sync: bool = True,
     ):
         self.model = model
         self.storage = storage
         self.filters = filters
+        self.export_batch_size = export_batch_size
+        self.executor = executor
+        self.default_fields = default_fields
+        self.count_mode = count_mode
+        self.count_cap = count_cap
+        self.facet_counts = facet_counts
+        self.fast_responses = fast_responses
+        self.bulk_validator = bulk_validator
+        self.offload_sync = offload_sync
+        self.single_flight = SingleFlight() if coalesce else None
         self.db_model = create_in_db_model(model)
         self.update_model = create_update_model(model)
+        self.replace_model = create_replace_model(model)
 
         async def create(items: list[model]) -> list[self.db_model]:
             """
             Create an object, generating a unique id by default
             """
-            return await run_async_or_sync(self._create, items)
+            return self._render(await run_async_or_sync(self._create, items))
 
         async def update(
             items: list[self.update_model],
-        ) -> list[self.db_model]:
+        ) -> dict:
             """
-            Create an object, generating a unique id by default
+            Partially update objects by unique id
             """
             return await run_async_or_sync(self._update, items)
 
         async def replace(
-            items: list[self.db_model],
-        ) -> list[self.db_model]:
+            items: list[self.replace_model],
+        ) -> dict:
             """
-            Create an object, generating a unique id by default
+            Replace objects by unique id
             """
             return await run_async_or_sync(self._replace, items)
 
-        async def get(uid: str) -> self.db_model:
+        async def get(
+            uid: str,
+            fields: Annotated[list[str] | None, Query()] = None,
+            expand: Annotated[list[str] | None, Query()] = None,
+        ) -> self.db_model:
             """
             Get an object by its unique id
             """
-            return await run_async_or_sync(self._get, uid)
+            fields, expand = split_fields(fields), split_fields(expand)
+            if not fields and not expand:
+                return self._render(await run_async_or_sync(self._get, uid))
+            item = await run_async_or_sync(self._get, uid, fields, expand)
+            if self.fast_responses:
+                return self._render(item)
+            # Partial or expanded items do not validate as items
+            return JSONResponse(jsonable_encoder(item))
+
+        async def get_many(
+            uid: Annotated[list[str], Query()],
+            fields: Annotated[list[str] | None, Query()] = None,
+        ) -> dict:
+            """
+            Get objects by their unique ids, missing ids are reported
+            """
+            return self._render(
+                await run_async_or_sync(
+                    self._get_many, uid, split_fields(fields)
+                )
+            )
 
         async def find(
             common: Annotated[dict, Depends(get_common_parameters)],
@@ -76,33 +138,144 @@ class BaseCrud:
             """
             Get one or more objects by a comparison operator
 
-            See: :func:`fastcrud.storage.local.default_filter` docstring
+            See: :func:`fastcrud.utils.normalize_parameter` docstring
             for more details
             """
-            return await run_async_or_sync(
-                self._find, common, common_match, filters, facets
+            return self._render(
+                await run_async_or_sync(
+                    self._find, common, common_match, filters, facets
+                )
             )
 
-        async def delete(uids: Annotated[list[str], Query()]):
+        async def export(
+            common_match: Annotated[
+                dict, Depends(get_common_match_parameters)
+            ],
+            filters: Annotated[filters, Depends(filters)],
+            ordering: Annotated[str | None, Query()] = None,
+        ):
+            """
+            Export every object matching the filters as NDJSON
             """
-            Delete an object by unique id
+            return StreamingResponse(
+                await self._export(common_match, filters, ordering),
+                media_type="application/x-ndjson",
+            )
+
+        async def delete(uids: Annotated[list[str], Query()]) -> dict:
+            """
+            Delete objects by unique id
             """
             return await run_async_or_sync(self._delete, uids)
 
+        if bulk_validator is not None:
+
+            async def create(request: Request) -> list[self.db_model]:
+                """
+                Create objects, large bodies are validated in chunks
+                """
+                results = await self._bulk(request, "create", self._create)
+                return self._render([doc for docs in results for doc in docs])
+
+            async def update(request: Request) -> dict:
+                """
+                Partially update objects, large bodies are validated in chunks
+                """
+                return merge_reports(
+                    await self._bulk(request, "update", self._update)
+                )
+
+            async def replace(request: Request) -> dict:
+                """
+                Replace objects, large bodies are validated in chunks
+                """
+                return merge_reports(
+                    await self._bulk(request, "replace", self._replace)
+                )
+
         self.get = get
+        self.get_many = get_many
         self.create = create
         self.update = update
         self.replace = replace
         self.delete = delete
         self.find = find
+        self.export = export
+
+    def _render(self, content: Any) -> Any:
+        """Serialize ``content`` straight to JSON bytes in fast mode.
+
+        The returned response skips the response model validation and
+        ``jsonable_encoder``, items are serialized by pydantic-core.
+        """
+        if not self.fast_responses:
+            return content
+        return Response(
+            to_json(content, fallback=jsonable_encoder),
+            media_type="application/json",
+        )
+
+    async def _call(self, func, *args, **kwargs):
+        return await run_async_or_sync(
+            func,
+            *args,
+            executor=self.executor,
+            offload=self.offload_sync,
+            **kwargs,
+        )
 
-    async def _get(self, uid):
-        return await run_async_or_sync(self.storage.get, uid)
+    async def _get(self, uid, fields=None, expand=None):
+        args = (uid, fields, expand) if fields or expand else (uid,)
+        if self.single_flight is not None:
+            return await self.single_flight.do(
+                ("get", uid, tuple(fields or ()), tuple(expand or ())),
+                self._call,
+                self.storage.get,
+                *args,
+            )
+        return await self._call(self.storage.get, *args)
+
+    async def _get_many(self, uids, fields=None):
+        args = (uids, fields) if fields else (uids,)
+        items = await self._call(self.storage.get_many, *args)
+        results = [item for item in items if item is not None]
+        return {
+            "results": results
+            if self.fast_responses
+            else jsonable_encoder(results),
+            "missing": [
+                uid for uid, item in zip(uids, items) if item is None
+            ],
+        }
 
     async def _find(
         self, common, common_match, filters, facets, *args, **kwargs
     ):
-        return await run_async_or_sync(
+        common = {
+            **common,
+            "fields": common.get("fields") or self.default_fields,
+            "count": common.get("count") or self.count_mode,
+            "count_cap": self.count_cap,
+        }
+        if self.facet_counts is not None and facets:
+            materialized = self.facet_counts.lookup(
+                common_match | (filters or {}), facets
+            )
+            if materialized is not None:
+                result = await self._find(common, common_match, filters, [])
+                return {**result, **materialized}
+        if self.single_flight is not None and not args and not kwargs:
+            key = self._find_key(common, common_match, filters, facets)
+            return await self.single_flight.do(
+                ("find", key),
+                self._call,
+                self.storage.find,
+                common,
+                common_match,
+                filters,
+                facets,
+            )
+        return await self._call(
             self.storage.find,
             common,
             common_match,
@@ -112,17 +285,130 @@ class BaseCrud:
             **kwargs,
         )
 
+    @staticmethod
+    def _find_key(common, common_match, filters, facets) -> str:
+        if filters is not None and not isinstance(filters, dict):
+            filters = vars(filters)
+        return json.dumps(
+            [common, common_match, filters, sorted(facets)],
+            default=str,
+            sort_keys=True,
+        )
+
+    async def _export(self, common_match, filters, ordering):
+        """Lines of the export, started before the response is sent.
+
+        Invalid filters raise on the first line, while an error status
+        can still be returned instead of a truncated 200 body.
+        """
+        lines = self.storage.export(
+            common_match,
+            filters,
+            ordering=ordering,
+            batch_size=self.export_batch_size,
+        )
+        try:
+            first = await anext(lines)
+        except StopAsyncIteration:
+            return lines
+        return prepend_line(first, lines)
+
+    async def _bulk(self, request: Request, kind: str, write) -> list:
+        """Write the items of the body chunk by chunk, as validated.
+
+        Chunks validated before an invalid one are already written, the
+        422 response reports how many items in ``X-Written-Count``.
+        """
+        results, written = [], 0
+        chunks = self.bulk_validator.validate(
+            self.model, kind, await request.body()
+        )
+        try:
+            async for items in chunks:
+                results.append(await write(items))
+                written += len(items)
+        except BulkValidationError as err:
+            raise HTTPException(
+                status_code=422,
+                detail=err.errors,
+                headers={"X-Written-Count": str(written)},
+            )
+        finally:
+            await chunks.aclose()
+        return results
+
     async def _create(self, items):
-        return await run_async_or_sync(self.storage.create, items)
+        docs = await self._call(self.storage.create, items)
+        if self.facet_counts is not None:
+            # Counted from the items, the stored documents may hold
+            # native values such as BSON datetimes
+            model = self.storage.result_model(
+                self.facet_counts.stored_fields
+            )
+            self.facet_counts.apply(
+                [],
+                self._facet_documents(
+                    [self.storage.build_item(model, doc) for doc in docs]
+                ),
+            )
+        return docs
 
     async def _update(self, items):
-        return await run_async_or_sync(self.storage.update, items)
+        return await self._counted_write(
+            [item.id for item in items], self.storage.update, items
+        )
 
     async def _replace(self, items):
-        return await run_async_or_sync(self.storage.replace, items)
+        return await self._counted_write(
+            [item.id for item in items], self.storage.replace, items
+        )
 
     async def _delete(self, uids: list[str]):
-        return await run_async_or_sync(self.storage.delete, uids)
+        return await self._counted_write(
+            uids, self.storage.delete, uids, read_after=False
+        )
+
+    async def _counted_write(self, uids, func, *args, read_after=True):
+        """Run a write, maintaining the materialized facet counts."""
+        if self.facet_counts is None:
+            return await self._call(func, *args)
+        before = await self._read_documents(uids)
+        result = await self._call(func, *args)
+        after = await self._read_documents(uids) if read_after else []
+        self.facet_counts.apply(before, after)
+        return result
+
+    async def _read_documents(self, uids) -> list[dict | None]:
+        items = await self._call(
+            self.storage.get_many, uids, self.facet_counts.stored_fields
+        )
+        return self._facet_documents(items)
+
+    @staticmethod
+    def _facet_documents(items) -> list[dict | None]:
+        """JSON documents of the counted items, like the export lines
+        the counts are reconciled from."""
+        return [
+            None
+            if item is None
+            else item.model_dump(mode="json", by_alias=True, warnings=False)
+            for item in items
+        ]
+
+
+async def prepend_line(first: str, lines: AsyncIterator[str]):
+    yield first
+    async for line in lines:
+        yield line
+
+
+def merge_reports(reports: list[dict]) -> dict:
+    """Merge the write reports of consecutive chunks."""
+    return {
+        "matched_count": sum(report["matched_count"] for report in reports),
+        "modified_count": sum(report["modified_count"] for report in reports),
+        "items": [item for report in reports for item in report["items"]],
+    }
 
 
 class CRUDRouter(APIRouter):
@@ -135,6 +421,22 @@ class CRUDRouter(APIRouter):
         storage_cls: BaseStorage | None = None,
         storage_settings: dict | None = None,
         filters=None,
+        export_batch_size: int = 1000,
+        coalesce: bool = True,
+        cache_settings: dict | None = None,
+        query_cache_settings: dict | None = None,
+        clients: MongoClientRegistry | None = None,
+        executor_settings: dict | None = None,
+        orderings: list[str] | None = None,
+        index_settings: dict | None = None,
+        search: dict[str, str] | None = None,
+        fields: list[str] | None = None,
+        relations: dict | None = None,
+        count_settings: dict | None = None,
+        facet_settings: dict | None = None,
+        fast_responses: bool = False,
+        bulk_settings: dict | None = None,
+        offload_sync: bool = True,
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
@@ -143,25 +445,159 @@ class CRUDRouter(APIRouter):
         self.storage_cls = storage_cls or MongoStorage
         self.collection = collection or self.model.__name__
         self.storage_settings: dict = storage_settings or {}
+        self.clients = clients or MONGODB_CLIENTS
+        self.executor = None
+        if executor_settings is not None:
+            # e.g. {"max_workers": 8, "max_queue": 64}
+            self.executor = BoundedExecutor(**executor_settings)
 
-        mongodb_client = AsyncIOMotorClient(
-            self.storage_settings["mongodb_url"]
-        )
+        db = None
+        if "mongodb_url" in self.storage_settings:
+            # Routers with the same url and options share the connection pool
+            mongodb_client = self.clients.get(
+                self.storage_settings["mongodb_url"],
+                **self.storage_settings.get("mongodb_options", {}),
+            )
+            db = mongodb_client[self.storage_settings["mongodb_name"]]
 
         self.storage: MongoStorage = self.storage_cls(
-            mongodb_client[self.storage_settings["mongodb_name"]],
+            db,
             self.model,
             self.collection,
+            # e.g. {"batch_size": 1000, "ordered": False}
+            **self.storage_settings.get("storage_options", {}),
+        )
+        if search is not None:
+            # e.g. {"name": "ngram", "city": "prefix"}, see
+            # fastcrud.utils.build_search_parameter
+            self.storage.search = search
+        if relations is not None:
+            # e.g. {"owner": "users", "tags": {"collection": "tags",
+            # "fields": ["name"]}}, see normalize_relations
+            self.storage.relations = normalize_relations(relations)
+        # Documents written through the router are trusted in fast mode
+        self.storage.trusted_documents = fast_responses
+        # The declared query parameters are normalized once, requests
+        # only build the clauses of the values they set
+        self.storage.compile_filters(
+            [
+                *filter_parameters(get_common_match_parameters),
+                *filter_parameters(filters),
+            ]
+        )
+        if query_cache_settings is not None:
+            # e.g. {"maxsize": 256, "page_ttl": 5.0, "facets_ttl": 60.0}
+            self.storage.query_cache = QueryCache(**query_cache_settings)
+        if cache_settings is not None:
+            # e.g. {"maxsize": 1024, "ttl": 60.0}
+            self.storage = CachedStorage(
+                self.storage,
+                executor=self.executor,
+                offload=offload_sync,
+                **cache_settings,
+            )
+
+        self.facet_counts = None
+        if facet_settings is not None:
+            # e.g. {"fields": ["type"], "partitions": ["status"]}
+            self.facet_counts = MaterializedFacets(**facet_settings)
+
+        self.bulk_validator = None
+        if bulk_settings is not None:
+            # e.g. {"threshold": 262144, "chunk_size": 2000,
+            # "processes": 4}, see fastcrud.bulk.BulkValidator
+            self.bulk_validator = BulkValidator(**bulk_settings)
+
+        self.index_plan = derive_index_plan(
+            filters,
+            orderings,
+            search,
+            # e.g. {"fields": ["name", "type"], "max_indexes": 16}
+            **(index_settings or {}),
         )
 
         self.crud = self.crud_cls(
             self.model,
             self.storage,
             filters=filters or (lambda: None),
+            export_batch_size=export_batch_size,
+            coalesce=coalesce,
+            executor=self.executor,
+            # Default projection of the find results
+            default_fields=fields,
+            # e.g. {"count_mode": "capped", "count_cap": 10000}
+            **(count_settings or {}),
+            facet_counts=self.facet_counts,
+            fast_responses=fast_responses,
+            bulk_validator=self.bulk_validator,
+            # Synchronous storages bound to one thread, e.g. holding a
+            # sqlite3 connection, run their calls on the loop thread
+            offload_sync=offload_sync,
         )
+        # Static paths must be registered before "/{uid}"
+        self.crud.export = self.get("/export")(self.crud.export)
+        self.crud.get_many = self.get("/batch")(self.crud.get_many)
         self.crud.get = self.get("/{uid}")(self.crud.get)
         self.crud.find = self.get("/")(self.crud.find)
-        self.crud.create = self.post("/")(self.crud.create)
-        self.crud.update = self.patch("/")(self.crud.update)
-        self.crud.replace = self.patch("/")(self.crud.replace)
+        self.crud.create = self.post(
+            "/", openapi_extra=self._bulk_openapi("create")
+        )(self.crud.create)
+        self.crud.update = self.patch(
+            "/", openapi_extra=self._bulk_openapi("update")
+        )(self.crud.update)
+        self.crud.replace = self.put(
+            "/", openapi_extra=self._bulk_openapi("replace")
+        )(self.crud.replace)
         self.crud.delete = self.delete("/")(self.crud.delete)
+        # Only run by applications without a lifespan, others call
+        # shutdown from theirs
+        self.add_event_handler("shutdown", self.shutdown)
+
+    def _bulk_openapi(self, kind: str) -> dict | None:
+        """Request body of a bulk route, which reads the raw body."""
+        if self.bulk_validator is None:
+            return None
+        return {
+            "requestBody": {
+                "required": True,
+                "content": {
+                    "application/json": {
+                        "schema": request_schema(self.model, kind)
+                    }
+                },
+            }
+        }
+
+    def shutdown(self):
+        """Stop the worker pools, to be called in the application
+        lifespan."""
+        if self.bulk_validator is not None:
+            self.bulk_validator.shutdown()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    async def reconcile_facets(self, interval: float | None = None):
+        """Recount the materialized facets, every ``interval`` seconds.
+
+        To be called in the application lifespan, as a background task
+        when ``interval`` is set. Facets are read from the counts once
+        reconciled.
+        """
+        if self.facet_counts is None:
+            return None
+        if interval is None:
+            return await self.facet_counts.reconcile(self.storage)
+        return await self.facet_counts.reconcile_periodically(
+            self.storage, interval
+        )
+
+    async def provision_indexes(self, dry_run: bool = False) -> dict | None:
+        """Apply the index plan, to be called in the application lifespan.
+
+        ``orderings`` declares the orderings clients commonly use, see
+        :func:`fastcrud.storage.indexes.derive_index_plan`.
+        """
+        ensure_indexes = getattr(self.storage, "ensure_indexes", None)
+        if ensure_indexes is None:
+            return None
+        return await ensure_indexes(self.index_plan, dry_run=dry_run)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Annotated
+from typing import Annotated, Literal
 
 from fastapi import Query
 
@@ -30,16 +30,48 @@ class CommonQueryParams:
         self.updated__lte = updated__lte
 
 
+def split_fields(fields: list[str] | None) -> list[str] | None:
+    """Fields of a list query parameter, repeated or comma separated."""
+    if not fields:
+        return None
+    return [
+        field.strip()
+        for value in fields
+        for field in value.split(",")
+        if field.strip()
+    ] or None
+
+
 async def get_common_parameters(
     limit: Annotated[int, Query(min=1, max=100)] = 10,
     offset: Annotated[int, Query(min=0)] = 0,
     ordering: Annotated[str | None, Query()] = None,
+    pagination: Annotated[Literal["offset", "cursor"], Query()] = "offset",
+    cursor: Annotated[str | None, Query()] = None,
+    fields: Annotated[list[str] | None, Query()] = None,
+    expand: Annotated[list[str] | None, Query()] = None,
+    count: Annotated[
+        Literal["exact", "estimated", "capped", "cached"] | None, Query()
+    ] = None,
 ) -> dict:
-    """Get common api parameters."""
+    """Get common api parameters.
+
+    ``cursor`` is the continuation token returned in the metadata of a
+    previous page, passing it implies ``pagination=cursor``. ``fields``
+    restricts the returned fields, ``_id`` is always returned, and
+    ``expand`` replaces the listed references by the related documents.
+    ``count`` selects how the total count is computed, see
+    :func:`fastcrud.storage.planner.plan_find`.
+    """
     return {
         "limit": limit,
         "offset": offset,
         "ordering": ordering,
+        "pagination": "cursor" if cursor else pagination,
+        "cursor": cursor,
+        "fields": split_fields(fields),
+        "expand": split_fields(expand),
+        "count": count,
     }
 
 
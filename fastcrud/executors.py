@@ -0,0 +1,77 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import daiquiri
+from fastapi.exceptions import HTTPException
+
+LOGGER = daiquiri.getLogger(__name__)
+
+
+def _timed_call(func: Callable, *args, **kwargs) -> tuple[float, Any]:
+    return time.monotonic(), func(*args, **kwargs)
+
+
+class BoundedExecutor:
+    """Run blocking functions in a bounded thread pool.
+
+    At most ``max_workers`` calls run at once and ``max_queue`` more
+    wait for a worker, further calls are rejected with a 503 so that a
+    saturated pool pushes back on clients instead of piling up work.
+    Storage calls must share the state of the storage, so there is no
+    process pool.
+    """
+
+    def __init__(self, max_workers: int = 8, max_queue: int = 64):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.in_flight = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "running": min(self.in_flight, self.max_workers),
+            "queued": max(self.in_flight - self.max_workers, 0),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "wait_time": self.wait_time,
+            "max_wait_time": self.max_wait_time,
+        }
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        if self.in_flight >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            LOGGER.warning("Executor saturated, rejecting %s", func)
+            raise HTTPException(
+                status_code=503,
+                detail="Too many pending requests, retry later",
+                headers={"Retry-After": "1"},
+            )
+
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        self.submitted += 1
+        submitted_at = time.monotonic()
+        try:
+            started_at, result = await loop.run_in_executor(
+                self.executor,
+                functools.partial(_timed_call, func, *args, **kwargs),
+            )
+        finally:
+            self.in_flight -= 1
+        wait_time = max(started_at - submitted_at, 0.0)
+        self.wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+        return result
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,54 @@
+import asyncio
+from typing import Any, Callable, Hashable
+
+import daiquiri
+
+from fastcrud.utils import run_async_or_sync
+
+LOGGER = daiquiri.getLogger(__name__)
+
+
+class SingleFlight:
+    """Coalesce identical concurrent calls into a single one.
+
+    While a call for a given key is in flight, other callers with the
+    same key await its result instead of issuing their own call.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "ratio": self.coalesced / self.calls if self.calls else 0.0,
+            "in_flight": len(self._in_flight),
+        }
+
+    async def do(
+        self, key: Hashable, func: Callable, *args, **kwargs
+    ) -> Any:
+        self.calls += 1
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            LOGGER.debug("Coalescing call '%s'", key)
+        else:
+            future = asyncio.ensure_future(
+                run_async_or_sync(func, *args, **kwargs)
+            )
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._forget(key, future))
+        # Shielded so a cancelled caller does not cancel the shared call
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        if not future.cancelled():
+            # Mark the exception as retrieved when every caller is gone
+            future.exception()
@@ -1,4 +1,6 @@
+import functools
 import json
+from typing import Any, Callable, Iterable
 
 import daiquiri
 
@@ -7,34 +9,63 @@ from fastcrud.utils import build_parameter, normalize_parameter
 LOGGER = daiquiri.getLogger(__name__)
 
 
-def process_lookup_items_stage(stages: list, item_fields: list[str]):
-    """Process lookup items stage."""
+def process_lookup_items_stage(
+    stages: list,
+    item_fields: list[str],
+    relations: dict[str, dict] | None = None,
+    prefix: str | None = None,
+):
+    """Process lookup items stage.
+
+    ``relations`` gives the collection and the projected fields of the
+    related documents, the collection defaults to the field name. The
+    related documents are stored in ``prefix.field``, in ``field``
+    without prefix.
+    """
     for field in item_fields:
-        stages.append(
-            {
-                "$lookup": {
-                    "from": field,
-                    "localField": field,
-                    "foreignField": "_id",
-                    "as": field,
-                }
-            },
-        )
+        relation = (relations or {}).get(field, {})
+        lookup = {
+            "from": relation.get("collection", field),
+            "localField": field,
+            "foreignField": "_id",
+            "as": f"{prefix}.{field}" if prefix else field,
+        }
+        if relation.get("fields"):
+            lookup["pipeline"] = [
+                {"$project": {name: 1 for name in relation["fields"]}}
+            ]
+        stages.append({"$lookup": lookup})
+
+
+def parse_ordering(ordering: str | None) -> dict[str, int]:
+    """Parse an ordering string such as ``name,-created``."""
+    ordering_dict: dict[str, int] = {}
+    for ordering_field in (ordering or "").split(","):
+        if not ordering_field:
+            continue
+        if ordering_field[0] == "-":
+            direction = -1
+            field = ordering_field[1:]
+        else:
+            direction = 1
+            field = ordering_field
+        ordering_dict[field] = direction
+    return ordering_dict
+
 
+def process_ordering_stage(
+    stages: list, ordering: str | None, tie_breaker: bool = False
+):
+    """Process ordering stage.
 
-def process_ordering_stage(stages: list, ordering: str | None):
-    """Process ordering stage."""
+    When ``tie_breaker`` is set, ``_id`` is appended to the sort keys so
+    the resulting order is total, as required by keyset pagination.
+    """
 
-    if ordering:
-        ordering_dict = {}
-        for ordering_field in ordering.split(","):
-            if ordering_field[0] == "-":
-                direction = -1
-                field = ordering_field[1:]
-            else:
-                direction = 1
-                field = ordering_field
-            ordering_dict[field] = direction
+    ordering_dict = parse_ordering(ordering)
+    if tie_breaker:
+        ordering_dict.setdefault("_id", 1)
+    if ordering_dict:
         sort_stage = {"$sort": ordering_dict}
         LOGGER.debug(
             "Adding the following sort stage '%s'", json.dumps(sort_stage)
@@ -42,12 +73,59 @@ def process_ordering_stage(stages: list, ordering: str | None):
         stages.append(sort_stage)
 
 
+def _after_condition(field: str, direction: int, value: Any) -> dict | None:
+    """Condition on the values of ``field`` sorted after ``value``.
+
+    Null and missing values sort before any other value, like MongoDB
+    sorts them, and are not matched by range operators. None when no
+    value sorts after ``value``.
+    """
+    if direction == 1:
+        if value is None:
+            return {field: {"$ne": None}}
+        return {field: {"$gt": value}}
+    if value is None:
+        return None
+    return {"$or": [{field: {"$lt": value}}, {field: None}]}
+
+
+def process_cursor_stage(
+    stages: list, ordering_dict: dict[str, int], values: list
+):
+    """Process cursor stage.
+
+    Translate the keyset ``values`` of the last document of the previous
+    page into a range ``$match`` on the ``ordering_dict`` fields, so the
+    next page starts where the previous one stopped and the sort index
+    can be used instead of skipping documents.
+    """
+
+    fields = list(ordering_dict)
+    if len(values) != len(fields):
+        raise ValueError("invalid cursor: does not match ordering")
+
+    conditions = []
+    for index, field in enumerate(fields):
+        after = _after_condition(field, ordering_dict[field], values[index])
+        if after is None:
+            continue
+        condition = dict(zip(fields[:index], values[:index]))
+        condition.update(after)
+        conditions.append(condition)
+
+    cursor_stage = {"$match": {"$or": conditions}}
+    LOGGER.debug("Adding the following cursor stage '%s'", cursor_stage)
+    stages.append(cursor_stage)
+
+
 def process_facet_stage(
     stages: list,
     facet_list_fields: list[str],
     facet_other_fields: list[str],
     limit: int,
     offset: int,
+    include_metadata: bool = True,
+    include_results: bool = True,
 ):
     """Process facet stage."""
 
@@ -60,24 +138,112 @@ def process_facet_stage(
 
         facet_stage[field].append({"$sortByCount": f"${field}"})
 
-    facet_stage["metadata"] = [{"$count": "count"}]
-    facet_stage["results"] = [{"$skip": offset}, {"$limit": limit}]
+    if include_metadata:
+        facet_stage["metadata"] = [{"$count": "count"}]
+    if include_results:
+        facet_stage["results"] = [{"$skip": offset}, {"$limit": limit}]
     stages.append({"$facet": facet_stage})
 
 
-def process_query_parameter_stage(match_stages: list, query_parameters: dict):
-    """Process query parameter stage."""
+def process_pagination_stage(stages: list, limit: int, offset: int = 0):
+    """Process pagination stage."""
 
-    for parameter, value in query_parameters.items():
-        if value is None:
+    if offset:
+        stages.append({"$skip": offset})
+    stages.append({"$limit": limit})
+
+
+def process_projection_stage(
+    stages: list, fields: list[str], required: list[str] | None = None
+) -> dict:
+    """Process projection stage.
+
+    ``required`` fields, e.g. the ordering fields needed to build the
+    next cursor, are projected too unless a parent path already is.
+    """
+
+    projection: dict = {}
+    for field in [*fields, *(required or [])]:
+        parts = field.split(".")
+        if field == "_id" or any(
+            ".".join(parts[:index]) in projection
+            for index in range(1, len(parts) + 1)
+        ):
             continue
+        projection[field] = 1
+    stages.append({"$project": projection})
+    return projection
+
+
+def process_count_stage(stages: list):
+    """Process count stage."""
+
+    stages.append({"$count": "count"})
+
 
-        parameter, operator = normalize_parameter(parameter)
+def compile_query_parameter(
+    parameter: str,
+    search: dict | None = None,
+    encode: Callable | None = None,
+) -> Callable[[Any], list[dict]]:
+    """Compile a query parameter into the builder of its match clauses.
 
+    The parameter is normalized once, the builder only turns values,
+    lists of values included, into their clauses.
+    """
+    field, operator = normalize_parameter(parameter)
+    build = functools.partial(
+        build_parameter,
+        field,
+        operator,
+        search=(search or {}).get(field),
+        encode=encode,
+    )
+
+    def builder(value: Any) -> list[dict]:
         if isinstance(value, list):
-            for list_value in value:
-                match_stages.append(
-                    build_parameter(parameter, operator, list_value)
-                )
-        else:
-            match_stages.append(build_parameter(parameter, operator, value))
+            return [build(list_value) for list_value in value]
+        return [build(value)]
+
+    return builder
+
+
+def compile_query_parameters(
+    parameters: Iterable[str],
+    search: dict | None = None,
+    encode: Callable | None = None,
+) -> dict[str, Callable[[Any], list[dict]]]:
+    """Compile the declared query parameters into their builders."""
+    return {
+        parameter: compile_query_parameter(parameter, search, encode)
+        for parameter in parameters
+    }
+
+
+def process_query_parameter_stage(
+    match_stages: list,
+    query_parameters: dict,
+    search: dict | None = None,
+    encode: Callable | None = None,
+    builders: dict[str, Callable] | None = None,
+):
+    """Process query parameter stage.
+
+    ``search`` maps fields to their substring search strategy, ``encode``
+    converts the values like the storage encodes documents. Parameters
+    precompiled in ``builders`` skip the normalization, the others are
+    compiled on the fly.
+    """
+
+    builders = builders or {}
+    for parameter, value in query_parameters.items():
+        if value is None:
+            continue
+
+        builder = builders.get(parameter)
+        if builder is None:
+            builder = compile_query_parameter(parameter, search, encode)
+        match_stages.extend(builder(value))
+    if sum("$text" in clause for clause in match_stages) > 1:
+        # MongoDB accepts a single $text expression per query
+        raise ValueError("only one text search is supported per query")
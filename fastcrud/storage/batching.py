@@ -0,0 +1,147 @@
+import asyncio
+from collections import Counter
+from typing import Awaitable, Callable
+
+import daiquiri
+from pymongo.errors import BulkWriteError
+
+LOGGER = daiquiri.getLogger(__name__)
+
+
+class WriteCoalescer:
+    """Merge concurrent inserts into shared ``insert_many`` calls.
+
+    Documents submitted by concurrent requests are buffered for up to
+    ``max_delay`` seconds or ``max_items`` documents, then flushed
+    together in writes of ``batch_size`` documents, in the order they
+    were submitted. ``ordered`` writes stop at the first error, so the
+    documents submitted after a failing one, by any request, are not
+    inserted. Each submitter gets back its own documents, or a
+    :class:`BulkWriteError` holding only the errors of its documents,
+    indexed relatively to what it submitted.
+    """
+
+    def __init__(
+        self,
+        insert_many: Callable[..., Awaitable],
+        max_items: int = 500,
+        max_delay: float = 0.005,
+        batch_size: int = 1000,
+        ordered: bool = False,
+    ):
+        self.insert_many = insert_many
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.ordered = ordered
+        self.histogram: Counter[int] = Counter()
+        self.counters: Counter[str] = Counter()
+        self._pending: list[tuple[list[dict], asyncio.Future]] = []
+        self._pending_items = 0
+        self._timer: asyncio.TimerHandle | None = None
+        self._flushes: set[asyncio.Task] = set()
+
+    @property
+    def stats(self) -> dict:
+        """Flush counters, and flushes by size bucketed by powers of two."""
+        flushes = self.counters["flushes"]
+        return {
+            "flushes": flushes,
+            "requests": self.counters["requests"],
+            "documents": self.counters["documents"],
+            "writes": self.counters["writes"],
+            "write_errors": self.counters["write_errors"],
+            "failed_flushes": self.counters["failed_flushes"],
+            "requests_per_flush": self.counters["requests"] / flushes
+            if flushes
+            else 0.0,
+            "pending": self._pending_items,
+            "batch_sizes": dict(sorted(self.histogram.items())),
+        }
+
+    async def submit(self, docs: list[dict]) -> list[dict]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((docs, future))
+        self._pending_items += len(docs)
+        if self._pending_items >= self.max_items:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self.flush)
+        return await future
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending, self._pending_items = self._pending, [], 0
+        task = asyncio.ensure_future(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _write(self, docs: list[dict]) -> tuple[dict[int, dict], int]:
+        """Insert ``docs`` batch by batch.
+
+        Returns the write errors by index in ``docs``, and the number
+        of documents the writes went through, all of them unless an
+        ordered write failed.
+        """
+        write_errors: dict[int, dict] = {}
+        for start in range(0, len(docs), self.batch_size):
+            self.counters["writes"] += 1
+            try:
+                await self.insert_many(
+                    docs[start : start + self.batch_size],
+                    ordered=self.ordered,
+                )
+            except BulkWriteError as err:
+                errors = err.details.get("writeErrors", [])
+                for error in errors:
+                    write_errors[start + error["index"]] = error
+                if self.ordered and errors:
+                    return write_errors, start + errors[0]["index"] + 1
+        return write_errors, len(docs)
+
+    async def _flush(self, batch: list[tuple[list[dict], asyncio.Future]]):
+        docs = [doc for request_docs, _ in batch for doc in request_docs]
+        size = len(docs)
+        self.histogram[1 << (size - 1).bit_length() if size else 0] += 1
+        self.counters.update(
+            flushes=1, requests=len(batch), documents=size
+        )
+        LOGGER.debug(
+            "Flushing %d documents from %d requests", size, len(batch)
+        )
+
+        try:
+            write_errors, attempted = await self._write(docs)
+        except Exception as err:
+            self.counters["failed_flushes"] += 1
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(err)
+            return
+        self.counters["write_errors"] += len(write_errors)
+
+        start = 0
+        for request_docs, future in batch:
+            end = start + len(request_docs)
+            errors = [
+                {**write_errors[index], "index": index - start}
+                for index in range(start, end)
+                if index in write_errors
+            ]
+            inserted = max(0, min(end, attempted) - start) - len(errors)
+            start = end
+            if future.done():
+                continue
+            if inserted < len(request_docs):
+                future.set_exception(
+                    BulkWriteError(
+                        {"writeErrors": errors, "nInserted": inserted}
+                    )
+                )
+            else:
+                future.set_result(request_docs)
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Hashable
+
+import daiquiri
+
+from fastcrud.storage.commun import BaseStorage
+from fastcrud.utils import run_async_or_sync
+
+LOGGER = daiquiri.getLogger(__name__)
+_MISSING = object()
+
+
+class LRUCache:
+    """Size bounded LRU cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = _MISSING) -> Any:
+        entry = self._data.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires >= time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else float("inf")
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class QueryCache:
+    """Cache of aggregation results keyed on the pipeline.
+
+    Each collection carries a generation counter which is part of every
+    key: bumping it on writes makes all the cached results of the
+    collection unreachable at once and they age out of the LRU. Page
+    and count results use ``page_ttl`` while facet counts, which move
+    slowly, use ``facets_ttl``.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        page_ttl: float | None = 5.0,
+        facets_ttl: float | None = 60.0,
+    ):
+        self.cache = LRUCache(maxsize=maxsize, ttl=page_ttl)
+        self.ttls = {"facets": facets_ttl}
+        self.generations: defaultdict[str, int] = defaultdict(int)
+
+    @property
+    def stats(self) -> dict:
+        return {**self.cache.stats, "generations": dict(self.generations)}
+
+    def bump(self, collection: str):
+        self.generations[collection] += 1
+
+    def key(self, collection: str, kind: str, stages: list[dict]) -> str:
+        payload = json.dumps(
+            [collection, self.generations[collection], kind, stages],
+            default=str,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def fetch(
+        self,
+        collection: str,
+        kind: str,
+        stages: list[dict],
+        loader: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        key = self.key(collection, kind, stages)
+        value = self.cache.get(key)
+        if value is _MISSING:
+            value = await loader()
+            self.cache.set(key, value, ttl=self.ttls.get(kind))
+        return value
+
+
+class CachedStorage(BaseStorage):
+    """Read-through cache in front of any :class:`BaseStorage`.
+
+    ``get`` results are kept in an :class:`LRUCache` and the entries of
+    the written uids are dropped on ``create``, ``update``, ``replace``
+    and ``delete``. Every other attribute is served by the wrapped
+    storage.
+    """
+
+    def __init__(
+        self,
+        storage: BaseStorage,
+        maxsize: int = 1024,
+        ttl: float | None = 60.0,
+        executor=None,
+        offload: bool = True,
+    ):
+        self.storage = storage
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.executor = executor
+        self.offload = offload
+
+    def __getattr__(self, name: str):
+        return getattr(self.storage, name)
+
+    @property
+    def stats(self) -> dict:
+        return self.cache.stats
+
+    async def get(
+        self,
+        uid: str,
+        fields: list[str] | None = None,
+        expand: list[str] | None = None,
+    ):
+        if fields or expand:
+            # Only whole items are cached
+            return await self._call(self.storage.get, uid, fields, expand)
+        item = self.cache.get(uid)
+        if item is _MISSING:
+            item = await self._call(self.storage.get, uid)
+            self.cache.set(uid, item)
+        return item
+
+    async def get_many(
+        self, uids: list[str], fields: list[str] | None = None
+    ) -> list:
+        if fields:
+            return await self._call(self.storage.get_many, uids, fields)
+        items = {uid: self.cache.get(uid) for uid in dict.fromkeys(uids)}
+        missing = [uid for uid, item in items.items() if item is _MISSING]
+        if missing:
+            fetched = await self._call(self.storage.get_many, missing)
+            for uid, item in zip(missing, fetched):
+                items[uid] = item
+                if item is not None:
+                    self.cache.set(uid, item)
+        return [items[uid] for uid in uids]
+
+    async def create(self, items):
+        results = await self._call(self.storage.create, items)
+        self._invalidate_items(items)
+        return results
+
+    async def update(self, items):
+        results = await self._call(self.storage.update, items)
+        self._invalidate_items(items)
+        return results
+
+    async def replace(self, items):
+        results = await self._call(self.storage.replace, items)
+        self._invalidate_items(items)
+        return results
+
+    async def delete(self, uids):
+        results = await self._call(self.storage.delete, uids)
+        for uid in uids:
+            self.cache.invalidate(uid)
+        return results
+
+    async def find(self, *args, **kwargs):
+        return await self._call(self.storage.find, *args, **kwargs)
+
+    def export(self, *args, **kwargs):
+        return self.storage.export(*args, **kwargs)
+
+    async def _call(self, func, *args, **kwargs):
+        return await run_async_or_sync(
+            func,
+            *args,
+            executor=self.executor,
+            offload=self.offload,
+            **kwargs,
+        )
+
+    def _invalidate_items(self, items):
+        for item in items:
+            uid = getattr(item, "id", None)
+            if uid is not None:
+                self.cache.invalidate(uid)
@@ -0,0 +1,122 @@
+from contextlib import asynccontextmanager
+from typing import Hashable
+
+import daiquiri
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+LOGGER = daiquiri.getLogger(__name__)
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool listener keeping utilization counters."""
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.check_out_failures = 0
+        self.cleared = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "open": self.open,
+            "checked_out": self.checked_out,
+            "idle": self.open - self.checked_out,
+            "check_out_failures": self.check_out_failures,
+            "cleared": self.cleared,
+        }
+
+    def pool_created(self, event):
+        ...
+
+    def pool_ready(self, event):
+        ...
+
+    def pool_cleared(self, event):
+        self.cleared += 1
+
+    def pool_closed(self, event):
+        ...
+
+    def connection_created(self, event):
+        self.open += 1
+
+    def connection_ready(self, event):
+        ...
+
+    def connection_closed(self, event):
+        self.open -= 1
+
+    def connection_check_out_started(self, event):
+        ...
+
+    def connection_check_out_failed(self, event):
+        self.check_out_failures += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+
+class MongoClientRegistry:
+    """Share Motor clients, and thus connection pools, across routers.
+
+    Clients are keyed by URL and pool options (``maxPoolSize``,
+    ``minPoolSize``, timeouts...) and created with ``connect=False``, so
+    no connection is opened until :meth:`startup` runs in the application
+    lifespan. :meth:`shutdown` closes every pool.
+    """
+
+    def __init__(self):
+        self._clients: dict[Hashable, AsyncIOMotorClient] = {}
+        self._stats: dict[Hashable, PoolStats] = {}
+
+    @staticmethod
+    def key(url: str, **options) -> Hashable:
+        return url, tuple(sorted(options.items()))
+
+    def get(self, url: str, **options) -> AsyncIOMotorClient:
+        key = self.key(url, **options)
+        if key not in self._clients:
+            LOGGER.debug("Creating MongoDB client with options %s", options)
+            self._stats[key] = PoolStats()
+            self._clients[key] = AsyncIOMotorClient(
+                url,
+                connect=False,
+                event_listeners=[self._stats[key]],
+                **options,
+            )
+        return self._clients[key]
+
+    def stats(self) -> list[dict]:
+        return [
+            {
+                "nodes": sorted(client.nodes),
+                "options": dict(key[1]),
+                "pool": self._stats[key].as_dict(),
+            }
+            for key, client in self._clients.items()
+        ]
+
+    async def startup(self):
+        """Open the pools and check the servers are reachable."""
+        for client in self._clients.values():
+            await client.admin.command("ping")
+
+    async def shutdown(self):
+        """Close the pools, a client used again reconnects on demand."""
+        for client in self._clients.values():
+            client.close()
+
+    @asynccontextmanager
+    async def lifespan(self, *args):
+        await self.startup()
+        try:
+            yield
+        finally:
+            await self.shutdown()
+
+
+MONGODB_CLIENTS = MongoClientRegistry()
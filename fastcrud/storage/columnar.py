@@ -0,0 +1,301 @@
+from datetime import datetime
+from typing import Any
+
+import daiquiri
+
+from fastcrud.storage.memory import (
+    RANGE_OPERATORS,
+    MemoryStorage,
+    hash_key,
+    match_condition,
+    match_document,
+)
+from fastcrud.utils import get_field_value
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+LOGGER = daiquiri.getLogger(__name__)
+NUMPY_OPERATORS = {
+    "$gt": "greater",
+    "$gte": "greater_equal",
+    "$lt": "less",
+    "$lte": "less_equal",
+}
+
+
+class Column:
+    """Values of one field for every row of the snapshot."""
+
+    dtype: Any = None
+    missing: Any = None
+
+    def __init__(self, field: str, capacity: int):
+        self.field = field
+        self.values = np.full(capacity, self.missing, dtype=self.dtype)
+
+    def grow(self, capacity: int):
+        values = np.full(capacity, self.missing, dtype=self.dtype)
+        values[: len(self.values)] = self.values
+        self.values = values
+
+    def set(self, row: int, doc: dict):
+        value = get_field_value(doc, self.field)
+        try:
+            self.values[row] = self.encode(value)
+        except (TypeError, ValueError):
+            LOGGER.warning("Cannot store %r in column %s", value, self.field)
+            self.values[row] = self.missing
+
+    def encode(self, value: Any) -> Any:
+        return self.missing if value is None else value
+
+    def mask(self, condition: Any, size: int):
+        """Boolean mask of the rows matching ``condition``, if supported."""
+        values = self.values[:size]
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        mask = np.ones(size, dtype=bool)
+        for operator, operand in condition.items():
+            try:
+                if isinstance(operand, list):
+                    operand = [self.encode(item) for item in operand]
+                else:
+                    operand = self.encode(operand)
+            except (TypeError, ValueError):
+                return None
+            if operator in RANGE_OPERATORS:
+                compare = getattr(np, NUMPY_OPERATORS[operator])
+                mask &= compare(values, operand)
+            elif operator == "$eq":
+                mask &= values == operand
+            elif operator == "$ne":
+                mask &= values != operand
+            elif operator == "$in":
+                mask &= np.isin(values, operand)
+            elif operator == "$nin":
+                mask &= ~np.isin(values, operand)
+            else:
+                return None
+        return mask
+
+
+class NumericColumn(Column):
+    dtype = np.float64 if np else None
+    missing = np.nan if np else None
+
+    def encode(self, value: Any) -> Any:
+        if value is None:
+            return self.missing
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise TypeError(f"{value!r} is not a number")
+        return value
+
+
+class DatetimeColumn(Column):
+    dtype = "datetime64[us]"
+    missing = "NaT"
+
+    def encode(self, value: Any) -> Any:
+        if value is None:
+            return np.datetime64(self.missing)
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if not isinstance(value, datetime):
+            raise TypeError(f"{value!r} is not a datetime")
+        if value.tzinfo is not None:
+            value = value.replace(tzinfo=None) - value.utcoffset()
+        return np.datetime64(value, "us")
+
+
+class CategoricalColumn(Column):
+    """Dictionary encoded column, code 0 stands for missing values."""
+
+    dtype = np.int32 if np else None
+    missing = 0
+
+    def __init__(self, field: str, capacity: int):
+        super().__init__(field, capacity)
+        self.categories: list[Any] = [None]
+        self.codes: dict[Any, int] = {hash_key(None): 0}
+
+    def encode(self, value: Any) -> int:
+        key = hash_key(value)
+        if key not in self.codes:
+            self.codes[key] = len(self.categories)
+            self.categories.append(value)
+        return self.codes[key]
+
+    def mask(self, condition: Any, size: int):
+        # Evaluate the condition once per category, then map the codes
+        matches = np.fromiter(
+            (
+                match_condition(category, condition)
+                for category in self.categories
+            ),
+            dtype=bool,
+            count=len(self.categories),
+        )
+        return matches[self.values[:size]]
+
+    def facet(self, mask) -> list[dict]:
+        counts = np.bincount(
+            self.values[: len(mask)][mask], minlength=len(self.categories)
+        )
+        return [
+            {"_id": self.categories[code], "count": int(counts[code])}
+            for code in np.argsort(-counts, kind="stable")
+            if counts[code]
+        ]
+
+
+class ColumnarStorage(MemoryStorage):
+    """In memory storage answering filters and facets from NumPy arrays.
+
+    Besides the documents, a columnar snapshot keeps the ``categorical``
+    fields dictionary encoded, the ``numeric`` fields as ``float64`` and
+    the ``datetimes`` fields, ``created`` and ``updated`` by default, as
+    ``datetime64``. Conditions on these fields are evaluated as
+    vectorized boolean masks and facets on categorical fields are
+    counted with ``bincount``. Other conditions fall back to
+    :class:`MemoryStorage`. Writes update the snapshot incrementally:
+    rows are appended and deleted rows are tombstoned until the next
+    compaction.
+    """
+
+    def __init__(
+        self,
+        db: Any,
+        model,
+        collection: str | None = None,
+        categorical: list[str] | None = None,
+        numeric: list[str] | None = None,
+        datetimes: list[str] | None = None,
+        capacity: int = 1024,
+        **kwargs,
+    ):
+        if np is None:
+            raise ImportError(
+                "ColumnarStorage requires numpy, install fastcrud[columnar]"
+            )
+        self.capacity = capacity
+        self.size = 0
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.row_ids: list[str] = []
+        self.rows: dict[str, int] = {}
+        self.columns: dict[str, Column] = {}
+        for fields, column_cls in (
+            (categorical or [], CategoricalColumn),
+            (numeric or [], NumericColumn),
+            (
+                ["created", "updated"] if datetimes is None else datetimes,
+                DatetimeColumn,
+            ),
+        ):
+            for field in fields:
+                self.columns[field] = column_cls(field, capacity)
+        super().__init__(db, model, collection, **kwargs)
+
+    def _insert(self, doc: dict):
+        super()._insert(doc)
+        if self.size == self.capacity:
+            self._grow(self.capacity * 2)
+        row = self.size
+        self.size += 1
+        self.alive[row] = True
+        self.row_ids.append(doc["_id"])
+        self.rows[doc["_id"]] = row
+        for column in self.columns.values():
+            column.set(row, doc)
+
+    def _remove(self, uid: str) -> dict | None:
+        doc = super()._remove(uid)
+        row = self.rows.pop(uid, None)
+        if row is not None:
+            self.alive[row] = False
+            if self.size - len(self.rows) > max(len(self.rows), 1024):
+                self.rebuild()
+        return doc
+
+    def _grow(self, capacity: int):
+        alive = np.zeros(capacity, dtype=bool)
+        alive[: self.size] = self.alive[: self.size]
+        self.alive = alive
+        for column in self.columns.values():
+            column.grow(capacity)
+        self.capacity = capacity
+
+    def rebuild(self):
+        """Rebuild the snapshot from the documents, dropping tombstones."""
+        LOGGER.debug("Rebuilding the %s snapshot", self.collection)
+        self.size = 0
+        self.row_ids = []
+        self.rows = {}
+        self.alive[:] = False
+        for field, column in self.columns.items():
+            self.columns[field] = type(column)(field, self.capacity)
+        for row, doc in enumerate(self.docs.values()):
+            self.size += 1
+            self.alive[row] = True
+            self.row_ids.append(doc["_id"])
+            self.rows[doc["_id"]] = row
+            for column in self.columns.values():
+                column.set(row, doc)
+
+    def _mask(self, query: dict):
+        """Mask of the rows matching the vectorizable part of ``query``.
+
+        Returns the mask and the conditions left to evaluate per document.
+        """
+        mask = self.alive[: self.size].copy()
+        residual = []
+        for condition in query.get("$and", [query] if query else []):
+            for field, field_condition in condition.items():
+                column = self.columns.get(field)
+                field_mask = (
+                    column.mask(field_condition, self.size)
+                    if column is not None
+                    else None
+                )
+                if field_mask is None:
+                    residual.append({field: field_condition})
+                else:
+                    mask &= field_mask
+        return mask, residual
+
+    def _match(self, query: dict, docs: list[dict] | None) -> list[dict]:
+        if docs is not None:
+            return super()._match(query, docs)
+        mask, residual = self._mask(query)
+        docs = [self.docs[self.row_ids[row]] for row in np.flatnonzero(mask)]
+        if residual:
+            query = {"$and": residual}
+            docs = [doc for doc in docs if match_document(doc, query)]
+        return docs
+
+    async def find(
+        self, common, common_match, filters, facets, *args, **kwargs
+    ):
+        plan = self.plan(common, common_match, filters, facets)
+        mask, residual = self._mask(
+            plan.match[0]["$match"] if plan.match else {}
+        )
+        if residual or not all(
+            isinstance(self.columns.get(field), CategoricalColumn)
+            for field in facets
+        ):
+            return await super().find(
+                common, common_match, filters, facets, *args, **kwargs
+            )
+
+        results, next_cursor = plan.paginate(self.aggregate(plan.page))
+        return {
+            **{field: self.columns[field].facet(mask) for field in facets},
+            "metadata": {
+                **plan.count_metadata(int(mask.sum())),
+                "next": next_cursor,
+            },
+            "results": [dict(doc) for doc in results],
+        }
@@ -1,7 +1,20 @@
 import abc
+import inspect
+import json
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import HTTPException
+
+from fastcrud.storage.aggregation import compile_query_parameters
+from fastcrud.utils import create_partial_model
 
 
 class BaseStorage(abc.ABC):
+    # Match builders of the declared query parameters
+    query_builders: dict | None = None
+    # Build the returned items without validating the documents
+    trusted_documents: bool = False
+
     @abc.abstractmethod
     def __init__(self, *args, **kwargs):
         ...
@@ -29,3 +42,82 @@ class BaseStorage(abc.ABC):
     @abc.abstractmethod
     def find(self, *args, **kwargs):
         ...
+
+    async def get_many(
+        self, uids: list[str], fields: list[str] | None = None
+    ) -> list:
+        """Items of ``uids`` in the same order, None for missing ones.
+
+        Calls ``get`` once per distinct uid and projects the items on
+        ``fields``, storages override it with a batched read. A
+        synchronous ``get`` runs on the loop thread.
+        """
+        model = self.result_model(fields) if fields else None
+        found = {}
+        for uid in dict.fromkeys(uids):
+            try:
+                item = self.get(uid)
+                if inspect.isawaitable(item):
+                    item = await item
+            except HTTPException as err:
+                if err.status_code != 404:
+                    raise
+                continue
+            if model is not None:
+                item = model(**jsonable_encoder(item))
+            found[uid] = item
+        return [found.get(uid) for uid in uids]
+
+    async def export(
+        self,
+        common_match,
+        filters,
+        ordering: str | None = None,
+        batch_size: int = 1000,
+    ):
+        """NDJSON lines of the matching documents, batch by batch.
+
+        Walks ``find`` pages with offset pagination, storages override
+        it with a single pass over the result set. A synchronous
+        ``find`` runs on the loop thread.
+        """
+        common = {
+            "limit": batch_size,
+            "offset": 0,
+            "ordering": ordering,
+            "pagination": "offset",
+            "cursor": None,
+            "fields": None,
+            "expand": None,
+            "count": None,
+        }
+        while True:
+            page = self.find(common, common_match, filters, [])
+            if inspect.isawaitable(page):
+                page = await page
+            for result in page["results"]:
+                yield json.dumps(jsonable_encoder(result)) + "\n"
+            if len(page["results"]) < batch_size:
+                break
+            common["offset"] += batch_size
+
+    def compile_filters(self, parameters: list[str]):
+        """Precompile the match builders of the declared query parameters."""
+        self.query_builders = compile_query_parameters(parameters)
+
+    def build_item(self, model, doc: dict):
+        """Item of a stored document, constructed when it is trusted."""
+        if self.trusted_documents:
+            return model.model_construct(**doc)
+        return model(**doc)
+
+    def result_model(self, fields: list[str] | None = None):
+        """Model of the documents returned with a ``fields`` projection."""
+        if not fields:
+            return self.db_model
+        try:
+            return create_partial_model(
+                self.model, tuple(sorted(set(fields)))
+            )
+        except ValueError as err:
+            raise HTTPException(status_code=400, detail=str(err))
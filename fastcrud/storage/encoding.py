@@ -0,0 +1,152 @@
+import enum
+import uuid
+from datetime import date, datetime, time
+from typing import Any
+
+import daiquiri
+import pydantic
+from bson import Binary
+from fastapi.encoders import jsonable_encoder
+from pymongo import UpdateOne
+
+from fastcrud.utils import datetime_to_iso8601_with_z_suffix
+
+LOGGER = daiquiri.getLogger(__name__)
+NATIVE_TYPES = (str, bool, int, float, bytes, type(None))
+
+
+class ValueEncoder:
+    """Encode documents and filter values as their JSON representation.
+
+    Datetimes are stored as ISO 8601 strings, this is the historical
+    format, understood by every storage.
+    """
+
+    name = "json"
+
+    def dump(self, item: pydantic.BaseModel, **kwargs) -> dict:
+        """Document stored for ``item``, ``kwargs`` go to model_dump."""
+        return item.model_dump(mode="json", **kwargs)
+
+    def document(self, doc: dict) -> dict:
+        return jsonable_encoder(doc)
+
+    def value(self, value: Any) -> Any:
+        """Filter value comparable with the stored documents."""
+        if isinstance(value, datetime):
+            return datetime_to_iso8601_with_z_suffix(value)
+        return value
+
+
+class BSONEncoder(ValueEncoder):
+    """Encode documents and filter values as native BSON values.
+
+    Datetimes are stored as BSON dates, naive datetimes being UTC, dates
+    as midnight datetimes, UUIDs as standard binary UUIDs and enums as
+    their value. Range filters on dates then compare dates, with smaller
+    index keys than strings. Other types fall back to JSON.
+    """
+
+    name = "bson"
+
+    def dump(self, item: pydantic.BaseModel, **kwargs) -> dict:
+        return self.document(item.model_dump(**kwargs))
+
+    def document(self, doc: dict) -> dict:
+        return self.value(doc)
+
+    def value(self, value: Any) -> Any:
+        if isinstance(value, NATIVE_TYPES + (datetime,)):
+            return value
+        if isinstance(value, enum.Enum):
+            return self.value(value.value)
+        if isinstance(value, date):
+            return datetime.combine(value, time())
+        if isinstance(value, uuid.UUID):
+            return Binary.from_uuid(value)
+        if isinstance(value, dict):
+            return {key: self.value(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return [self.value(item) for item in value]
+        if isinstance(value, pydantic.BaseModel):
+            return self.dump(value)
+        return jsonable_encoder(value)
+
+
+ENCODERS = {
+    encoder.name: encoder for encoder in (ValueEncoder(), BSONEncoder())
+}
+
+
+def get_encoder(encoding: str) -> ValueEncoder:
+    try:
+        return ENCODERS[encoding]
+    except KeyError:
+        raise ValueError(f"Unknown encoding {encoding!r}") from None
+
+
+def datetime_fields(model: type[pydantic.BaseModel]) -> list[str]:
+    """Top level fields of ``model`` annotated as datetimes."""
+    return [
+        name
+        for name, field in model.model_fields.items()
+        if field.annotation in (datetime, datetime | None)
+    ]
+
+
+def parse_datetime(value: str) -> datetime | None:
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+async def migrate_string_dates(
+    collection,
+    fields: list[str],
+    batch_size: int = 1000,
+    dry_run: bool = False,
+) -> dict:
+    """Convert the ISO 8601 strings of ``fields`` into BSON dates.
+
+    Only the documents holding a string in one of the fields are read,
+    and they are rewritten with batched ``bulk_write`` calls touching
+    the converted fields only, so the migration can be interrupted and
+    resumed. Strings which are not dates are left untouched and
+    counted as skipped.
+    """
+    query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    projection = {field: True for field in fields}
+    report = {"matched": 0, "converted": 0, "skipped": 0, "modified": 0}
+    operations: list[UpdateOne] = []
+
+    async def flush():
+        if operations and not dry_run:
+            result = await collection.bulk_write(operations, ordered=False)
+            report["modified"] += result.modified_count
+        operations.clear()
+
+    cursor = collection.find(query, projection, batch_size=batch_size)
+    async for doc in cursor:
+        report["matched"] += 1
+        changes = {}
+        for field in fields:
+            value = doc.get(field)
+            if not isinstance(value, str):
+                continue
+            parsed = parse_datetime(value)
+            if parsed is None:
+                report["skipped"] += 1
+            else:
+                changes[field] = parsed
+        if changes:
+            report["converted"] += 1
+            operations.append(
+                UpdateOne({"_id": doc["_id"]}, {"$set": changes})
+            )
+        if len(operations) >= batch_size:
+            await flush()
+    await flush()
+
+    LOGGER.info("Migrated string dates of %s: %s", collection.name, report)
+    return report
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import Any, Hashable
+
+import daiquiri
+
+from fastcrud.storage.memory import hash_key
+from fastcrud.utils import (
+    get_field_value,
+    normalize_parameter,
+    normalize_value,
+)
+
+LOGGER = daiquiri.getLogger(__name__)
+
+
+class MaterializedFacets:
+    """Facet counts of a collection, maintained on every write.
+
+    Counts are kept for the unfiltered collection and, for each of the
+    ``partitions`` fields, for every value of the field, so ``find``
+    calls without filters or with a single equality filter on a
+    partition field read their facets in O(distinct values).
+
+    Writes are applied incrementally from the documents before and
+    after them. Writes made by other processes, or racing between the
+    reads and the write, are only caught up by :meth:`reconcile`, which
+    recounts the whole collection and is meant to run periodically.
+    Until the first reconciliation no count is served.
+    """
+
+    def __init__(
+        self, fields: list[str], partitions: list[str] | None = None
+    ):
+        self.fields = fields
+        self.partitions = partitions or []
+        self.slices: dict[tuple, dict[str, Counter]] = {}
+        self.values: dict[Hashable, Any] = {}
+        self.reconciled_at: float | None = None
+
+    @property
+    def stored_fields(self) -> list[str]:
+        """Top-level fields read to count a document."""
+        return sorted(
+            {field.split(".")[0] for field in self.fields + self.partitions}
+        )
+
+    def _slice_keys(self, doc: dict) -> list[tuple]:
+        keys: list[tuple] = [()]
+        for field in self.partitions:
+            value = get_field_value(doc, field)
+            if value is not None and not isinstance(value, (dict, list)):
+                keys.append((field, hash_key(value)))
+        return keys
+
+    def _count(self, doc: dict, delta: int):
+        for key in self._slice_keys(doc):
+            counters = self.slices.setdefault(
+                key, {field: Counter() for field in self.fields}
+            )
+            for field in self.fields:
+                # Values are grouped whole, list fields included, like
+                # the $sortByCount of the facet pipelines
+                value = get_field_value(doc, field)
+                value_key = hash_key(value)
+                self.values.setdefault(value_key, value)
+                counters[field][value_key] += delta
+                if counters[field][value_key] <= 0:
+                    del counters[field][value_key]
+
+    def apply(self, before: list[dict | None], after: list[dict | None]):
+        """Apply a write, given the written documents before and after."""
+        for doc in before:
+            if doc is not None:
+                self._count(doc, -1)
+        for doc in after:
+            if doc is not None:
+                self._count(doc, 1)
+
+    def slice_key(self, query_parameters: dict) -> tuple | None:
+        """Key of the slice matching the filters, if materialized."""
+        conditions = {
+            parameter: value
+            for parameter, value in query_parameters.items()
+            if value is not None
+        }
+        if not conditions:
+            return ()
+        if len(conditions) != 1:
+            return None
+        ((parameter, value),) = conditions.items()
+        field, operator = normalize_parameter(parameter)
+        if (
+            operator is not None
+            or field not in self.partitions
+            or isinstance(value, list)
+        ):
+            return None
+        return (field, hash_key(normalize_value(value, None)))
+
+    def lookup(
+        self, query_parameters: dict, facets: list[str]
+    ) -> dict | None:
+        """Facets of the matching slice, None when not materialized."""
+        if self.reconciled_at is None:
+            return None
+        if not set(facets) <= set(self.fields):
+            return None
+        key = self.slice_key(query_parameters)
+        if key is None:
+            return None
+        counters = self.slices.get(key, {})
+        return {
+            field: [
+                {"_id": self.values[value], "count": count}
+                for value, count in counters.get(
+                    field, Counter()
+                ).most_common()
+            ]
+            for field in facets
+        }
+
+    async def reconcile(self, storage) -> dict:
+        """Recount every document of ``storage``, read with ``export``."""
+        started = time.monotonic()
+        current = MaterializedFacets(self.fields, self.partitions)
+        async for line in storage.export({}, {}):
+            current._count(json.loads(line), 1)
+        drift = sum(
+            1
+            for key in self.slices.keys() | current.slices.keys()
+            if self.slices.get(key) != current.slices.get(key)
+        )
+        self.slices, self.values = current.slices, current.values
+        self.reconciled_at = time.time()
+        report = {
+            "slices": len(self.slices),
+            "drifted_slices": drift,
+            "duration": time.monotonic() - started,
+        }
+        LOGGER.info("Reconciled facet counts: %s", report)
+        return report
+
+    async def reconcile_periodically(self, storage, interval: float = 300.0):
+        """Reconcile every ``interval`` seconds, until cancelled."""
+        while True:
+            try:
+                await self.reconcile(storage)
+            except Exception:
+                LOGGER.exception("Failed to reconcile facet counts")
+            await asyncio.sleep(interval)
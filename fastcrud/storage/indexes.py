@@ -0,0 +1,169 @@
+import inspect
+from typing import Callable
+
+import daiquiri
+from pymongo import ASCENDING, TEXT, IndexModel
+
+from fastcrud.storage.aggregation import parse_ordering
+from fastcrud.utils import (
+    FILTER_CONTAINS_OPERATORS,
+    SEARCH_STRATEGIES,
+    ngrams_field,
+    normalize_parameter,
+)
+
+LOGGER = daiquiri.getLogger(__name__)
+COMMON_MATCH_FIELDS = ["created", "updated"]
+EQUALITY_OPERATORS = {None, "$in", "$nin"}
+
+
+def filter_parameters(filters: Callable | None) -> list[str]:
+    """Names of the query parameters declared by a filters dependency."""
+    if filters is None:
+        return []
+    return list(inspect.signature(filters).parameters)
+
+
+def index_name(keys: list[tuple[str, int | str]]) -> str:
+    return "fastcrud_" + "_".join(f"{field}_{kind}" for field, kind in keys)
+
+
+def _flipped(keys: list[tuple[str, int | str]]) -> list:
+    return [(field, -kind) for field, kind in keys]
+
+
+def _is_prefix(keys: list, other: list) -> bool:
+    """Whether the ``keys`` index is served by the ``other`` index.
+
+    An index can be walked backwards, so a prefix with every direction
+    flipped is served too.
+    """
+    if TEXT in dict(keys).values() or TEXT in dict(other).values():
+        return False
+    prefix = other[: len(keys)]
+    return len(keys) < len(other) and keys in (prefix, _flipped(prefix))
+
+
+def key_pattern(keys) -> tuple:
+    """Comparable key pattern of planned or existing index keys.
+
+    Text indexes are stored with ``_fts``/``_ftsx`` keys and the indexed
+    fields as weights, ``weights`` gives the fields of existing ones.
+    """
+    keys = list(keys.items() if isinstance(keys, dict) else keys)
+    if any(kind == TEXT for _, kind in keys):
+        return ("$text", tuple(sorted(field for field, _ in keys)))
+    return tuple((field, kind) for field, kind in keys)
+
+
+def _prune(plans: list[list]) -> list[list]:
+    """Leave out the indexes which are a prefix of another one."""
+    return [
+        keys
+        for keys in plans
+        if not any(_is_prefix(keys, other) for other in plans)
+    ]
+
+
+def derive_index_plan(
+    filters: Callable | None,
+    orderings: list[str] | None = None,
+    search: dict[str, str] | None = None,
+    fields: list[str] | None = None,
+    max_indexes: int = 16,
+) -> list[IndexModel]:
+    """Derive the indexes serving the declared filters and orderings.
+
+    * one single field index per filtered field, ``created`` and
+      ``updated`` included,
+    * one compound index per ordering, ending with ``_id`` so keyset
+      pagination is served too, and one per equality filter and
+      ordering pair, equality keys first,
+    * for ``contains``/``icontains`` fields, depending on their
+      ``search`` strategy: one text index over the ``text`` fields, a
+      multikey index on the n-grams of the ``ngram`` fields, a single
+      field index otherwise.
+
+    ``fields`` restricts the filtered fields worth an index, e.g. to
+    leave out free text fields only matched occasionally, ``created``,
+    ``updated`` and the ``search`` fields are always indexed.
+
+    Indexes which are a prefix of another planned index are left out,
+    the longer index serves their queries. At most ``max_indexes`` are
+    planned, the equality and ordering pairs of the last orderings are
+    dropped first, then the last planned indexes, with a warning. A
+    warning is logged for the ``text`` fields too, which share their
+    index, see :func:`fastcrud.utils.build_search_parameter`.
+    """
+    search = search or {}
+    for field, strategy in search.items():
+        if strategy not in SEARCH_STRATEGIES:
+            raise ValueError(f"Unknown search strategy {strategy!r}")
+    indexed: dict[str, bool] = {
+        field: False for field in COMMON_MATCH_FIELDS
+    }
+    text_fields: list[str] = []
+    for parameter in filter_parameters(filters):
+        field, operator = normalize_parameter(parameter)
+        if operator in FILTER_CONTAINS_OPERATORS:
+            strategy = search.get(field, "regex")
+            if strategy == "text":
+                if field not in text_fields:
+                    text_fields.append(field)
+                continue
+            if strategy == "ngram":
+                indexed.setdefault(ngrams_field(field), False)
+                continue
+        if fields is not None and field not in fields:
+            continue
+        if operator in FILTER_CONTAINS_OPERATORS:
+            indexed.setdefault(field, False)
+            continue
+        indexed[field] = indexed.get(field, False) or (
+            operator in EQUALITY_OPERATORS
+        )
+
+    plans: list[list[tuple[str, int | str]]] = [
+        [(field, ASCENDING)] for field in indexed
+    ]
+    # Equality and ordering pairs, dropped first past max_indexes
+    pairs: list[list[tuple[str, int | str]]] = []
+    for ordering in orderings or []:
+        sort = parse_ordering(ordering)
+        sort.setdefault("_id", ASCENDING)
+        plans.append(list(sort.items()))
+        for field, equality in indexed.items():
+            if equality and field not in sort:
+                pairs.append([(field, ASCENDING), *sort.items()])
+                plans.append(pairs[-1])
+
+    limit = max_indexes - bool(text_fields)
+    planned = _prune(plans)
+    dropped = 0
+    while len(planned) > limit and pairs:
+        plans.remove(pairs.pop())
+        planned = _prune(plans)
+        dropped += 1
+    if len(planned) > limit:
+        dropped += len(planned) - max(limit, 0)
+        planned = planned[: max(limit, 0)]
+    if dropped:
+        LOGGER.warning(
+            "Left %d indexes out of the plan, over max_indexes=%d",
+            dropped,
+            max_indexes,
+        )
+
+    indexes: dict[str, IndexModel] = {}
+    if text_fields:
+        LOGGER.warning(
+            "The text search strategy of %s matches whole words in any "
+            "of the text indexed fields, case insensitively, whatever "
+            "the filtered field and operator",
+            ", ".join(text_fields),
+        )
+        planned.append([(field, TEXT) for field in text_fields])
+    for keys in planned:
+        name = index_name(keys)
+        indexes.setdefault(name, IndexModel(keys, name=name))
+    return list(indexes.values())
@@ -0,0 +1,491 @@
+import asyncio
+import bisect
+import json
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+from operator import itemgetter
+from typing import Any, Iterable
+
+import daiquiri
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import HTTPException
+
+from fastcrud.storage.commun import BaseStorage
+from fastcrud.storage.planner import FindPlan, plan_find
+from fastcrud.utils import (
+    create_document,
+    create_in_db_model,
+    get_field_value,
+    project_document,
+)
+
+LOGGER = daiquiri.getLogger(__name__)
+RANGE_OPERATORS = {"$gt", "$gte", "$lt", "$lte"}
+
+
+def sort_key(value: Any) -> tuple:
+    """Key ordering values of any type, types grouped like BSON does."""
+    if value is None:
+        return (0,)
+    if isinstance(value, bool):
+        return (5, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (6, value.timestamp())
+    return (3, json.dumps(value, sort_keys=True, default=str))
+
+
+def hash_key(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True, default=str)
+    return value
+
+
+def _compare(value: Any, operator: str, operand: Any) -> bool:
+    if operator in RANGE_OPERATORS:
+        value_key, operand_key = sort_key(value), sort_key(operand)
+        if value is None or value_key[0] != operand_key[0]:
+            return False
+        if operator == "$gt":
+            return value_key > operand_key
+        if operator == "$gte":
+            return value_key >= operand_key
+        if operator == "$lt":
+            return value_key < operand_key
+        return value_key <= operand_key
+    if operator == "$in":
+        return any(_compare(value, "$eq", item) for item in operand)
+    if operator == "$eq":
+        if isinstance(value, list) and not isinstance(operand, list):
+            return operand in value
+        return value == operand
+    raise ValueError(f"unsupported operator: {operator}")
+
+
+def match_condition(value: Any, condition: Any) -> bool:
+    """Match a field ``value`` against a MongoDB field condition."""
+    if not isinstance(condition, dict):
+        return _compare(value, "$eq", condition)
+
+    for operator, operand in condition.items():
+        if operator == "$options":
+            continue
+        if operator == "$regex":
+            options = condition.get("$options", "")
+            flags = re.IGNORECASE if "i" in options else 0
+            values = value if isinstance(value, list) else [value]
+            if not any(
+                isinstance(item, str) and re.search(operand, item, flags)
+                for item in values
+            ):
+                return False
+        elif operator == "$ne":
+            if _compare(value, "$eq", operand):
+                return False
+        elif operator == "$nin":
+            if _compare(value, "$in", operand):
+                return False
+        elif operator == "$exists":
+            if (value is not None) != bool(operand):
+                return False
+        elif isinstance(value, list) and operator != "$in":
+            if not any(_compare(item, operator, operand) for item in value):
+                return False
+        elif not _compare(value, operator, operand):
+            return False
+    return True
+
+
+def match_document(doc: dict, query: dict) -> bool:
+    """Match a document against a MongoDB ``$match`` query."""
+    for field, condition in query.items():
+        if field == "$and":
+            if not all(match_document(doc, sub) for sub in condition):
+                return False
+        elif field == "$or":
+            if not any(match_document(doc, sub) for sub in condition):
+                return False
+        elif not match_condition(get_field_value(doc, field), condition):
+            return False
+    return True
+
+
+class HashIndex:
+    """Map every value of a field, or of its array items, to the ids."""
+
+    def __init__(self, field: str):
+        self.field = field
+        self.entries: defaultdict[Any, set[str]] = defaultdict(set)
+
+    def _keys(self, doc: dict) -> Iterable:
+        value = get_field_value(doc, self.field)
+        values = value if isinstance(value, list) else [value]
+        return {hash_key(item) for item in values}
+
+    def add(self, doc: dict):
+        for key in self._keys(doc):
+            self.entries[key].add(doc["_id"])
+
+    def remove(self, doc: dict):
+        for key in self._keys(doc):
+            self.entries[key].discard(doc["_id"])
+            if not self.entries[key]:
+                del self.entries[key]
+
+    def lookup(self, condition: Any) -> set[str] | None:
+        """Ids matching an equality or ``$in`` condition, if supported."""
+        if not isinstance(condition, dict):
+            return set(self.entries.get(hash_key(condition), ()))
+        if list(condition) == ["$in"]:
+            ids: set[str] = set()
+            for value in condition["$in"]:
+                ids |= self.entries.get(hash_key(value), set())
+            return ids
+        return None
+
+
+class SortedIndex:
+    """Keep ``(sort_key(value), id)`` entries sorted to serve ranges."""
+
+    def __init__(self, field: str):
+        self.field = field
+        self.entries: list[tuple[tuple, str]] = []
+
+    def _entry(self, doc: dict) -> tuple[tuple, str]:
+        return sort_key(get_field_value(doc, self.field)), doc["_id"]
+
+    def add(self, doc: dict):
+        bisect.insort(self.entries, self._entry(doc))
+
+    def remove(self, doc: dict):
+        entry = self._entry(doc)
+        index = bisect.bisect_left(self.entries, entry)
+        if index < len(self.entries) and self.entries[index] == entry:
+            del self.entries[index]
+
+    def lookup(self, condition: Any) -> set[str] | None:
+        """Ids matching a range condition, if supported."""
+        if not isinstance(condition, dict) or not condition:
+            return None
+        if not set(condition) <= RANGE_OPERATORS:
+            return None
+
+        key = itemgetter(0)
+        bracket = sort_key(next(iter(condition.values())))[0]
+        low = bisect.bisect_left(self.entries, (bracket,), key=key)
+        high = bisect.bisect_left(self.entries, (bracket + 1,), key=key)
+        for operator, operand in condition.items():
+            if sort_key(operand)[0] != bracket:
+                return set()
+            operand_key = sort_key(operand)
+            if operator in ("$gt", "$lte"):
+                position = bisect.bisect_right
+            else:
+                position = bisect.bisect_left
+            index = position(self.entries, operand_key, key=key)
+            if operator in ("$gt", "$gte"):
+                low = max(low, index)
+            else:
+                high = min(high, index)
+        return {uid for _, uid in self.entries[low:high]}
+
+    def ordered_ids(self, direction: int) -> Iterable[str]:
+        entries = self.entries if direction == 1 else reversed(self.entries)
+        return (uid for _, uid in entries)
+
+
+class MemoryStorage(BaseStorage):
+    """Process local storage evaluating the same plans as MongoDB.
+
+    ``find`` runs the pipelines built by :func:`plan_find`, so filters,
+    ordering, cursors and facets behave like with :class:`MongoStorage`.
+    Fields listed in ``hash_indexes`` serve equality and ``$in``
+    conditions, fields listed in ``sorted_indexes`` serve range
+    conditions and ordering, other conditions are evaluated by scanning
+    the candidate documents.
+    """
+
+    def __init__(
+        self,
+        db: Any,
+        model,
+        collection: str | None = None,
+        hash_indexes: list[str] | None = None,
+        sorted_indexes: list[str] | None = None,
+    ):
+        self.collection = collection or f"{model.__name__}"
+        self.model = model
+        self.db_model = create_in_db_model(model)
+        self.docs: dict[str, dict] = {}
+        self.hash_indexes = {
+            field: HashIndex(field) for field in ["_id", *(hash_indexes or [])]
+        }
+        self.sorted_indexes = {
+            field: SortedIndex(field) for field in sorted_indexes or []
+        }
+
+    def _indexes(self) -> Iterable[HashIndex | SortedIndex]:
+        yield from self.hash_indexes.values()
+        yield from self.sorted_indexes.values()
+
+    def _insert(self, doc: dict):
+        self.docs[doc["_id"]] = doc
+        for index in self._indexes():
+            index.add(doc)
+
+    def _remove(self, uid: str) -> dict | None:
+        doc = self.docs.pop(uid, None)
+        if doc is not None:
+            for index in self._indexes():
+                index.remove(doc)
+        return doc
+
+    async def get(
+        self,
+        uid: str,
+        fields: list[str] | None = None,
+        expand: list[str] | None = None,
+    ):
+        if expand:
+            raise HTTPException(
+                status_code=400,
+                detail=f"cannot expand: {', '.join(expand)}",
+            )
+        model = self.result_model(fields)
+        item = self.docs.get(uid)
+        if item is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"{uid=} was not found in {self.collection}",
+            )
+        return self.build_item(model, item)
+
+    async def get_many(
+        self, uids: list[str], fields: list[str] | None = None
+    ) -> list:
+        model = self.result_model(fields)
+        return [
+            self.build_item(model, self.docs[uid])
+            if uid in self.docs
+            else None
+            for uid in uids
+        ]
+
+    async def create(self, items):
+        docs = [create_document(item) for item in items]
+        for doc in docs:
+            self._insert(doc)
+        return docs
+
+    async def update(self, items):
+        updated = jsonable_encoder(datetime.now())
+        statuses = []
+        for item in items:
+            doc = self._remove(item.id)
+            if doc is None:
+                statuses.append({"_id": item.id, "status": "not_found"})
+                continue
+            changes = item.model_dump(
+                mode="json",
+                exclude_unset=True,
+                exclude={"id", "created", "updated"},
+            )
+            self._insert({**doc, **changes, "updated": updated})
+            statuses.append({"_id": item.id, "status": "ok"})
+        return self._write_report(statuses)
+
+    async def replace(self, items):
+        statuses = []
+        for item in items:
+            stored = self._remove(item.id)
+            if stored is None:
+                statuses.append({"_id": item.id, "status": "not_found"})
+                continue
+            doc = item.model_dump(mode="json", by_alias=True)
+            # The creation date is kept
+            self._insert({**doc, "created": stored.get("created")})
+            statuses.append({"_id": item.id, "status": "ok"})
+        return self._write_report(statuses)
+
+    async def delete(self, uids):
+        deleted = [uid for uid in uids if self._remove(uid) is not None]
+        return {"deleted_count": len(deleted)}
+
+    @staticmethod
+    def _write_report(statuses: list[dict]) -> dict:
+        matched = sum(status["status"] == "ok" for status in statuses)
+        return {
+            "matched_count": matched,
+            "modified_count": matched,
+            "items": statuses,
+        }
+
+    def plan(self, common, common_match, filters, facets) -> FindPlan:
+        self.result_model(common.get("fields"))
+        try:
+            return plan_find(
+                common,
+                common_match | filters,
+                facets,
+                builders=self.query_builders,
+            )
+        except ValueError as err:
+            raise HTTPException(status_code=400, detail=str(err))
+
+    async def explain(self, common, common_match, filters, facets) -> dict:
+        return self.plan(common, common_match, filters, facets).explain()
+
+    async def find(
+        self, common, common_match, filters, facets, *args, **kwargs
+    ):
+        plan = self.plan(common, common_match, filters, facets)
+        results = self.aggregate(plan.page)
+        count = self.aggregate(plan.count)
+        facet_docs = self.aggregate(plan.facets) if plan.facets else [{}]
+
+        results, next_cursor = plan.paginate(results)
+        return {
+            **facet_docs[0],
+            "metadata": {
+                **plan.count_metadata(count[0]["count"] if count else 0),
+                "next": next_cursor,
+            },
+            "results": [dict(doc) for doc in results],
+        }
+
+    async def export(
+        self,
+        common_match,
+        filters,
+        ordering: str | None = None,
+        batch_size: int = 1000,
+    ):
+        try:
+            plan = plan_find(
+                {"ordering": ordering, "limit": max(len(self.docs), 1)},
+                common_match | filters,
+                [],
+                builders=self.query_builders,
+            )
+        except ValueError as err:
+            raise HTTPException(status_code=400, detail=str(err))
+        for index, doc in enumerate(self.aggregate(plan.page), start=1):
+            yield json.dumps(doc) + "\n"
+            if index % batch_size == 0:
+                # Let other requests run between batches
+                await asyncio.sleep(0)
+
+    def aggregate(
+        self, stages: list[dict], docs: list[dict] | None = None
+    ) -> list[dict]:
+        """Run the subset of aggregation stages produced by the planner.
+
+        ``docs`` defaults to the whole collection, in which case indexes
+        are used to select the candidates of a leading ``$match`` and to
+        order them.
+        """
+        for stage in stages:
+            ((name, spec),) = stage.items()
+            if name == "$match":
+                docs = self._match(spec, docs)
+            elif name == "$sort":
+                docs = self._sort(docs, spec)
+            elif name == "$skip":
+                docs = self._all(docs)[spec:]
+            elif name == "$limit":
+                docs = self._all(docs)[:spec]
+            elif name == "$project":
+                docs = [project_document(doc, spec) for doc in self._all(docs)]
+            elif name == "$count":
+                count = len(self._all(docs))
+                docs = [{spec: count}] if count else []
+            elif name == "$unwind":
+                field = spec.lstrip("$")
+                docs = [
+                    {**doc, field: value}
+                    for doc in self._all(docs)
+                    for value in get_field_value(doc, field) or []
+                ]
+            elif name == "$sortByCount":
+                field = spec.lstrip("$")
+                values: dict[Any, Any] = {}
+                counter: Counter = Counter()
+                for doc in self._all(docs):
+                    value = get_field_value(doc, field)
+                    key = hash_key(value)
+                    values.setdefault(key, value)
+                    counter[key] += 1
+                docs = [
+                    {"_id": values[key], "count": count}
+                    for key, count in counter.most_common()
+                ]
+            elif name == "$facet":
+                docs = self._all(docs)
+                docs = [
+                    {
+                        field: self.aggregate(sub_stages, docs)
+                        for field, sub_stages in spec.items()
+                    }
+                ]
+            else:
+                raise ValueError(f"unsupported stage: {name}")
+        return self._all(docs)
+
+    def _match(self, query: dict, docs: list[dict] | None) -> list[dict]:
+        source = self._candidates(query) if docs is None else docs
+        return [doc for doc in source if match_document(doc, query)]
+
+    def _all(self, docs: list[dict] | None) -> list[dict]:
+        return list(self.docs.values()) if docs is None else docs
+
+    def _candidates(self, query: dict) -> Iterable[dict]:
+        """Select the candidate documents of a query using indexes."""
+        conditions = query.get("$and", [query])
+        ids: set[str] | None = None
+        for condition in conditions:
+            for field, field_condition in condition.items():
+                for index in (
+                    self.hash_indexes.get(field),
+                    self.sorted_indexes.get(field),
+                ):
+                    matched = index and index.lookup(field_condition)
+                    if matched is not None:
+                        ids = matched if ids is None else ids & matched
+                        break
+        if ids is None:
+            LOGGER.debug("Scanning %s for %s", self.collection, query)
+            return self.docs.values()
+        return (self.docs[uid] for uid in ids)
+
+    def _sort(
+        self, docs: list[dict] | None, ordering: dict[str, int]
+    ) -> list[dict]:
+        fields = [field for field in ordering if field != "_id"]
+        direction = ordering[fields[0]] if fields else ordering["_id"]
+        index = self.sorted_indexes.get(fields[0]) if fields else None
+        if (
+            index is not None
+            and len(fields) == 1
+            and ordering.get("_id", direction) == direction
+        ):
+            # The index entries are ordered by value then by id
+            if docs is None:
+                return [self.docs[uid] for uid in index.ordered_ids(direction)]
+            selected = {doc["_id"]: doc for doc in docs}
+            return [
+                selected[uid]
+                for uid in index.ordered_ids(direction)
+                if uid in selected
+            ]
+
+        docs = list(self._all(docs))
+        for field, field_direction in reversed(ordering.items()):
+            docs.sort(
+                key=lambda doc: sort_key(get_field_value(doc, field)),
+                reverse=field_direction == -1,
+            )
+        return docs
@@ -1,92 +1,159 @@
-import operator
+import asyncio
+import json
+from datetime import datetime
 
 import daiquiri
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import HTTPException
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import TEXT, IndexModel, UpdateOne
+from pymongo.errors import BulkWriteError
 
 from fastcrud.storage.aggregation import (
-    process_facet_stage,
-    process_ordering_stage,
+    compile_query_parameters,
+    parse_ordering,
     process_query_parameter_stage,
 )
+from fastcrud.storage.batching import WriteCoalescer
+from fastcrud.storage.cache import LRUCache, QueryCache
 from fastcrud.storage.commun import BaseStorage
-from fastcrud.utils import create_in_db_model
+from fastcrud.storage.encoding import (
+    datetime_fields,
+    get_encoder,
+    migrate_string_dates,
+)
+from fastcrud.storage.indexes import key_pattern
+from fastcrud.storage.planner import FindPlan, plan_find
+from fastcrud.storage.relations import RelationLoader, split_looked_up
+from fastcrud.utils import (
+    NGRAMS_FIELD,
+    chunked,
+    create_document,
+    create_in_db_model,
+    get_field_value,
+    ngrams,
+    ngrams_field,
+)
 
 LOGGER = daiquiri.getLogger(__name__)
 
 
-def default_filter(field, value, obj, opr="eq"):
-    """
-    Containment Test	obj in seq	contains(seq, obj)
-    Truth Test	obj	truth(obj)
-    Ordering	a < b	lt(a, b)
-    Ordering	a <= b	le(a, b)
-    Equality	a == b	eq(a, b)
-    Difference	a != b	ne(a, b)
-    Ordering	a >= b	ge(a, b)
-    Ordering	a > b	gt(a, b)
-    """
-    OPERATORS = {
-        "contains",
-        "exists",
-        "lt",
-        "le",
-        "eq",
-        "ne",
-        "ge",
-        "gt",
-    }
-    assert opr in OPERATORS, "find operation: invalid operator"
-    if opr == "contains":
-        field = vars(obj).get(field)
-        if not isinstance(field, (str, list, tuple, set, frozenset)):
-            field = list()
-        return operator.contains(field, value)
-    if opr == "exists":
-        return operator.truth(vars(obj).get(field))
-    return vars(operator)[opr](vars(obj).get(field), value)
-
-
 class MongoStorage(BaseStorage):
+    query_cache: QueryCache | None = None
+    # Substring search strategy of the fields, see build_search_parameter
+    search: dict[str, str] | None = None
+    # Reference fields which can be expanded, see normalize_relations
+    relations: dict[str, dict] | None = None
+
     def __init__(
         self,
         db: AsyncIOMotorDatabase,
         model,
         collection: str | None = None,
+        batch_size: int = 1000,
+        ordered: bool = True,
+        read_back: bool = False,
+        write_buffer: dict | None = None,
+        encoding: str = "json",
+        count_cache: dict | None = None,
     ):
         self.db = db
         self.collection = collection or f"{model.__name__}"
         self.model = model
         self.db_model = create_in_db_model(model)
+        self.batch_size = batch_size
+        self.ordered = ordered
+        self.read_back = read_back
+        # "bson" stores datetimes and UUIDs natively, see ValueEncoder
+        self.encoder = get_encoder(encoding)
+        # Exact counts memoized per filter for the "cached" count mode,
+        # they are not invalidated by writes
+        self.count_cache = LRUCache(**(count_cache or {}))
+        self.write_coalescer = None
+        if write_buffer is not None:
+            # e.g. {"max_items": 500, "max_delay": 0.005}, flushed in
+            # writes of batch_size documents like the direct inserts
+            self.write_coalescer = WriteCoalescer(
+                lambda docs, ordered: self.db[self.collection].insert_many(
+                    docs, ordered=ordered
+                ),
+                batch_size=batch_size,
+                ordered=ordered,
+                **write_buffer,
+            )
 
-    async def get(self, uid: str):
-        item = await self.db[self.collection].find_one({"_id": uid})
+    async def get(
+        self,
+        uid: str,
+        fields: list[str] | None = None,
+        expand: list[str] | None = None,
+    ):
+        model = self.result_model(fields)
+        relations = self._expanded_relations(expand)
+        item = await self.db[self.collection].find_one(
+            {"_id": uid},
+            {field: True for field in [*fields, *relations]}
+            if fields
+            else None,
+        )
         if item is None:
             raise HTTPException(
                 status_code=404,
                 detail=f"{uid=} was not found in {self.collection}",
             )
-        return self.db_model(**item)
+        if not relations:
+            return self.build_item(model, item)
+        (expanded,) = await RelationLoader(self.db).expand([item], relations)
+        item = self.build_item(model, item)
+        return {
+            **item.model_dump(by_alias=True, warnings=False),
+            **expanded,
+        }
 
-    async def create(self, items):
-        items_in_db = []
-        for item in items:
-            items_in_db.append(
-                self.db_model(
-                    **{
-                        **item.model_dump(),
-                        "created": item.updated,
-                    }
-                )
+    async def get_many(
+        self, uids: list[str], fields: list[str] | None = None
+    ) -> list:
+        """Items of ``uids`` in the same order, None for missing ones.
+
+        Distinct uids are read with ``$in`` queries of ``batch_size``.
+        """
+        model = self.result_model(fields)
+        found = {}
+        for chunk in chunked(list(dict.fromkeys(uids)), self.batch_size):
+            cursor = self.db[self.collection].find(
+                {"_id": {"$in": list(chunk)}},
+                {field: True for field in fields} if fields else None,
             )
-        try:
-            results = await self.db[self.collection].insert_many(
-                jsonable_encoder(items_in_db)
+            async for doc in cursor:
+                found[doc["_id"]] = self.build_item(model, doc)
+        return [found.get(uid) for uid in uids]
+
+    def _expanded_relations(self, expand: list[str] | None) -> dict:
+        relations = self.relations or {}
+        unknown = [field for field in expand or [] if field not in relations]
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"cannot expand: {', '.join(unknown)}",
             )
+        return {field: relations[field] for field in expand or []}
+
+    async def create(self, items):
+        docs = [create_document(item, self.encoder.dump) for item in items]
+        stored = [self._with_ngrams(doc) for doc in docs]
+        try:
+            if self.write_coalescer is not None:
+                await self.write_coalescer.submit(stored)
+            else:
+                for chunk in chunked(stored, self.batch_size):
+                    await self.db[self.collection].insert_many(
+                        chunk, ordered=self.ordered
+                    )
+            if not self.read_back:
+                return docs
             docs = (
                 await self.db[self.collection]
-                .find({"_id": {"$in": results.inserted_ids}})
+                .find({"_id": {"$in": [doc["_id"] for doc in docs]}})
                 .to_list(None)
             )
             return jsonable_encoder(
@@ -94,41 +161,437 @@ class MongoStorage(BaseStorage):
             )
         except Exception as err:
             raise HTTPException(status_code=500, detail=str(err))
+        finally:
+            self._invalidate_queries()
 
-    def update(self, items):
-        ...
+    def _ngram_fields(self) -> list[str]:
+        return [
+            field
+            for field, strategy in (self.search or {}).items()
+            if strategy == "ngram"
+        ]
 
-    def replace(self, items):
-        ...
+    def _ngrams_changes(self, doc: dict) -> dict:
+        """``$set`` of the n-grams of the ``ngram`` fields found in doc."""
+        return {
+            ngrams_field(field): ngrams(get_field_value(doc, field))
+            for field in self._ngram_fields()
+            if get_field_value(doc, field) is not None
+        }
 
-    def delete(self, uids):
-        ...
+    def _with_ngrams(self, doc: dict) -> dict:
+        fields = self._ngram_fields()
+        if not fields:
+            return doc
+        return {
+            **doc,
+            NGRAMS_FIELD: {
+                field.replace(".", "__"): ngrams(get_field_value(doc, field))
+                for field in fields
+            },
+        }
 
-    async def find(
-        self, common, common_match, filters, facets, *args, **kwargs
+    async def ensure_indexes(
+        self, indexes: list[IndexModel], dry_run: bool = False
+    ) -> dict:
+        """Create the missing ``indexes``, matched by key pattern.
+
+        The report lists the planned indexes which are missing, already
+        present, possibly under another name, and the existing indexes
+        which are not planned. Nothing is created with ``dry_run``.
+        """
+        collection = self.db[self.collection]
+        existing = {
+            key_pattern(
+                [(field, TEXT) for field in info["weights"]]
+                if "weights" in info
+                else info["key"]
+            ): name
+            for name, info in (await collection.index_information()).items()
+        }
+        planned = {
+            index.document["name"]: key_pattern(index.document["key"])
+            for index in indexes
+        }
+        matched = set(planned.values())
+        report = {
+            "missing": [
+                name for name, key in planned.items() if key not in existing
+            ],
+            "present": [
+                name for name, key in planned.items() if key in existing
+            ],
+            "extra": [
+                name
+                for key, name in existing.items()
+                if name != "_id_" and key not in matched
+            ],
+        }
+        if report["missing"] and not dry_run:
+            LOGGER.info(
+                "Creating indexes %s on %s", report["missing"], self.collection
+            )
+            await collection.create_indexes(
+                [
+                    index
+                    for index in indexes
+                    if index.document["name"] in report["missing"]
+                ]
+            )
+        return report
+
+    async def migrate_dates(
+        self, fields: list[str] | None = None, batch_size: int = 1000
+    ) -> dict:
+        """Convert the string dates of ``fields`` into BSON dates.
+
+        Defaults to the datetime fields of the model, to be run once
+        before switching a collection to the ``bson`` encoding.
+        """
+        try:
+            return await migrate_string_dates(
+                self.db[self.collection],
+                fields or datetime_fields(self.model),
+                batch_size=batch_size,
+            )
+        finally:
+            self._invalidate_queries()
+
+    async def backfill_ngrams(
+        self, batch_size: int = 1000, dry_run: bool = False
+    ) -> dict:
+        """Store the n-grams of the documents missing them.
+
+        The ``ngram`` strategy only maintains the n-grams of the
+        documents it writes, to be run once after enabling it on an
+        existing collection. Only the documents missing the n-grams of
+        a field are read, and they are updated with batched
+        ``bulk_write`` calls, so the backfill can be interrupted and
+        resumed.
+        """
+        fields = self._ngram_fields()
+        report = {"matched": 0, "modified": 0}
+        if not fields:
+            return report
+        collection = self.db[self.collection]
+        query = {
+            "$or": [
+                {ngrams_field(field): {"$exists": False}} for field in fields
+            ]
+        }
+        operations: list[UpdateOne] = []
+
+        async def flush():
+            if operations and not dry_run:
+                result = await collection.bulk_write(operations, ordered=False)
+                report["modified"] += result.modified_count
+            operations.clear()
+
+        try:
+            cursor = collection.find(
+                query,
+                {field: True for field in fields},
+                batch_size=batch_size,
+            )
+            async for doc in cursor:
+                report["matched"] += 1
+                changes = {
+                    ngrams_field(field): ngrams(get_field_value(doc, field))
+                    for field in fields
+                }
+                operations.append(
+                    UpdateOne({"_id": doc["_id"]}, {"$set": changes})
+                )
+                if len(operations) >= batch_size:
+                    await flush()
+            await flush()
+        finally:
+            self._invalidate_queries()
+        return report
+
+    def build_item(self, model, doc: dict):
+        if self.encoder.name != "json":
+            # Native values such as binary UUIDs need the validation
+            return model(**doc)
+        return super().build_item(model, doc)
+
+    def compile_filters(self, parameters: list[str]):
+        self.query_builders = compile_query_parameters(
+            parameters, self.search, self.encoder.value
+        )
+
+    def _invalidate_queries(self):
+        if self.query_cache is not None:
+            self.query_cache.bump(self.collection)
+
+    async def update(self, items):
+        updated = datetime.now()
+        operations = []
+        for item in items:
+            changes = self.encoder.document(
+                {
+                    **item.model_dump(
+                        exclude_unset=True,
+                        exclude={"id", "created", "updated"},
+                    ),
+                    "updated": updated,
+                }
+            )
+            operations.append(
+                UpdateOne(
+                    {"_id": item.id},
+                    {"$set": {**changes, **self._ngrams_changes(changes)}},
+                )
+            )
+        return await self._bulk_write(
+            [item.id for item in items], operations
+        )
+
+    async def replace(self, items):
+        operations = []
+        for item in items:
+            doc = self._with_ngrams(self.encoder.dump(item, by_alias=True))
+            doc.pop("created", None)
+            # Replaced whole but the stored creation date, the values
+            # are literals so strings starting with $ are not paths
+            operations.append(
+                UpdateOne(
+                    {"_id": item.id},
+                    [
+                        {
+                            "$replaceWith": {
+                                "$mergeObjects": [
+                                    {"$literal": doc},
+                                    {"created": "$created"},
+                                ]
+                            }
+                        }
+                    ],
+                )
+            )
+        return await self._bulk_write(
+            [item.id for item in items], operations
+        )
+
+    async def delete(self, uids):
+        deleted_count = 0
+        try:
+            for chunk in chunked(uids, self.batch_size):
+                result = await self.db[self.collection].delete_many(
+                    {"_id": {"$in": list(chunk)}}
+                )
+                deleted_count += result.deleted_count
+        except Exception as err:
+            raise HTTPException(status_code=500, detail=str(err))
+        finally:
+            self._invalidate_queries()
+        return {"deleted_count": deleted_count}
+
+    async def _bulk_write(self, uids: list[str], operations: list) -> dict:
+        """Run ``operations`` as chunked ``bulk_write`` calls.
+
+        The per-item report is built from the write results and errors,
+        without reading the documents back, the ids are only looked up
+        when some did not match. In ordered mode the first error stops
+        the batch and the remaining items are skipped.
+        """
+        statuses: list[dict] = [{"_id": uid, "status": "ok"} for uid in uids]
+        matched_count = modified_count = 0
+        failed = False
+        try:
+            for start in range(0, len(operations), self.batch_size):
+                chunk = operations[start : start + self.batch_size]
+                if failed:
+                    for index in range(start, start + len(chunk)):
+                        statuses[index]["status"] = "skipped"
+                    continue
+                try:
+                    result = await self.db[self.collection].bulk_write(
+                        chunk, ordered=self.ordered
+                    )
+                    details = result.bulk_api_result
+                except BulkWriteError as err:
+                    details = err.details
+                    for error in details["writeErrors"]:
+                        index = start + error["index"]
+                        statuses[index]["status"] = "error"
+                        statuses[index]["error"] = error["errmsg"]
+                    if self.ordered:
+                        failed = True
+                        last = start + details["writeErrors"][-1]["index"]
+                        for status in statuses[last + 1 : start + len(chunk)]:
+                            status["status"] = "skipped"
+                matched_count += details["nMatched"]
+                modified_count += details["nModified"]
+                await self._report_unmatched(
+                    statuses[start : start + len(chunk)], details["nMatched"]
+                )
+        except Exception as err:
+            raise HTTPException(status_code=500, detail=str(err))
+        finally:
+            self._invalidate_queries()
+        return {
+            "matched_count": matched_count,
+            "modified_count": modified_count,
+            "items": statuses,
+        }
+
+    async def _report_unmatched(self, statuses: list[dict], matched: int):
+        """Mark the ``statuses`` of the ids that matched no document.
+
+        The write results only count the matched documents, the ids are
+        looked up when some of the written ones did not match.
+        """
+        written = [status for status in statuses if status["status"] == "ok"]
+        if matched >= len(written):
+            return
+        found = {
+            doc["_id"]
+            async for doc in self.db[self.collection].find(
+                {"_id": {"$in": [status["_id"] for status in written]}},
+                {"_id": 1},
+            )
+        }
+        for status in written:
+            if status["_id"] not in found:
+                status["status"] = "not_found"
+
+    async def export(
+        self,
+        common_match,
+        filters,
+        ordering: str | None = None,
+        batch_size: int = 1000,
     ):
-        stages: list[dict] = []
+        """Stream the matching documents as NDJSON lines.
+
+        Documents are pulled from a cursor ``batch_size`` at a time, so
+        memory stays bounded whatever the size of the result set.
+        """
+        match_stages: list[dict] = []
+        try:
+            process_query_parameter_stage(
+                match_stages,
+                common_match | filters,
+                self.search,
+                self.encoder.value,
+                self.query_builders,
+            )
+        except ValueError as err:
+            raise HTTPException(status_code=400, detail=str(err))
+        cursor = self.db[self.collection].find(
+            {"$and": match_stages} if match_stages else {},
+            sort=list(parse_ordering(ordering).items()) or None,
+            batch_size=batch_size,
+        )
+        async for doc in cursor:
+            item = self.build_item(self.db_model, doc)
+            yield item.model_dump_json(by_alias=True, warnings=False) + "\n"
+
+    def plan(self, common, common_match, filters, facets) -> FindPlan:
+        self.result_model(common.get("fields"))
+        try:
+            return plan_find(
+                common,
+                common_match | filters,
+                facets,
+                self.search,
+                self.encoder.value,
+                self.relations,
+                self.query_builders,
+            )
+        except ValueError as err:
+            raise HTTPException(status_code=400, detail=str(err))
 
-        limit = common.get("limit", 10)
-        offset = common.get("offset", 0)
-        ordering = common.get("ordering")
+    async def explain(
+        self,
+        common,
+        common_match,
+        filters,
+        facets,
+        verbosity: str | None = None,
+    ) -> dict:
+        """Explain the plan chosen for a ``find`` call.
+
+        Without ``verbosity`` only the planned pipelines are returned,
+        otherwise MongoDB is asked to explain the page pipeline too.
+        """
+        plan = self.plan(common, common_match, filters, facets)
+        explanation = plan.explain()
+        if verbosity:
+            explanation["mongodb"] = await self.db.command(
+                "explain",
+                {
+                    "aggregate": self.collection,
+                    "pipeline": plan.page,
+                    "cursor": {},
+                },
+                verbosity=verbosity,
+            )
+        return explanation
 
-        pre_match_stages: list[dict] = []
-        process_query_parameter_stage(pre_match_stages, common_match | filters)
+    async def find(
+        self, common, common_match, filters, facets, *args, **kwargs
+    ):
+        plan = self.plan(common, common_match, filters, facets)
+        model = self.result_model(common.get("fields"))
+        collection = self.db[self.collection]
 
-        if pre_match_stages:
-            stages.append({"$match": {"$and": pre_match_stages}})
+        async def run(kind: str, stages: list[dict] | None) -> list[dict]:
+            if stages is None:
+                return [{}]
+            if self.query_cache is None:
+                return await collection.aggregate(stages).to_list(None)
+            return await self.query_cache.fetch(
+                self.collection,
+                kind,
+                stages,
+                lambda: collection.aggregate(stages).to_list(None),
+            )
 
-        # Ordering stage
-        process_ordering_stage(stages, ordering)
+        async def run_count() -> dict:
+            if plan.count_mode == "estimated" and not plan.match:
+                # Read from the collection metadata, no document scanned
+                count = await collection.estimated_document_count()
+                return plan.count_metadata(count, exact=False)
+            if plan.count_mode != "cached":
+                count = await run("count", plan.count)
+                return plan.count_metadata(count[0]["count"] if count else 0)
+            key = json.dumps(plan.count, default=str, sort_keys=True)
+            count = self.count_cache.get(key, None)
+            if count is None:
+                result = await collection.aggregate(plan.count).to_list(None)
+                count = result[0]["count"] if result else 0
+                self.count_cache.set(key, count)
+            return plan.count_metadata(count)
 
-        # Facets stage
-        process_facet_stage(
-            stages,
-            [],
-            facets,
-            limit,
-            offset,
+        results, count_metadata, facet_docs = await asyncio.gather(
+            run("page", plan.page),
+            run_count(),
+            run("facets", plan.facets),
         )
 
-        return stages
+        results, next_cursor = plan.paginate(results)
+        if plan.expand_strategy == "lookup":
+            results, expanded = split_looked_up(results, plan.expand)
+        elif plan.expand_strategy == "batch":
+            # Per request loader, each related document is fetched once
+            expanded = await RelationLoader(self.db).expand(
+                results, plan.expand
+            )
+        else:
+            expanded = None
+        items = [self.build_item(model, doc) for doc in results]
+        if expanded is not None:
+            items = [
+                {**item.model_dump(by_alias=True, warnings=False), **values}
+                for item, values in zip(items, expanded)
+            ]
+        return {
+            **(facet_docs[0] if facet_docs else {}),
+            "metadata": {**count_metadata, "next": next_cursor},
+            # Trusted items are left to the fast response serialization
+            "results": items
+            if self.trusted_documents
+            else jsonable_encoder(items),
+        }
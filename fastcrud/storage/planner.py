@@ -0,0 +1,184 @@
+import dataclasses
+from typing import Callable
+
+import daiquiri
+
+from fastcrud.storage.aggregation import (
+    parse_ordering,
+    process_count_stage,
+    process_cursor_stage,
+    process_facet_stage,
+    process_lookup_items_stage,
+    process_ordering_stage,
+    process_pagination_stage,
+    process_projection_stage,
+    process_query_parameter_stage,
+)
+from fastcrud.storage.relations import LOOKUP_FIELD, LOOKUP_MAX_PAGE_SIZE
+from fastcrud.utils import decode_cursor, encode_cursor, get_field_value
+
+LOGGER = daiquiri.getLogger(__name__)
+# Capped counts stop counting beyond this many documents
+COUNT_CAP = 1000
+
+
+@dataclasses.dataclass
+class FindPlan:
+    """Pipelines needed to answer a ``find`` call.
+
+    The page pipeline only holds top level ``$match``/``$sort``/``$skip``/
+    ``$limit`` stages so MongoDB can walk an index and stop after the
+    page, then the ``$project`` of the requested fields if any, while
+    the count and facet pipelines are independent and can be run
+    concurrently.
+    """
+
+    pagination: str
+    limit: int
+    ordering: dict[str, int]
+    match: list[dict]
+    page: list[dict]
+    count: list[dict]
+    facets: list[dict] | None = None
+    projection: dict | None = None
+    expand: dict[str, dict] = dataclasses.field(default_factory=dict)
+    expand_strategy: str | None = None
+    count_mode: str = "exact"
+    count_cap: int = COUNT_CAP
+
+    def explain(self) -> dict:
+        return dataclasses.asdict(self)
+
+    def paginate(self, results: list[dict]) -> tuple[list[dict], str | None]:
+        """Trim the page results and build the next cursor if any."""
+        if self.pagination != "cursor" or len(results) <= self.limit:
+            return results, None
+        results = results[: self.limit]
+        next_cursor = encode_cursor(
+            [get_field_value(results[-1], field) for field in self.ordering]
+        )
+        return results, next_cursor
+
+    def count_metadata(self, count: int, exact: bool = True) -> dict:
+        """Metadata reporting the ``count`` of the count pipeline."""
+        if self.count_mode == "capped" and count > self.count_cap:
+            return {"count": self.count_cap, "count_exact": False}
+        return {"count": count, "count_exact": exact}
+
+
+def plan_find(
+    common: dict,
+    query_parameters: dict,
+    facets: list[str],
+    search: dict | None = None,
+    encode: Callable | None = None,
+    relations: dict[str, dict] | None = None,
+    builders: dict[str, Callable] | None = None,
+):
+    """Plan the pipelines of a ``find`` call.
+
+    Relations to ``expand`` are looked up in the page pipeline for pages
+    up to ``LOOKUP_MAX_PAGE_SIZE`` documents, beyond that one batched
+    query per collection is cheaper than a lookup per document.
+
+    The ``count`` mode is ``exact`` by default, ``capped`` stops counting
+    after ``count_cap`` documents. The ``estimated`` and ``cached`` modes
+    are left to the storages, which may fall back to the exact count.
+
+    Raises :class:`ValueError` when the cursor cannot be decoded or a
+    relation cannot be expanded.
+    """
+
+    limit = common.get("limit", 10)
+    offset = common.get("offset", 0)
+    ordering = common.get("ordering")
+    pagination = common.get("pagination") or "offset"
+    cursor = common.get("cursor")
+    fields = common.get("fields")
+    relations = relations or {}
+    unknown = [
+        field for field in common.get("expand") or [] if field not in relations
+    ]
+    if unknown:
+        raise ValueError(f"cannot expand: {', '.join(unknown)}")
+    expand = {field: relations[field] for field in common.get("expand") or []}
+
+    match: list[dict] = []
+    pre_match_stages: list[dict] = []
+    process_query_parameter_stage(
+        pre_match_stages, query_parameters, search, encode, builders
+    )
+    if pre_match_stages:
+        match.append({"$match": {"$and": pre_match_stages}})
+
+    page = list(match)
+    ordering_dict = parse_ordering(ordering)
+    if pagination == "cursor":
+        ordering_dict.setdefault("_id", 1)
+        if cursor:
+            process_cursor_stage(page, ordering_dict, decode_cursor(cursor))
+        process_ordering_stage(page, ordering, tie_breaker=True)
+        # Read one extra document to know whether there is a next page
+        process_pagination_stage(page, limit + 1)
+    else:
+        process_ordering_stage(page, ordering)
+        process_pagination_stage(page, limit, offset)
+
+    projection = None
+    if fields:
+        # Projected last, so the sort can still walk an index
+        projection = process_projection_stage(
+            page,
+            fields,
+            [
+                *(ordering_dict if pagination == "cursor" else []),
+                *expand,
+            ],
+        )
+
+    expand_strategy = None
+    if expand:
+        expand_strategy = "batch"
+        if limit <= LOOKUP_MAX_PAGE_SIZE:
+            expand_strategy = "lookup"
+            process_lookup_items_stage(
+                page, list(expand), expand, LOOKUP_FIELD
+            )
+
+    count_mode = common.get("count") or "exact"
+    count_cap = common.get("count_cap") or COUNT_CAP
+    count = list(match)
+    if count_mode == "capped":
+        # One more document tells whether the cap is exceeded
+        process_pagination_stage(count, count_cap + 1)
+    process_count_stage(count)
+
+    facet_stages = None
+    if facets:
+        facet_stages = list(match)
+        process_facet_stage(
+            facet_stages,
+            [],
+            facets,
+            limit,
+            offset,
+            include_metadata=False,
+            include_results=False,
+        )
+
+    plan = FindPlan(
+        pagination=pagination,
+        limit=limit,
+        ordering=ordering_dict,
+        match=match,
+        page=page,
+        count=count,
+        facets=facet_stages,
+        projection=projection,
+        expand=expand,
+        expand_strategy=expand_strategy,
+        count_mode=count_mode,
+        count_cap=count_cap,
+    )
+    LOGGER.debug("Planned find: %s", plan)
+    return plan
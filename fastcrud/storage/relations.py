@@ -0,0 +1,147 @@
+from collections import defaultdict
+from typing import Any
+
+import daiquiri
+
+from fastcrud.utils import project_document
+
+LOGGER = daiquiri.getLogger(__name__)
+# Documents looked up in the pipeline are stored under this field
+LOOKUP_FIELD = "_expand"
+# Pages up to this size are expanded with $lookup, larger ones in batch
+LOOKUP_MAX_PAGE_SIZE = 20
+
+
+def normalize_relations(relations: dict | None) -> dict[str, dict]:
+    """Normalize the declared relations.
+
+    Relations map reference fields to the collection they point to,
+    either as a collection name or as a ``{"collection": ...,
+    "fields": [...]}`` dictionary projecting the related documents.
+    """
+    normalized = {}
+    for field, relation in (relations or {}).items():
+        if isinstance(relation, str):
+            relation = {"collection": relation}
+        normalized[field] = {
+            "collection": relation["collection"],
+            "fields": relation.get("fields"),
+        }
+    return normalized
+
+
+def projection(fields: list[str] | None) -> dict | None:
+    return {field: 1 for field in fields} if fields else None
+
+
+def resolve(value: Any, documents: dict) -> Any:
+    """Replace a reference, or a list of references, by the documents."""
+    if isinstance(value, list):
+        return [documents[uid] for uid in value if uid in documents]
+    return documents.get(value)
+
+
+class RelationLoader:
+    """Resolve references in batches, one ``$in`` query per collection.
+
+    Meant to live for a single request: resolved documents are cached,
+    so documents referenced many times are fetched once.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.documents: dict[str, dict] = defaultdict(dict)
+        self.queries = 0
+
+    async def load(
+        self, collection: str, uids: set, fields: list[str] | None = None
+    ) -> dict:
+        cache = self.documents[collection]
+        missing = [uid for uid in uids if uid not in cache]
+        if missing:
+            self.queries += 1
+            docs = (
+                await self.db[collection]
+                .find({"_id": {"$in": missing}}, projection(fields))
+                .to_list(None)
+            )
+            cache.update((doc["_id"], doc) for doc in docs)
+        return cache
+
+    async def expand(
+        self, docs: list[dict], relations: dict[str, dict]
+    ) -> list[dict]:
+        """Resolved ``relations`` of each document."""
+        uids: dict[str, set] = defaultdict(set)
+        fields: dict[str, list[str] | None] = {}
+        for field, relation in relations.items():
+            collection = relation["collection"]
+            for doc in docs:
+                value = doc.get(field)
+                uids[collection].update(
+                    value if isinstance(value, list) else [value]
+                )
+            # Relations sharing a collection share the query, projecting
+            # the union of their fields
+            shared = fields.get(collection, [])
+            if relation["fields"] is None or shared is None:
+                fields[collection] = None
+            else:
+                fields[collection] = sorted({*shared, *relation["fields"]})
+
+        documents = {}
+        for collection, collection_uids in uids.items():
+            collection_uids.discard(None)
+            documents[collection] = await self.load(
+                collection, collection_uids, fields[collection]
+            )
+
+        expanded = []
+        for doc in docs:
+            values = {}
+            for field, relation in relations.items():
+                value = resolve(
+                    doc.get(field), documents[relation["collection"]]
+                )
+                if relation["fields"]:
+                    value = project_related(value, relation["fields"])
+                values[field] = value
+            expanded.append(values)
+        return expanded
+
+
+def project_related(value: Any, fields: list[str]) -> Any:
+    if isinstance(value, list):
+        return [project_document(doc, projection(fields)) for doc in value]
+    if value is None:
+        return None
+    return project_document(value, projection(fields))
+
+
+def split_looked_up(
+    docs: list[dict], relations: dict[str, dict]
+) -> tuple[list[dict], list]:
+    """Documents expanded by ``$lookup`` and their resolved ``relations``.
+
+    The documents are copied without the looked up field, they may be
+    shared with the query cache and must not be modified.
+    """
+    copies, expanded = [], []
+    for doc in docs:
+        looked_up = doc.get(LOOKUP_FIELD, {})
+        copies.append(
+            {key: value for key, value in doc.items() if key != LOOKUP_FIELD}
+        )
+        expanded.append(
+            {
+                field: resolve(
+                    doc.get(field),
+                    {
+                        related["_id"]: related
+                        for related in looked_up.get(field, [])
+                    },
+                )
+                for field in relations
+            }
+        )
+    return copies, expanded
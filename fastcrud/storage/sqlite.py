@@ -0,0 +1,603 @@
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import UnionType
+from typing import Any, Collection
+
+import daiquiri
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import HTTPException
+
+from fastcrud.storage.commun import BaseStorage
+from fastcrud.storage.planner import FindPlan, plan_find
+from fastcrud.utils import (
+    FILTER_CONTAINS_OPERATORS,
+    chunked,
+    create_document,
+    create_in_db_model,
+    normalize_parameter,
+    project_document,
+)
+
+LOGGER = daiquiri.getLogger(__name__)
+FIELD_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z0-9_]+)*$")
+SQL_OPERATORS = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+# SQLite limits the number of host parameters of a statement
+MAX_VARIABLES = 500
+# Names the facet statements, apart from the page and count ones
+FACET_PREFIX = "facet:"
+
+
+def _regexp(pattern: str, value: Any) -> bool:
+    return isinstance(value, str) and re.search(pattern, value) is not None
+
+
+def field_expression(field: str, function: str = "json_extract") -> str:
+    """SQL expression of a document field.
+
+    The JSON path is inlined, not bound, so the expression matches the
+    one of the expression indexes and SQLite can use them.
+    """
+    if field == "_id" and function == "json_extract":
+        return "id"
+    if not FIELD_PATTERN.match(field):
+        raise ValueError(f"invalid field: {field}")
+    return f"{function}(doc, '$.{field}')"
+
+
+def json_value(value: Any, json_type: str | None) -> Any:
+    """Value of a field read with ``json_extract``, given its JSON type."""
+    if json_type in ("array", "object"):
+        return json.loads(value)
+    if json_type in ("true", "false"):
+        return json_type == "true"
+    return value
+
+
+def sql_value(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, datetime):
+        return jsonable_encoder(value)
+    return value
+
+
+def compile_expression(expression: str, condition: Any) -> tuple[str, list]:
+    """Compile a MongoDB field condition on a SQL ``expression``."""
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+
+    clauses: list[str] = []
+    params: list = []
+    for operator, operand in condition.items():
+        if operator == "$eq" and operand is None:
+            # Like MongoDB, null matches null and missing values
+            clauses.append(f"{expression} IS NULL")
+        elif operator == "$eq":
+            clauses.append(f"{expression} = ?")
+            params.append(sql_value(operand))
+        elif operator in SQL_OPERATORS:
+            clauses.append(f"{expression} {SQL_OPERATORS[operator]} ?")
+            params.append(sql_value(operand))
+        elif operator in ("$in", "$nin"):
+            placeholders = ", ".join("?" * len(operand))
+            if operator == "$in":
+                clauses.append(f"{expression} IN ({placeholders})")
+            else:
+                clauses.append(
+                    f"({expression} IS NULL"
+                    f" OR {expression} NOT IN ({placeholders}))"
+                )
+            params.extend(sql_value(item) for item in operand)
+        elif operator == "$ne" and operand is None:
+            clauses.append(f"{expression} IS NOT NULL")
+        elif operator == "$ne":
+            clauses.append(f"({expression} IS NULL OR {expression} != ?)")
+            params.append(sql_value(operand))
+        elif operator == "$regex":
+            if "i" in condition.get("$options", ""):
+                operand = f"(?i){operand}"
+            clauses.append(f"{expression} REGEXP ?")
+            params.append(operand)
+        elif operator == "$exists":
+            clauses.append(
+                f"{expression} IS {'NOT ' if operand else ''}NULL"
+            )
+        elif operator != "$options":
+            raise ValueError(f"unsupported operator: {operator}")
+    return " AND ".join(clauses) or "1", params
+
+
+def compile_array_condition(field: str, condition: Any) -> tuple[str, list]:
+    """Compile a condition on an array field, matched by any of its items.
+
+    ``$ne``/``$nin`` match when none of the items is excluded, like
+    MongoDB. Scalar values are iterated as a single item.
+    """
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+    items = f"FROM json_each(doc, '$.{field}')"
+    clauses: list[str] = []
+    params: list = []
+    for operator, operand in condition.items():
+        if operator == "$options":
+            continue
+        if operator == "$exists" or operand is None:
+            clause, sub_params = compile_expression(
+                field_expression(field), {operator: operand}
+            )
+            clauses.append(clause)
+            params.extend(sub_params)
+            continue
+        negated = operator in ("$ne", "$nin")
+        item_condition = {
+            {"$ne": "$eq", "$nin": "$in"}.get(operator, operator): operand
+        }
+        if operator == "$regex":
+            item_condition["$options"] = condition.get("$options", "")
+        clause, sub_params = compile_expression("value", item_condition)
+        clauses.append(
+            f"{'NOT ' if negated else ''}EXISTS (SELECT 1 {items} "
+            f"WHERE {clause})"
+        )
+        params.extend(sub_params)
+    return " AND ".join(clauses) or "1", params
+
+
+def compile_condition(
+    field: str, condition: Any, array_fields: Collection[str] = ()
+) -> tuple[str, list]:
+    """Compile a MongoDB field condition into a SQL expression."""
+    if field in array_fields:
+        # Validates the field, inlined in the JSON path of the items
+        field_expression(field)
+        return compile_array_condition(field, condition)
+    return compile_expression(field_expression(field), condition)
+
+
+def compile_query(
+    query: dict, array_fields: Collection[str] = ()
+) -> tuple[str, list]:
+    """Compile a MongoDB ``$match`` query into a SQL ``WHERE`` clause.
+
+    Conditions on the ``array_fields`` match any of the array items.
+    """
+    clauses: list[str] = []
+    params: list = []
+    for field, condition in query.items():
+        if field in ("$and", "$or"):
+            compiled = [compile_query(sub, array_fields) for sub in condition]
+            joiner = " AND " if field == "$and" else " OR "
+            clauses.append(
+                "(" + joiner.join(clause for clause, _ in compiled) + ")"
+            )
+            for _, sub_params in compiled:
+                params.extend(sub_params)
+        else:
+            clause, sub_params = compile_condition(
+                field, condition, array_fields
+            )
+            clauses.append(clause)
+            params.extend(sub_params)
+    return " AND ".join(clauses) or "1", params
+
+
+def compile_pipeline(
+    stages: list[dict], array_fields: Collection[str] = ()
+) -> tuple[str, str, list]:
+    """Compile the ``$match``/``$sort``/``$skip``/``$limit`` stages.
+
+    ``$project`` is applied to the loaded documents.
+
+    Returns the ``WHERE`` clause, the trailing ``ORDER BY``/``LIMIT``
+    clauses and their parameters.
+    """
+    where: list[str] = []
+    params: list = []
+    order_by = ""
+    limit, offset = -1, 0
+    for stage in stages:
+        ((name, spec),) = stage.items()
+        if name == "$match":
+            clause, match_params = compile_query(spec, array_fields)
+            where.append(clause)
+            params.extend(match_params)
+        elif name == "$sort":
+            order_by = " ORDER BY " + ", ".join(
+                f"{field_expression(field)} {'ASC' if d == 1 else 'DESC'}"
+                for field, d in spec.items()
+            )
+        elif name == "$skip":
+            offset = spec
+        elif name == "$limit":
+            limit = spec
+        elif name not in ("$count", "$project"):
+            raise ValueError(f"unsupported stage: {name}")
+    tail = f"{order_by} LIMIT ? OFFSET ?"
+    return " AND ".join(where) or "1", tail, [*params, limit, offset]
+
+
+def array_fields(model) -> set[str]:
+    """Top level fields of ``model`` holding lists."""
+    fields = set()
+    for name, info in create_in_db_model(model).model_fields.items():
+        annotation = info.annotation
+        types = (
+            typing.get_args(annotation)
+            if typing.get_origin(annotation) in (typing.Union, UnionType)
+            else (annotation,)
+        )
+        if any(
+            kind is list or typing.get_origin(kind) is list for kind in types
+        ):
+            fields.add(info.alias or name)
+    return fields
+
+
+class SQLiteStorage(BaseStorage):
+    """Storage keeping the documents as JSON in a SQLite table.
+
+    Queries built by :func:`plan_find` are compiled into parameterized
+    SQL over ``json_extract`` expressions, backed by expression indexes
+    on the ``indexes`` fields and on the fields of the declared filters.
+    Every blocking call runs in a dedicated thread pool, each worker
+    thread owning its own connection.
+    """
+
+    def __init__(
+        self,
+        db: Any,
+        model,
+        collection: str | None = None,
+        database: str = ":memory:",
+        indexes: list[str] | None = None,
+        max_workers: int = 4,
+    ):
+        self.collection = collection or f"{model.__name__}"
+        self.model = model
+        self.db_model = create_in_db_model(model)
+        self.database = database
+        self.table = '"' + self.collection.replace('"', '""') + '"'
+        if database == ":memory:":
+            # Every connection to ":memory:" opens a different database
+            max_workers = 1
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix=f"sqlite-{self.collection}",
+        )
+        self._local = threading.local()
+        self.indexes = ["created", "updated", *(indexes or [])]
+        # Conditions on list fields match any item, like MongoDB
+        self.array_fields = array_fields(model)
+        self._ready: asyncio.Future | None = None
+
+    def compile_filters(self, parameters: list[str]):
+        """Precompile the declared query parameters and index their fields.
+
+        Substring searches and list fields are not served by expression
+        indexes and are left out.
+        """
+        super().compile_filters(parameters)
+        for parameter in parameters:
+            field, operator = normalize_parameter(parameter)
+            if (
+                operator in FILTER_CONTAINS_OPERATORS
+                or field in self.indexes
+                or field in self.array_fields
+                or not FIELD_PATTERN.match(field)
+            ):
+                continue
+            self.indexes.append(field)
+        # The new indexes are created with the schema, on the next call
+        self._ready = None
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.database, check_same_thread=False, timeout=30
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.create_function(
+                "REGEXP", 2, _regexp, deterministic=True
+            )
+            self._local.connection = connection
+        return connection
+
+    def _create_schema(self):
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} "
+                "(id TEXT PRIMARY KEY, doc TEXT NOT NULL)"
+            )
+            for field in self.indexes:
+                name = f"{self.collection}_{field}".replace('"', "")
+                connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS "ix_{name}" '
+                    f"ON {self.table} ({field_expression(field)})"
+                )
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        if self._ready is None:
+            self._ready = loop.run_in_executor(
+                self.executor, self._create_schema
+            )
+        await self._ready
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def _fetch(self, sql: str, params: list) -> list:
+        return self._connection().execute(sql, params).fetchall()
+
+    async def get(
+        self,
+        uid: str,
+        fields: list[str] | None = None,
+        expand: list[str] | None = None,
+    ):
+        if expand:
+            raise HTTPException(
+                status_code=400,
+                detail=f"cannot expand: {', '.join(expand)}",
+            )
+        model = self.result_model(fields)
+        rows = await self._run(
+            self._fetch, f"SELECT doc FROM {self.table} WHERE id = ?", [uid]
+        )
+        if not rows:
+            raise HTTPException(
+                status_code=404,
+                detail=f"{uid=} was not found in {self.collection}",
+            )
+        return self.build_item(model, json.loads(rows[0][0]))
+
+    async def get_many(
+        self, uids: list[str], fields: list[str] | None = None
+    ) -> list:
+        model = self.result_model(fields)
+        found = {}
+        for chunk in chunked(list(dict.fromkeys(uids)), MAX_VARIABLES):
+            placeholders = ", ".join("?" * len(chunk))
+            rows = await self._run(
+                self._fetch,
+                f"SELECT id, doc FROM {self.table} "
+                f"WHERE id IN ({placeholders})",
+                list(chunk),
+            )
+            found.update(
+                (uid, self.build_item(model, json.loads(doc)))
+                for uid, doc in rows
+            )
+        return [found.get(uid) for uid in uids]
+
+    def _insert(self, docs: list[dict]):
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                f"INSERT INTO {self.table} (id, doc) VALUES (?, ?)",
+                [(doc["_id"], json.dumps(doc)) for doc in docs],
+            )
+
+    async def create(self, items):
+        docs = [create_document(item) for item in items]
+        try:
+            await self._run(self._insert, docs)
+        except sqlite3.Error as err:
+            raise HTTPException(status_code=500, detail=str(err))
+        return docs
+
+    def _write(self, sql: str, rows: list[tuple]) -> list[int]:
+        return self._write_each([(sql, row) for row in rows])
+
+    def _write_each(self, statements: list[tuple[str, list]]) -> list[int]:
+        connection = self._connection()
+        with connection:
+            return [
+                connection.execute(sql, params).rowcount
+                for sql, params in statements
+            ]
+
+    async def update(self, items):
+        updated = jsonable_encoder(datetime.now())
+        statements = []
+        for item in items:
+            changes = {
+                **item.model_dump(
+                    mode="json",
+                    exclude_unset=True,
+                    exclude={"id", "created", "updated"},
+                ),
+                "updated": updated,
+            }
+            # Top level fields are replaced whole, like with MongoDB $set
+            assignments = ", ".join("?, json(?)" for _ in changes)
+            params = [
+                param
+                for field, value in changes.items()
+                for param in (f'$."{field}"', json.dumps(value))
+            ]
+            statements.append(
+                (
+                    f"UPDATE {self.table} "
+                    f"SET doc = json_set(doc, {assignments}) WHERE id = ?",
+                    [*params, item.id],
+                )
+            )
+        counts = await self._run(self._write_each, statements)
+        return self._write_report(items, counts)
+
+    async def replace(self, items):
+        rows = [
+            (item.model_dump_json(by_alias=True), item.id) for item in items
+        ]
+        # The creation date is kept
+        counts = await self._run(
+            self._write,
+            f"UPDATE {self.table} SET doc = json_set(json(?), '$.created', "
+            "json_extract(doc, '$.created')) WHERE id = ?",
+            rows,
+        )
+        return self._write_report(items, counts)
+
+    @staticmethod
+    def _write_report(items, counts: list[int]) -> dict:
+        statuses = [
+            {"_id": item.id, "status": "ok" if count else "not_found"}
+            for item, count in zip(items, counts)
+        ]
+        matched = sum(1 for count in counts if count)
+        return {
+            "matched_count": matched,
+            "modified_count": matched,
+            "items": statuses,
+        }
+
+    async def delete(self, uids):
+        rows = [tuple(chunk) for chunk in chunked(uids, MAX_VARIABLES)]
+        counts = []
+        for row in rows:
+            placeholders = ", ".join("?" * len(row))
+            counts += await self._run(
+                self._write,
+                f"DELETE FROM {self.table} WHERE id IN ({placeholders})",
+                [row],
+            )
+        return {"deleted_count": sum(counts)}
+
+    def plan(self, common, common_match, filters, facets) -> FindPlan:
+        self.result_model(common.get("fields"))
+        try:
+            return plan_find(
+                common,
+                common_match | filters,
+                facets,
+                builders=self.query_builders,
+            )
+        except ValueError as err:
+            raise HTTPException(status_code=400, detail=str(err))
+
+    def compile(self, plan: FindPlan) -> dict[str, tuple[str, list]]:
+        """Compile a plan into the SQL statements answering it.
+
+        The statements are named ``page``, ``count`` and ``facet:`` the
+        facet field, which may itself be named ``page`` or ``count``.
+        """
+        where, tail, params = compile_pipeline(plan.page, self.array_fields)
+        statements = {
+            "page": (
+                f"SELECT doc FROM {self.table} WHERE {where}{tail}",
+                params,
+            )
+        }
+        where, tail, params = compile_pipeline(
+            plan.count, self.array_fields
+        )
+        statements["count"] = (
+            f"SELECT COUNT(*) FROM {self.table} WHERE {where}",
+            params[:-2],
+        )
+        if plan.count_mode == "capped":
+            statements["count"] = (
+                f"SELECT COUNT(*) FROM (SELECT 1 FROM {self.table} "
+                f"WHERE {where}{tail})",
+                params,
+            )
+        for stage in (plan.facets or [])[len(plan.match) :]:
+            for field in stage["$facet"]:
+                statements[f"{FACET_PREFIX}{field}"] = (
+                    f"SELECT {field_expression(field)} AS value, "
+                    f"{field_expression(field, 'json_type')} AS type, "
+                    f"COUNT(*) AS count FROM {self.table} WHERE {where} "
+                    "GROUP BY value, type ORDER BY count DESC, value",
+                    params[:-2],
+                )
+        return statements
+
+    async def explain(self, common, common_match, filters, facets) -> dict:
+        plan = self.plan(common, common_match, filters, facets)
+        explanation = plan.explain()
+        explanation["sql"] = {}
+        for name, (sql, params) in self.compile(plan).items():
+            rows = await self._run(
+                self._fetch, f"EXPLAIN QUERY PLAN {sql}", params
+            )
+            explanation["sql"][name] = {
+                "statement": sql,
+                "plan": [row[-1] for row in rows],
+            }
+        return explanation
+
+    async def find(
+        self, common, common_match, filters, facets, *args, **kwargs
+    ):
+        plan = self.plan(common, common_match, filters, facets)
+        try:
+            statements = self.compile(plan)
+        except ValueError as err:
+            raise HTTPException(status_code=400, detail=str(err))
+
+        names = list(statements)
+        rows = await asyncio.gather(
+            *(self._run(self._fetch, *statements[name]) for name in names)
+        )
+        answers = dict(zip(names, rows))
+        results, next_cursor = plan.paginate(
+            [json.loads(doc) for (doc,) in answers.pop("page")]
+        )
+        if plan.projection:
+            results = [
+                project_document(doc, plan.projection) for doc in results
+            ]
+        (count,) = answers.pop("count")[0]
+        return {
+            **{
+                name[len(FACET_PREFIX) :]: [
+                    {"_id": json_value(value, json_type), "count": n}
+                    for value, json_type, n in rows
+                ]
+                for name, rows in answers.items()
+            },
+            "metadata": {
+                **plan.count_metadata(count),
+                "next": next_cursor,
+            },
+            "results": results,
+        }
+
+    async def export(
+        self,
+        common_match,
+        filters,
+        ordering: str | None = None,
+        batch_size: int = 1000,
+    ):
+        # Walk the result set with keyset pagination, batch by batch
+        common = {
+            "limit": batch_size,
+            "ordering": ordering,
+            "pagination": "cursor",
+        }
+        while True:
+            plan = self.plan(common, common_match, filters, [])
+            where, tail, params = compile_pipeline(
+                plan.page, self.array_fields
+            )
+            rows = await self._run(
+                self._fetch,
+                f"SELECT doc FROM {self.table} WHERE {where}{tail}",
+                params,
+            )
+            results, next_cursor = plan.paginate(
+                [json.loads(doc) for (doc,) in rows]
+            )
+            for doc in results:
+                yield json.dumps(doc) + "\n"
+            if next_cursor is None:
+                break
+            common["cursor"] = next_cursor
@@ -1,4 +1,9 @@
 import asyncio
+import base64
+import binascii
+import functools
+import json
+import re
 import typing
 import uuid
 from datetime import datetime, timezone
@@ -12,14 +17,61 @@ FILTER_CONTAINS_OPERATORS = ["contains", "icontains"]
 FILTER_LIST_OPERATORS = ["in", "nin"]
 FILTER_RANGE_OPERATORS = ["gt", "gte", "lt", "lte"]
 MONGODB_LIST_OPERATORS = ["$in", "$nin"]
+SEARCH_STRATEGIES = ["regex", "prefix", "text", "ngram"]
+NGRAM_SIZE = 3
+NGRAMS_FIELD = "_ngrams"
+# Types of the keyset values of a cursor, dates are decoded from $date
+CURSOR_TYPES = (str, int, float, bool, datetime, type(None))
 
 
-async def run_async_or_sync(func: typing.Callable, *args, **kwargs):
+async def run_async_or_sync(
+    func: typing.Callable, *args, executor=None, offload=True, **kwargs
+):
+    """Await ``func`` or, when it is synchronous, run it off the loop.
+
+    Synchronous functions run in ``executor``, a
+    :class:`fastcrud.executors.BoundedExecutor`, or in the default
+    executor of the loop, so blocking code never stalls other requests.
+    Without ``offload`` they run on the loop thread, for code bound to
+    one thread such as a ``sqlite3`` connection.
+    """
     if asyncio.iscoroutinefunction(func):
         return await func(*args, **kwargs)
-    return func(*args, **kwargs)
+    if not offload:
+        return func(*args, **kwargs)
+    if executor is not None:
+        return await executor.run(func, *args, **kwargs)
+    return await asyncio.to_thread(func, *args, **kwargs)
+
+
+def chunked(items: Sequence, size: int) -> typing.Iterator[Sequence]:
+    """Split ``items`` in chunks of at most ``size`` elements."""
+    for index in range(0, len(items), size):
+        yield items[index : index + size]
+
+
+def get_field_value(doc: dict, field: str):
+    """Get the value of a dotted ``field`` path in a document."""
+    for part in field.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def create_document(
+    item: pydantic.BaseModel, dump: typing.Callable | None = None
+) -> dict:
+    """Build the document stored for a newly created ``item``.
 
+    ``dump`` serializes the item, JSON ``model_dump`` by default.
+    """
+    # Serialize once, the items were validated by the route
+    doc = dump(item) if dump else item.model_dump(mode="json")
+    return {"_id": str(uuid.uuid1()), **doc, "created": doc["updated"]}
 
+
+@functools.cache
 def create_in_db_model(model):
     return pydantic.create_model(
         f"{model.__name__}InDb",
@@ -28,10 +80,57 @@ def create_in_db_model(model):
     )
 
 
+@functools.lru_cache(maxsize=256)
+def create_partial_model(model, fields: tuple[str, ...]):
+    """Model of the documents projected on ``fields``, ``_id`` included.
+
+    Raises :class:`ValueError` on fields the model does not declare.
+    """
+    db_model = create_in_db_model(model)
+    unknown = set(fields) - set(db_model.model_fields) - {"_id"}
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+    return pydantic.create_model(
+        f"{model.__name__}Partial",
+        **{
+            name: (info.annotation, info)
+            for name, info in db_model.model_fields.items()
+            if name == "id" or name in fields
+        },
+    )
+
+
+def project_document(doc: dict, projection: dict) -> dict:
+    """Apply an inclusion ``$project`` of dotted fields to ``doc``."""
+    projected: dict = {"_id": doc["_id"]} if "_id" in doc else {}
+    for field in projection:
+        source, target = doc, projected
+        *parents, last = field.split(".")
+        for part in parents:
+            source = source.get(part) if isinstance(source, dict) else None
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(part, {})
+        else:
+            if last in source:
+                target[last] = source[last]
+    return projected
+
+
+@functools.cache
+def create_replace_model(model):
+    """Model of the replaced items, their ``_id`` is required."""
+    return pydantic.create_model(
+        f"{model.__name__}Replace",
+        id=(str, pydantic.Field(alias="_id")),
+        __base__=create_in_db_model(model),
+    )
+
+
 def create_update_model(model, exclude: list[str] | None = None):
     return pydantic.create_model(
         f"{model.__name__}Update",
-        __base__=create_in_db_model(model),
+        __base__=create_replace_model(model),
         **{
             field: (model.model_fields[field].annotation, None)
             for field in model.model_fields
@@ -50,27 +149,135 @@ def datetime_to_iso8601_with_z_suffix(value: datetime) -> str:
     return formatted_datetime
 
 
-def build_parameter(parameter: str, operator: str | None, value: Any) -> dict:
-    """Build parameter dictionary."""
+def _cursor_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"{type(value).__name__} is not cursor serializable")
+
+
+def _cursor_object_hook(value: dict) -> Any:
+    if list(value) == ["$date"]:
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+
+def encode_cursor(values: list) -> str:
+    """Encode keyset values into an opaque continuation token."""
+    payload = json.dumps(
+        values, default=_cursor_default, separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    """Decode a continuation token built by :func:`encode_cursor`."""
+    try:
+        values = json.loads(
+            base64.urlsafe_b64decode(cursor.encode()),
+            object_hook=_cursor_object_hook,
+        )
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as err:
+        raise ValueError(f"invalid cursor: {err}")
+    if not isinstance(values, list):
+        raise ValueError("invalid cursor: expected a list of values")
+    # The values end up in $match, anything else could inject operators
+    if not all(isinstance(value, CURSOR_TYPES) for value in values):
+        raise ValueError("invalid cursor: expected scalar values")
+    return values
+
+
+def build_parameter(
+    parameter: str,
+    operator: str | None,
+    value: Any,
+    search: str | None = None,
+    encode: typing.Callable | None = None,
+) -> dict:
+    """Build parameter dictionary.
+
+    ``search`` is the strategy of ``contains``/``icontains`` parameters,
+    see :func:`build_search_parameter`. ``encode`` converts the values
+    like the storage encodes documents, see :func:`normalize_value`.
+    """
     match_stages_dict: dict = {}
     if operator:
         if operator in FILTER_CONTAINS_OPERATORS:
-            match_stages_dict[parameter] = {}
-            match_stages_dict[parameter]["$regex"] = f".*{value}.*"
-            if operator == "icontains":
-                match_stages_dict[parameter]["$options"] = "i"
+            match_stages_dict = build_search_parameter(
+                parameter, operator, value, search or "regex"
+            )
         else:
             match_stages_dict[parameter] = {}
             match_stages_dict[parameter][operator] = normalize_value(
-                value, operator
+                value, operator, encode
             )
     else:
-        match_stages_dict = {parameter: normalize_value(value, operator)}
+        match_stages_dict = {
+            parameter: normalize_value(value, operator, encode)
+        }
     return match_stages_dict
 
 
+def build_search_parameter(
+    parameter: str, operator: str, value: Any, search: str
+) -> dict:
+    """Build a substring search parameter dictionary.
+
+    The value is always escaped. Strategies:
+
+    * ``regex``: unanchored regex, scans the whole index or collection,
+    * ``prefix``: regex anchored at the start, served by a B-tree index
+      when case sensitive,
+    * ``text``: phrase search on the text index, matching whole words
+      in any of the text indexed fields whatever ``parameter``, and
+      case insensitively whatever ``operator``. MongoDB accepts a
+      single text search per query,
+    * ``ngram``: requires every n-gram of the value in the n-grams field
+      maintained by the storage, then checks the regex on the
+      candidates. Documents written before the strategy was enabled
+      need a backfill, see ``MongoStorage.backfill_ngrams``.
+    """
+    value = str(value)
+    regex = {"$regex": re.escape(value)}
+    if operator == "icontains":
+        regex["$options"] = "i"
+
+    if search == "prefix":
+        return {parameter: {**regex, "$regex": f"^{regex['$regex']}"}}
+    if search == "text":
+        phrase = value.replace("\\", "\\\\").replace('"', '\\"')
+        return {"$text": {"$search": f'"{phrase}"'}}
+    if search == "ngram" and len(value) >= NGRAM_SIZE:
+        return {
+            "$and": [
+                {ngrams_field(parameter): {"$all": ngrams(value)}},
+                {parameter: regex},
+            ]
+        }
+    return {parameter: regex}
+
+
+def ngrams_field(parameter: str) -> str:
+    return f"{NGRAMS_FIELD}.{parameter.replace('.', '__')}"
+
+
+def ngrams(value: Any, size: int = NGRAM_SIZE) -> list[str]:
+    """Lower case n-grams of a value, used for substring search."""
+    if not isinstance(value, str):
+        return []
+    value = value.lower()
+    return sorted(
+        {value[index : index + size] for index in range(len(value) - size + 1)}
+    )
+
+
 def normalize_parameter(parameter: str) -> tuple[str, str | None]:
-    """Normalize parameter."""
+    """Normalize parameter.
+
+    ``field__operator`` parameters are split into a dotted field path and
+    an operator: ``gt``, ``gte``, ``lt``, ``lte``, ``in`` and ``nin`` map
+    to the MongoDB operators, ``contains`` and ``icontains`` to a regex,
+    and any other ``__`` separator denotes a nested field.
+    """
     LOGGER.debug("Normalizing parameter: '%s'", parameter)
     operator = None
 
@@ -95,9 +302,21 @@ def normalize_parameter(parameter: str) -> tuple[str, str | None]:
 
 
 def normalize_value(
-    value: str | bool | datetime, operator: str | None
+    value: str | bool | datetime,
+    operator: str | None,
+    encode: typing.Callable | None = None,
 ) -> str | bool | Sequence[str | bool | datetime]:
-    """Normalize value."""
+    """Normalize value.
+
+    Without ``encode``, datetimes are compared as ISO 8601 strings.
+    """
+    if encode is not None:
+        if operator in MONGODB_LIST_OPERATORS:
+            return [
+                encode(item)
+                for item in normalize_mongodb_list_operators(value, operator)
+            ]
+        return encode(value)
     if isinstance(value, datetime):
         return datetime_to_iso8601_with_z_suffix(value)
     elif operator in MONGODB_LIST_OPERATORS:
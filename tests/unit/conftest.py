@@ -0,0 +1,115 @@
+import importlib.util
+
+import pytest
+import pytest_asyncio
+
+from fastcrud.core import BaseCrudModel
+from fastcrud.storage.columnar import ColumnarStorage
+from fastcrud.storage.memory import MemoryStorage
+from fastcrud.storage.sqlite import SQLiteStorage
+
+COMMON = {
+    "limit": 10,
+    "offset": 0,
+    "ordering": None,
+    "pagination": "offset",
+    "cursor": None,
+    "fields": None,
+    "expand": None,
+    "count": None,
+    "count_cap": None,
+}
+
+
+class Product(BaseCrudModel):
+    name: str
+    type: str
+    rank: int | None = None
+    tags: list[str] = []
+    meta: dict | None = None
+
+
+PRODUCTS = [
+    {
+        "name": "alpha",
+        "type": "a",
+        "rank": 3,
+        "tags": ["p", "q"],
+        "meta": {"k": 1},
+    },
+    {"name": "Beta", "type": "b", "rank": 1, "tags": ["q"]},
+    {"name": "gamma", "type": "a", "rank": 5, "tags": []},
+    {
+        "name": "delta",
+        "type": "c",
+        "rank": 2,
+        "tags": ["p", "q"],
+        "meta": {"k": 2},
+    },
+    {"name": "epsilon", "type": "a", "rank": 4, "tags": ["r"]},
+    {"name": "a.b", "type": "b", "rank": 6, "tags": []},
+]
+
+STORAGES = {
+    "memory": lambda: MemoryStorage(
+        None,
+        Product,
+        "products",
+        hash_indexes=["type"],
+        sorted_indexes=["rank"],
+    ),
+    "sqlite": lambda: SQLiteStorage(None, Product, "products"),
+    "columnar": lambda: ColumnarStorage(
+        None, Product, "products", categorical=["type"], numeric=["rank"]
+    ),
+}
+
+
+async def find(storage, facets=(), **parameters) -> dict:
+    """Call ``storage.find`` with the common and filter parameters."""
+    common = dict(COMMON)
+    filters = {}
+    for name, value in parameters.items():
+        if name in COMMON:
+            common[name] = value
+        else:
+            filters[name] = value
+    return await storage.find(common, {}, filters, list(facets))
+
+
+async def walk(storage, **parameters) -> list[dict]:
+    """Every document of a cursor paginated ``find``."""
+    results, cursor = [], None
+    while True:
+        page = await find(
+            storage, pagination="cursor", cursor=cursor, **parameters
+        )
+        results += page["results"]
+        cursor = page["metadata"]["next"]
+        if cursor is None:
+            return results
+
+
+# numpy is an optional dependency, see the columnar extra
+NUMPY_MISSING = importlib.util.find_spec("numpy") is None
+
+
+@pytest.fixture(
+    params=[
+        pytest.param(
+            name,
+            marks=pytest.mark.skipif(
+                name == "columnar" and NUMPY_MISSING,
+                reason="requires numpy",
+            ),
+        )
+        for name in STORAGES
+    ]
+)
+def storage(request):
+    return STORAGES[request.param]()
+
+
+@pytest_asyncio.fixture
+async def products(storage):
+    return await storage.create([Product(**doc) for doc in PRODUCTS])
@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from fastcrud.storage.batching import WriteCoalescer
+
+pytestmark = pytest.mark.asyncio
+
+
+class Collection:
+    """Inserts documents, failing the ones marked as duplicates."""
+
+    def __init__(self):
+        self.writes: list[list[str]] = []
+        self.docs: list[dict] = []
+
+    async def insert_many(self, docs: list[dict], ordered: bool):
+        self.writes.append([doc["_id"] for doc in docs])
+        errors = []
+        for index, doc in enumerate(docs):
+            if not doc.get("duplicate"):
+                self.docs.append(doc)
+                continue
+            errors.append({"index": index, "code": 11000})
+            if ordered:
+                break
+        if errors:
+            raise BulkWriteError(
+                {"writeErrors": errors, "nInserted": len(self.docs)}
+            )
+
+
+def documents(prefix: str, size: int, duplicates=()) -> list[dict]:
+    return [
+        {"_id": f"{prefix}{index}", "duplicate": index in duplicates}
+        for index in range(size)
+    ]
+
+
+async def submit_all(coalescer, *requests) -> list:
+    return await asyncio.gather(
+        *(coalescer.submit(docs) for docs in requests),
+        return_exceptions=True,
+    )
+
+
+async def test_flushes_are_written_in_batches():
+    collection = Collection()
+    coalescer = WriteCoalescer(
+        collection.insert_many, max_items=100, max_delay=0.01, batch_size=5
+    )
+    requests = [documents("a", 7), documents("b", 5), documents("c", 5)]
+    results = await submit_all(coalescer, *requests)
+    assert results == requests
+    assert [len(ids) for ids in collection.writes] == [5, 5, 5, 2]
+    assert [doc["_id"] for doc in collection.docs] == [
+        doc["_id"] for docs in requests for doc in docs
+    ]
+    stats = coalescer.stats
+    assert (stats["flushes"], stats["requests"], stats["writes"]) == (
+        1,
+        3,
+        4,
+    )
+    assert stats["documents"] == 17
+    assert stats["requests_per_flush"] == 3
+    assert stats["batch_sizes"] == {32: 1}
+
+    # Reaching max_items flushes without waiting for the delay
+    coalescer.max_items, coalescer.max_delay = 3, 60
+    assert await coalescer.submit(documents("d", 3)) == documents("d", 3)
+    assert coalescer.stats["flushes"] == 2
+
+
+async def test_errors_are_split_by_request():
+    collection = Collection()
+    coalescer = WriteCoalescer(
+        collection.insert_many, max_items=100, batch_size=3
+    )
+    first, second, third = await submit_all(
+        coalescer,
+        documents("a", 2, duplicates={1}),
+        documents("b", 3, duplicates={0}),
+        documents("c", 2),
+    )
+    assert isinstance(first, BulkWriteError)
+    assert first.details == {
+        "writeErrors": [{"index": 1, "code": 11000}],
+        "nInserted": 1,
+    }
+    assert second.details == {
+        "writeErrors": [{"index": 0, "code": 11000}],
+        "nInserted": 2,
+    }
+    assert third == documents("c", 2)
+    assert len(collection.docs) == 5
+    assert coalescer.stats["write_errors"] == 2
+
+
+async def test_ordered_writes_stop_at_the_first_error():
+    collection = Collection()
+    coalescer = WriteCoalescer(
+        collection.insert_many, max_items=100, batch_size=2, ordered=True
+    )
+    first, second, third = await submit_all(
+        coalescer,
+        documents("a", 1),
+        documents("b", 3, duplicates={1}),
+        documents("c", 1),
+    )
+    assert first == documents("a", 1)
+    assert second.details == {
+        "writeErrors": [{"index": 1, "code": 11000}],
+        "nInserted": 1,
+    }
+    # Not attempted after the error, so without errors of its own
+    assert third.details == {"writeErrors": [], "nInserted": 0}
+    assert collection.writes == [["a0", "b0"], ["b1", "b2"]]
+
+
+async def test_failed_flushes_fail_every_request():
+    async def insert_many(docs, ordered):
+        raise ConnectionError("unreachable")
+
+    coalescer = WriteCoalescer(insert_many, max_items=100)
+    results = await submit_all(
+        coalescer, documents("a", 1), documents("b", 1)
+    )
+    assert [type(result) for result in results] == [ConnectionError] * 2
+    assert coalescer.stats["failed_flushes"] == 1
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from demo.schemas import ItemModel
+from fastcrud.bulk import BulkValidationError, BulkValidator
+
+
+def body(size: int, invalid: int | None = None) -> bytes:
+    items = [
+        {"name": f"name {index}", "des": "des", "type": "t"}
+        for index in range(size)
+    ]
+    if invalid is not None:
+        items[invalid] = {"name": 1}
+    return json.dumps(items).encode()
+
+
+@pytest.fixture
+def validator():
+    validator = BulkValidator(threshold=100, chunk_size=7, processes=1)
+    yield validator
+    validator.shutdown()
+
+
+async def chunks(validator, payload: bytes, kind: str = "create") -> list:
+    return [
+        items async for items in validator.validate(ItemModel, kind, payload)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_small_bodies_are_validated_in_place(validator):
+    validator.threshold = 1024 * 1024
+    (items,) = await chunks(validator, body(20))
+    assert [item.name for item in items] == [f"name {i}" for i in range(20)]
+    assert validator._executor is None
+
+
+@pytest.mark.asyncio
+async def test_large_bodies_are_validated_in_chunks(validator):
+    results = await chunks(validator, body(20))
+    assert [len(items) for items in results] == [7, 7, 6]
+    items = [item for items in results for item in items]
+    assert isinstance(items[0], ItemModel)
+    assert items[19].name == "name 19"
+    assert items[0].model_fields_set == {"name", "des", "type"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("threshold", [100, 1024 * 1024])
+async def test_errors_are_located_in_the_body(validator, threshold):
+    validator.threshold = threshold
+    with pytest.raises(BulkValidationError) as err:
+        await chunks(validator, body(20, invalid=17))
+    locations = [error["loc"] for error in err.value.errors]
+    assert ["body", 17, "name"] in locations
+
+
+@pytest.mark.asyncio
+async def test_invalid_json(validator):
+    with pytest.raises(BulkValidationError) as err:
+        await chunks(validator, b"{" * 200)
+    assert err.value.errors[0]["type"] == "json_invalid"
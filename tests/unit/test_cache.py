@@ -0,0 +1,58 @@
+import pytest
+
+from fastcrud.storage.cache import CachedStorage, LRUCache, QueryCache
+from tests.unit.conftest import PRODUCTS, Product
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=None)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b", None) is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats["evictions"] == 1
+
+
+def test_lru_cache_expires(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(
+        "fastcrud.storage.cache.time.monotonic", lambda: now[0]
+    )
+    cache = LRUCache(maxsize=2, ttl=5.0)
+    cache.set("a", 1)
+    now[0] += 5.0
+    assert cache.get("a") == 1
+    now[0] += 0.1
+    assert cache.get("a", None) is None
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_query_cache_generations():
+    cache = QueryCache(maxsize=8)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return len(calls)
+
+    stages = [{"$match": {"type": "a"}}]
+    assert await cache.fetch("products", "page", stages, loader) == 1
+    assert await cache.fetch("products", "page", stages, loader) == 1
+    cache.bump("products")
+    assert await cache.fetch("products", "page", stages, loader) == 2
+
+
+@pytest.mark.asyncio
+async def test_cached_storage(storage):
+    cached = CachedStorage(storage, maxsize=8, ttl=None)
+    (doc,) = await cached.create([Product(**PRODUCTS[0])])
+    items = await cached.get_many([doc["_id"], "missing", doc["_id"]])
+    assert [item and item.name for item in items] == ["alpha", None, "alpha"]
+    assert cached.stats["size"] == 1
+    assert (await cached.get(doc["_id"])).name == "alpha"
+    assert cached.stats["hits"] == 1
+    await cached.delete([doc["_id"]])
+    assert cached.stats["size"] == 0
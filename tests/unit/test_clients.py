@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+import pytest
+
+from fastcrud.storage.clients import MongoClientRegistry, PoolStats
+
+
+def test_clients_are_shared_by_url_and_options():
+    registry = MongoClientRegistry()
+    client = registry.get("mongodb://localhost:27017", maxPoolSize=10)
+    assert registry.get("mongodb://localhost:27017", maxPoolSize=10) is client
+    assert registry.get("mongodb://localhost:27017", maxPoolSize=20) is not (
+        client
+    )
+    assert registry.get("mongodb://other:27017", maxPoolSize=10) is not (
+        client
+    )
+    assert registry.key("url", b=1, a=2) == registry.key("url", a=2, b=1)
+
+    # Clients do not connect before the startup
+    stats = registry.stats()
+    assert [entry["options"] for entry in stats] == [
+        {"maxPoolSize": 10},
+        {"maxPoolSize": 20},
+        {"maxPoolSize": 10},
+    ]
+    assert stats[0]["pool"]["open"] == 0
+
+
+def test_pool_stats():
+    stats = PoolStats()
+    event = SimpleNamespace()
+    for _ in range(3):
+        stats.connection_created(event)
+    stats.connection_checked_out(event)
+    stats.connection_checked_out(event)
+    stats.connection_checked_in(event)
+    stats.connection_closed(event)
+    stats.connection_check_out_failed(event)
+    stats.pool_cleared(event)
+    assert stats.as_dict() == {
+        "open": 2,
+        "checked_out": 1,
+        "idle": 1,
+        "check_out_failures": 1,
+        "cleared": 1,
+    }
+
+
+@pytest.mark.asyncio
+async def test_lifespan_pings_and_closes():
+    registry = MongoClientRegistry()
+    registry.get("mongodb://localhost:27017")
+    events = []
+
+    async def command(name):
+        events.append(name)
+        return {"ok": 1}
+
+    # Stand-in of the client, no server is reachable in the tests
+    (key,) = registry._clients
+    registry._clients[key] = SimpleNamespace(
+        admin=SimpleNamespace(command=command),
+        close=lambda: events.append("close"),
+    )
+    async with registry.lifespan(None):
+        assert events == ["ping"]
+    assert events == ["ping", "close"]
@@ -0,0 +1,15 @@
+import pytest
+
+from fastcrud.storage.columnar import ColumnarStorage
+from tests.unit.conftest import Product
+
+pytest.importorskip("numpy")
+
+
+def test_datetime_columns():
+    storage = ColumnarStorage(None, Product, "products", numeric=["rank"])
+    assert list(storage.columns) == ["rank", "created", "updated"]
+    storage = ColumnarStorage(
+        None, Product, "products", numeric=["rank"], datetimes=[]
+    )
+    assert list(storage.columns) == ["rank"]
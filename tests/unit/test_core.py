@@ -0,0 +1,278 @@
+import json
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+
+from demo.dependencies import item_query_params
+from demo.schemas import ItemModel
+from fastcrud.core import CRUDRouter
+from fastcrud.storage.commun import BaseStorage
+from fastcrud.storage.memory import MemoryStorage
+from fastcrud.utils import create_document, create_in_db_model
+
+
+@pytest.fixture(
+    params=[(False, None), (True, None), (True, {"processes": 1})],
+    ids=["validated", "fast", "bulk"],
+)
+def client(request):
+    fast_responses, bulk_settings = request.param
+    router = CRUDRouter(
+        collection="items",
+        model=ItemModel,
+        prefix="/item",
+        storage_cls=MemoryStorage,
+        filters=item_query_params,
+        fast_responses=fast_responses,
+        bulk_settings=bulk_settings,
+        facet_settings={"fields": ["type"]},
+    )
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+    client.fast_responses = fast_responses
+    return client
+
+
+def test_crud(client):
+    response = client.post(
+        "/item/",
+        json=[
+            {"name": f"name {index}", "des": "des", "type": "a"}
+            for index in range(3)
+        ],
+    )
+    assert response.status_code == 200
+    uids = [doc["_id"] for doc in response.json()]
+
+    assert client.get(f"/item/{uids[0]}").json()["name"] == "name 0"
+    response = client.get(f"/item/{uids[0]}", params={"fields": "name"})
+    assert response.json() == {"_id": uids[0], "name": "name 0"}
+    batch = client.get("/item/batch", params={"uid": [uids[1], "x"]}).json()
+    assert [doc["name"] for doc in batch["results"]] == ["name 1"]
+    assert batch["missing"] == ["x"]
+
+    report = client.patch("/item/", json=[{"_id": uids[0], "type": "b"}])
+    assert report.json()["matched_count"] == 1
+    page = client.get("/item/", params={"facets": "type"}).json()
+    assert page["type"] == [{"_id": "a", "count": 2}, {"_id": "b", "count": 1}]
+
+    assert client.delete("/item/", params={"uids": uids[:2]}).json() == {
+        "deleted_count": 2
+    }
+    assert client.get(f"/item/{uids[0]}").status_code == 404
+
+
+def test_get_responses(client, monkeypatch):
+    (doc,) = client.post(
+        "/item/", json=[{"name": "name", "des": "des", "type": "a"}]
+    ).json()
+    encoded = []
+
+    def encoder(*args, **kwargs):
+        encoded.append(args)
+        return jsonable_encoder(*args, **kwargs)
+
+    monkeypatch.setattr("fastcrud.core.jsonable_encoder", encoder)
+    assert client.get(f"/item/{doc['_id']}").json() == doc
+    response = client.get(f"/item/{doc['_id']}", params={"fields": "type"})
+    assert response.json() == {"_id": doc["_id"], "type": "a"}
+    response = client.get("/item/batch", params={"uid": [doc["_id"], "x"]})
+    assert response.json() == {"results": [doc], "missing": ["x"]}
+    response = client.get(
+        "/item/batch", params={"uid": doc["_id"], "fields": "name"}
+    )
+    assert response.json() == {
+        "results": [{"_id": doc["_id"], "name": "name"}],
+        "missing": [],
+    }
+    assert client.get("/item/missing").status_code == 404
+    # Fast responses are serialized by pydantic-core only
+    assert (encoded == []) == client.fast_responses
+
+
+def test_writes_require_ids(client):
+    (doc,) = client.post(
+        "/item/", json=[{"name": "name", "des": "des", "type": "a"}]
+    ).json()
+    for method in ("patch", "put"):
+        response = client.request(
+            method,
+            "/item/",
+            json=[{"name": "name", "des": "des", "type": "b"}],
+        )
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["loc"] == ["body", 0, "_id"]
+    report = client.put(
+        "/item/",
+        json=[{**doc, "type": "b"}, {**doc, "_id": "missing"}],
+    ).json()
+    assert [item["status"] for item in report["items"]] == ["ok", "not_found"]
+
+
+def test_cursor_pagination(client):
+    client.post(
+        "/item/",
+        json=[
+            {"name": f"name {index}", "des": "des", "type": "a"}
+            for index in range(5)
+        ],
+    )
+    names, cursor = [], None
+    while True:
+        params = {"ordering": "name", "limit": 2, "pagination": "cursor"}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get("/item/", params=params).json()
+        names += [doc["name"] for doc in page["results"]]
+        cursor = page["metadata"]["next"]
+        if cursor is None:
+            break
+    assert names == [f"name {index}" for index in range(5)]
+    response = client.get("/item/", params={"cursor": "garbage"})
+    assert response.status_code == 400
+
+
+class DictStorage(BaseStorage):
+    """Custom storage implementing the abstract methods only."""
+
+    def __init__(self, db, model, collection):
+        self.model = model
+        self.db_model = create_in_db_model(model)
+        self.docs = {}
+
+    def get(self, uid):
+        if uid not in self.docs:
+            raise HTTPException(status_code=404, detail=f"{uid=}")
+        return self.db_model(**self.docs[uid])
+
+    def create(self, items):
+        docs = [create_document(item) for item in items]
+        self.docs.update((doc["_id"], doc) for doc in docs)
+        return docs
+
+    def update(self, items):
+        for item in items:
+            self.docs[item.id].update(
+                item.model_dump(mode="json", exclude_unset=True)
+            )
+        return {"matched_count": len(items), "modified_count": len(items)}
+
+    def replace(self, items):
+        ...
+
+    def delete(self, uids):
+        for uid in uids:
+            self.docs.pop(uid, None)
+        return {"deleted_count": len(uids)}
+
+    def find(self, common, common_match, filters, facets):
+        docs = [
+            doc
+            for doc in self.docs.values()
+            if all(
+                doc.get(key) == value
+                for key, value in (filters or {}).items()
+            )
+        ]
+        start = common["offset"]
+        return {
+            "metadata": {"count": len(docs), "next": None},
+            "results": docs[start : start + common["limit"]],
+        }
+
+
+def test_custom_storage_defaults():
+    router = CRUDRouter(
+        collection="items",
+        model=ItemModel,
+        prefix="/item",
+        storage_cls=DictStorage,
+        facet_settings={"fields": ["type"]},
+    )
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+    docs = client.post(
+        "/item/",
+        json=[
+            {"name": f"name {index}", "des": "des", "type": "a"}
+            for index in range(2)
+        ],
+    ).json()
+    uids = [doc["_id"] for doc in docs]
+
+    batch = client.get("/item/batch", params={"uid": [uids[1], "x"]}).json()
+    assert [doc["name"] for doc in batch["results"]] == ["name 1"]
+    assert batch["missing"] == ["x"]
+    # Facet counts read the written documents with get_many
+    response = client.patch("/item/", json=[{"_id": uids[0], "type": "b"}])
+    assert response.status_code == 200
+    assert router.facet_counts.slices[()]["type"] == {"a": 1, "b": 1}
+
+
+def test_custom_storage_export():
+    router = CRUDRouter(
+        collection="items",
+        model=ItemModel,
+        prefix="/item",
+        storage_cls=DictStorage,
+        export_batch_size=2,
+    )
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+    client.post(
+        "/item/",
+        json=[
+            {"name": f"name {index}", "des": "des", "type": "a"}
+            for index in range(5)
+        ],
+    )
+    response = client.get("/item/export")
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [doc["name"] for doc in lines] == [
+        f"name {index}" for index in range(5)
+    ]
+
+
+def test_bulk_routes():
+    router = CRUDRouter(
+        collection="items",
+        model=ItemModel,
+        prefix="/item",
+        storage_cls=MemoryStorage,
+        bulk_settings={"threshold": 100, "chunk_size": 2, "processes": 1},
+    )
+    app = FastAPI()
+    app.include_router(router)
+
+    # The routes read the raw body, their schema is declared explicitly
+    operations = app.openapi()["paths"]["/item/"]
+    for method, required in (
+        ("post", {"name", "des", "type"}),
+        ("patch", {"_id"}),
+        ("put", {"_id", "name", "des", "type"}),
+    ):
+        schema = operations[method]["requestBody"]["content"][
+            "application/json"
+        ]["schema"]
+        assert schema["type"] == "array"
+        assert set(schema["items"]["required"]) == required
+    assert "$defs" not in json.dumps(app.openapi())
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/item/",
+            json=[
+                {"name": f"name {index}", "des": "des", "type": "a"}
+                for index in range(5)
+            ],
+        )
+        assert response.status_code == 200
+        assert router.bulk_validator._executor is not None
+    # The worker processes are stopped with the application
+    assert router.bulk_validator._executor is None
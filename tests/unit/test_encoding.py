@@ -0,0 +1,146 @@
+import enum
+import uuid
+from datetime import date, datetime, timezone
+from types import SimpleNamespace
+
+import pydantic
+import pytest
+from bson import Binary
+
+from demo.schemas import ItemModel
+from fastcrud.storage.encoding import (
+    BSONEncoder,
+    ValueEncoder,
+    datetime_fields,
+    get_encoder,
+    migrate_string_dates,
+)
+
+
+class Color(enum.Enum):
+    RED = "red"
+
+
+class Nested(pydantic.BaseModel):
+    day: date
+    uid: uuid.UUID
+
+
+class Sample(pydantic.BaseModel):
+    at: datetime
+    color: Color
+    nested: Nested
+    tags: set[str]
+
+
+def test_bson_encoder():
+    uid = uuid.uuid4()
+    at = datetime(2024, 1, 2, 3, 4, 5)
+    item = Sample(
+        at=at,
+        color=Color.RED,
+        nested=Nested(day=date(2024, 1, 2), uid=uid),
+        tags={"a"},
+    )
+    assert BSONEncoder().dump(item) == {
+        "at": at,
+        "color": "red",
+        "nested": {
+            "day": datetime(2024, 1, 2),
+            "uid": Binary.from_uuid(uid),
+        },
+        "tags": ["a"],
+    }
+    assert ValueEncoder().dump(item)["at"] == "2024-01-02T03:04:05"
+
+
+def test_encoded_filter_values():
+    at = datetime(2024, 1, 2, tzinfo=timezone.utc)
+    assert get_encoder("bson").value(at) is at
+    assert get_encoder("json").value(at) == "2024-01-02T00:00:00Z"
+    assert get_encoder("bson").value(date(2024, 1, 2)) == datetime(2024, 1, 2)
+    with pytest.raises(ValueError, match="Unknown encoding"):
+        get_encoder("xml")
+
+
+def test_datetime_fields():
+    assert datetime_fields(ItemModel) == ["created", "updated"]
+
+
+class Cursor:
+    def __init__(self, docs: list[dict]):
+        self.docs = docs
+
+    async def __aiter__(self):
+        for doc in self.docs:
+            yield doc
+
+
+class Collection:
+    name = "items"
+
+    def __init__(self, docs: list[dict]):
+        self.docs = {doc["_id"]: doc for doc in docs}
+        self.writes = 0
+
+    def find(self, query: dict, projection: dict, batch_size: int):
+        fields = [field for clause in query["$or"] for field in clause]
+        return Cursor(
+            [
+                {
+                    "_id": doc["_id"],
+                    **{field: doc.get(field) for field in fields},
+                }
+                for doc in self.docs.values()
+                if any(isinstance(doc.get(field), str) for field in fields)
+            ]
+        )
+
+    async def bulk_write(self, operations: list, ordered: bool):
+        self.writes += 1
+        for operation in operations:
+            self.docs[operation._filter["_id"]].update(operation._doc["$set"])
+        return SimpleNamespace(modified_count=len(operations))
+
+
+@pytest.mark.asyncio
+async def test_migrate_string_dates():
+    collection = Collection(
+        [
+            {"_id": "1", "created": "2024-01-02T00:00:00Z", "updated": None},
+            {"_id": "2", "created": "not a date", "updated": "2024-01-02"},
+            {"_id": "3", "created": datetime(2024, 1, 2)},
+        ]
+    )
+    report = await migrate_string_dates(
+        collection, ["created", "updated"], batch_size=1, dry_run=True
+    )
+    assert report == {
+        "matched": 2,
+        "converted": 2,
+        "skipped": 1,
+        "modified": 0,
+    }
+    assert collection.writes == 0
+
+    report = await migrate_string_dates(
+        collection, ["created", "updated"], batch_size=1
+    )
+    assert report["modified"] == 2
+    assert collection.writes == 2
+    assert collection.docs["1"]["created"] == datetime(
+        2024, 1, 2, tzinfo=timezone.utc
+    )
+    assert collection.docs["2"] == {
+        "_id": "2",
+        "created": "not a date",
+        "updated": datetime(2024, 1, 2),
+    }
+    # Interrupted migrations resume on the remaining strings only
+    report = await migrate_string_dates(collection, ["created", "updated"])
+    assert report == {
+        "matched": 1,
+        "converted": 0,
+        "skipped": 1,
+        "modified": 0,
+    }
@@ -0,0 +1,60 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi.exceptions import HTTPException
+
+from fastcrud.executors import BoundedExecutor
+from fastcrud.utils import run_async_or_sync
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_bounded_executor_rejects_when_saturated():
+    executor = BoundedExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+    try:
+        running = [
+            asyncio.ensure_future(executor.run(release.wait))
+            for _ in range(2)
+        ]
+        await asyncio.sleep(0.05)
+        assert executor.stats["running"] == 1
+        assert executor.stats["queued"] == 1
+
+        with pytest.raises(HTTPException) as err:
+            await executor.run(release.wait)
+        assert err.value.status_code == 503
+        assert err.value.headers == {"Retry-After": "1"}
+        assert executor.rejected == 1
+
+        release.set()
+        assert await asyncio.gather(*running) == [True, True]
+        assert await executor.run(sum, [1, 2]) == 3
+    finally:
+        release.set()
+        executor.shutdown()
+
+    stats = executor.stats
+    assert stats["submitted"] == 3
+    assert stats["rejected"] == 1
+    assert (stats["running"], stats["queued"]) == (0, 0)
+    # The queued call waited for the first one to finish
+    assert stats["max_wait_time"] > 0
+    assert stats["wait_time"] >= stats["max_wait_time"]
+
+
+async def test_run_async_or_sync_threads():
+    loop_thread = threading.get_ident()
+    assert await run_async_or_sync(threading.get_ident) != loop_thread
+    executor = BoundedExecutor(max_workers=1)
+    try:
+        thread = await run_async_or_sync(
+            threading.get_ident, executor=executor
+        )
+        assert thread != loop_thread
+    finally:
+        executor.shutdown()
+    # Opted out, for code bound to the loop thread
+    thread = await run_async_or_sync(threading.get_ident, offload=False)
+    assert thread == loop_thread
@@ -0,0 +1,41 @@
+import pytest
+
+from fastcrud.storage.facets import MaterializedFacets
+from tests.unit.conftest import PRODUCTS, Product, find
+
+pytestmark = pytest.mark.asyncio
+
+
+def ordered(facets: list[dict]) -> list[dict]:
+    return sorted(facets, key=lambda facet: (-facet["count"], repr(facet)))
+
+
+async def test_materialized_facets_match_the_pipelines(storage, products):
+    facets = MaterializedFacets(["type", "tags"], partitions=["type"])
+    assert facets.lookup({}, ["type"]) is None
+    report = await facets.reconcile(storage)
+    assert report["drifted_slices"] == report["slices"]
+
+    for filters in ({}, {"type": "a"}):
+        materialized = facets.lookup(filters, ["type", "tags"])
+        page = await find(storage, facets=["type", "tags"], **filters)
+        for field in ("type", "tags"):
+            assert ordered(materialized[field]) == ordered(page[field])
+    assert facets.lookup({"rank__gt": 1}, ["type"]) is None
+    assert facets.lookup({}, ["rank"]) is None
+
+
+async def test_materialized_facets_follow_writes(storage, products):
+    facets = MaterializedFacets(["type"], partitions=["type"])
+    await facets.reconcile(storage)
+    (doc,) = await storage.create([Product(**PRODUCTS[1])])
+    facets.apply([], [doc])
+    facets.apply([products[0]], [{**products[0], "type": "c"}])
+    assert facets.lookup({}, ["type"])["type"] == [
+        {"_id": "b", "count": 3},
+        {"_id": "a", "count": 2},
+        {"_id": "c", "count": 2},
+    ]
+    assert facets.lookup({"type": "c"}, ["type"])["type"] == [
+        {"_id": "c", "count": 2}
+    ]
@@ -0,0 +1,87 @@
+import pytest
+
+from demo.dependencies import item_query_params
+from fastcrud.storage.indexes import derive_index_plan, key_pattern
+
+
+def plan_keys(*args, **kwargs) -> list[list]:
+    return [
+        list(index.document["key"].items())
+        for index in derive_index_plan(*args, **kwargs)
+    ]
+
+
+def test_single_field_indexes():
+    assert plan_keys(item_query_params) == [
+        [("created", 1)],
+        [("updated", 1)],
+        [("name", 1)],
+        [("des", 1)],
+    ]
+
+
+def test_prefix_indexes_are_dropped():
+    keys = plan_keys(item_query_params, ["name", "-created"])
+    # Served by the name/_id and the reversed created/_id indexes
+    assert [("name", 1)] not in keys
+    assert [("created", 1)] not in keys
+    assert [("name", 1), ("_id", 1)] in keys
+    assert [("created", -1), ("_id", 1)] in keys
+    assert [("des", 1), ("name", 1), ("_id", 1)] in keys
+    assert [("updated", 1)] in keys
+
+
+def test_indexed_fields_are_restricted():
+    keys = plan_keys(
+        item_query_params, ["name", "-created"], fields=["name"]
+    )
+    assert not [index for index in keys if ("des", 1) in index]
+    assert [("name", 1), ("created", -1), ("_id", 1)] in keys
+    # The search fields are indexed whatever the restriction
+    keys = plan_keys(
+        item_query_params, search={"name": "ngram"}, fields=["des"]
+    )
+    assert keys == [
+        [("created", 1)],
+        [("updated", 1)],
+        [("des", 1)],
+        [("_ngrams.name", 1)],
+    ]
+
+
+def test_indexes_are_capped(caplog):
+    def filters(a: str, b: str, c: str, d: str):
+        ...
+
+    orderings = ["-created", "updated", "a"]
+    keys = plan_keys(filters, orderings)
+    assert len(keys) == 14
+    capped = plan_keys(filters, orderings, max_indexes=8)
+    assert len(capped) == 8
+    assert "Left 6 indexes out of the plan" in caplog.text
+    # The pairs of the last orderings are dropped first, the ordering
+    # indexes are kept
+    assert [("a", 1), ("_id", 1)] in capped
+    assert [("d", 1), ("created", -1), ("_id", 1)] in capped
+    assert [("d", 1), ("a", 1), ("_id", 1)] not in capped
+    assert [("d", 1), ("updated", 1), ("_id", 1)] not in capped
+    assert len(plan_keys(filters, orderings, max_indexes=2)) == 2
+
+
+def test_search_indexes(caplog):
+    keys = plan_keys(item_query_params, search={"name": "text"})
+    assert [("name", "text")] in keys
+    assert "text search strategy of name" in caplog.text
+    assert [("name", 1)] in keys
+    keys = plan_keys(item_query_params, search={"name": "ngram"})
+    assert [("_ngrams.name", 1)] in keys
+    with pytest.raises(ValueError, match="Unknown search strategy"):
+        derive_index_plan(item_query_params, search={"name": "fuzzy"})
+
+
+def test_key_pattern():
+    assert key_pattern([("name", 1), ("_id", 1)]) == (("name", 1), ("_id", 1))
+    assert key_pattern({"des": "text", "name": "text"}) == (
+        "$text",
+        ("des", "name"),
+    )
@@ -0,0 +1,369 @@
+"""MongoStorage against a minimal stand-in of a Motor database."""
+import copy
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pymongo import IndexModel
+
+from demo.dependencies import item_query_params
+from demo.schemas import ItemModel
+from fastcrud.core import CRUDRouter
+from fastcrud.storage.cache import QueryCache
+from fastcrud.storage.memory import match_document
+from fastcrud.storage.mongodb import MongoStorage
+from fastcrud.storage.relations import normalize_relations
+from fastcrud.utils import create_replace_model, create_update_model
+from tests.unit.conftest import COMMON
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeCursor:
+    def __init__(self, docs: list[dict]):
+        self.docs = docs
+
+    async def to_list(self, length):
+        return self.docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeCollection:
+    def __init__(self, docs: list[dict] | None = None):
+        self.docs = docs or []
+        self.pipelines: list[list[dict]] = []
+        self.estimated = 0
+        self.indexes: dict[str, dict] = {"_id_": {"key": [("_id", 1)]}}
+
+    async def index_information(self) -> dict:
+        return self.indexes
+
+    async def create_indexes(self, indexes: list[IndexModel]):
+        for index in indexes:
+            name = index.document["name"]
+            if name in self.indexes or any(
+                info["key"] == list(index.document["key"].items())
+                for info in self.indexes.values()
+            ):
+                raise AssertionError(f"IndexOptionsConflict: {name}")
+            self.indexes[name] = {"key": list(index.document["key"].items())}
+
+    def find(
+        self, query: dict, projection: dict | None = None, **kwargs
+    ) -> FakeCursor:
+        return FakeCursor(
+            [
+                copy.deepcopy(doc)
+                for doc in self.docs
+                if match_document(doc, query)
+            ]
+        )
+
+    async def insert_many(self, docs: list[dict], ordered: bool):
+        self.docs.extend(copy.deepcopy(docs))
+
+    async def bulk_write(self, operations: list, ordered: bool):
+        matched = 0
+        for operation in operations:
+            for index, doc in enumerate(self.docs):
+                if not match_document(doc, operation._filter):
+                    continue
+                matched += 1
+                if isinstance(operation._doc, list):
+                    # Only the $replaceWith of MongoStorage.replace
+                    (stage,) = operation._doc
+                    literal, paths = stage["$replaceWith"]["$mergeObjects"]
+                    self.docs[index] = {
+                        **literal["$literal"],
+                        **{
+                            field: doc[path[1:]]
+                            for field, path in paths.items()
+                            if path[1:] in doc
+                        },
+                    }
+                    continue
+                for path, value in operation._doc["$set"].items():
+                    *parents, field = path.split(".")
+                    target = doc
+                    for parent in parents:
+                        target = target.setdefault(parent, {})
+                    target[field] = value
+        return SimpleNamespace(
+            bulk_api_result={"nMatched": matched, "nModified": matched},
+            modified_count=matched,
+        )
+
+    async def estimated_document_count(self) -> int:
+        self.estimated += 1
+        return len(self.docs)
+
+    def aggregate(self, stages: list[dict]) -> FakeCursor:
+        self.pipelines.append(stages)
+        if stages and "$count" in stages[-1]:
+            return FakeCursor([{"count": len(self.docs)}])
+        # Every query returns new documents, like the server
+        return FakeCursor(copy.deepcopy(self.docs))
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name: str) -> FakeCollection:
+        self[name] = FakeCollection()
+        return self[name]
+
+
+async def test_lookup_expansion_keeps_cached_pages_intact():
+    db = FakeDatabase()
+    db["items"] = FakeCollection(
+        [
+            {
+                "_id": "1",
+                "name": "a",
+                "des": "d",
+                "type": "t",
+                "owner": "u1",
+                "_expand": {"owner": [{"_id": "u1", "name": "bob"}]},
+            }
+        ]
+    )
+    storage = MongoStorage(db, ItemModel, "items")
+    storage.relations = normalize_relations({"owner": "users"})
+    storage.query_cache = QueryCache()
+    common = {**COMMON, "expand": ["owner"]}
+
+    for _ in range(2):
+        page = await storage.find(common, {}, {}, [])
+        (result,) = page["results"]
+        assert result["owner"] == {"_id": "u1", "name": "bob"}
+        assert "_expand" not in result
+    # The second page was served by the query cache
+    assert len(db["items"].pipelines) == 2
+
+
+async def test_ensure_indexes_matches_key_patterns():
+    db = FakeDatabase()
+    db["items"].indexes.update(
+        {
+            # Created by hand under the default name
+            "updated_1": {"key": [("updated", 1)]},
+            "name_text": {
+                "key": [("_fts", "text"), ("_ftsx", 1)],
+                "weights": {"name": 1},
+            },
+            "type_1": {"key": [("type", 1)]},
+        }
+    )
+    storage = MongoStorage(db, ItemModel, "items")
+    indexes = [
+        IndexModel([("updated", 1)], name="fastcrud_updated_1"),
+        IndexModel([("name", "text")], name="fastcrud_name_text"),
+        IndexModel([("created", 1)], name="fastcrud_created_1"),
+    ]
+
+    report = await storage.ensure_indexes(indexes, dry_run=True)
+    assert report == {
+        "missing": ["fastcrud_created_1"],
+        "present": ["fastcrud_updated_1", "fastcrud_name_text"],
+        "extra": ["type_1"],
+    }
+    assert "fastcrud_created_1" not in db["items"].indexes
+
+    await storage.ensure_indexes(indexes)
+    assert "fastcrud_created_1" in db["items"].indexes
+    report = await storage.ensure_indexes(indexes)
+    assert report["missing"] == []
+
+
+async def test_bulk_write_reports_unmatched_ids():
+    db = FakeDatabase()
+    db["items"] = FakeCollection(
+        [{"_id": "1", "name": "a", "des": "d", "type": "t"}]
+    )
+    storage = MongoStorage(db, ItemModel, "items")
+    update_model = create_update_model(ItemModel)
+
+    report = await storage.update(
+        [update_model(_id="1", name="b"), update_model(_id="2", name="c")]
+    )
+    assert report["matched_count"] == 1
+    assert report["items"] == [
+        {"_id": "1", "status": "ok"},
+        {"_id": "2", "status": "not_found"},
+    ]
+    assert db["items"].docs[0]["name"] == "b"
+
+
+async def test_replace_keeps_creation_date():
+    created = "2024-01-01T00:00:00"
+    db = FakeDatabase()
+    doc = {"_id": "1", "name": "a", "des": "d", "type": "t"}
+    db["items"] = FakeCollection([{**doc, "created": created}])
+    storage = MongoStorage(db, ItemModel, "items")
+    replace_model = create_replace_model(ItemModel)
+
+    report = await storage.replace(
+        [replace_model(_id="1", name="$b", des="d", type="u")]
+    )
+    assert report["items"] == [{"_id": "1", "status": "ok"}]
+    (doc,) = db["items"].docs
+    assert (doc["name"], doc["type"], doc["created"]) == ("$b", "u", created)
+
+
+async def test_backfill_ngrams():
+    db = FakeDatabase()
+    db["items"] = FakeCollection(
+        [
+            {"_id": "1", "name": "Abcd", "des": "d", "type": "t"},
+            {"_id": "2", "des": "d", "type": "t"},
+            {
+                "_id": "3",
+                "name": "xyz",
+                "des": "d",
+                "type": "t",
+                "_ngrams": {"name": ["xyz"]},
+            },
+        ]
+    )
+    storage = MongoStorage(db, ItemModel, "items")
+    assert await storage.backfill_ngrams() == {"matched": 0, "modified": 0}
+    storage.search = {"name": "ngram"}
+
+    report = await storage.backfill_ngrams(batch_size=1, dry_run=True)
+    assert report == {"matched": 2, "modified": 0}
+    report = await storage.backfill_ngrams(batch_size=1)
+    assert report == {"matched": 2, "modified": 2}
+    assert [doc["_ngrams"]["name"] for doc in db["items"].docs] == [
+        ["abc", "bcd"],
+        [],
+        ["xyz"],
+    ]
+    report = await storage.backfill_ngrams()
+    assert report == {"matched": 0, "modified": 0}
+
+
+async def test_estimated_and_cached_counts():
+    db = FakeDatabase()
+    db["items"] = FakeCollection(
+        [
+            {"_id": str(index), "name": "a", "des": "d", "type": "t"}
+            for index in range(3)
+        ]
+    )
+    storage = MongoStorage(db, ItemModel, "items")
+
+    def counts() -> list[list[dict]]:
+        return [
+            stages
+            for stages in db["items"].pipelines
+            if "$count" in stages[-1]
+        ]
+
+    page = await storage.find({**COMMON, "count": "estimated"}, {}, {}, [])
+    assert page["metadata"]["count"] == 3
+    assert page["metadata"]["count_exact"] is False
+    assert db["items"].estimated == 1
+    assert counts() == []
+    # Filtered counts are not in the collection metadata
+    page = await storage.find(
+        {**COMMON, "count": "estimated"}, {}, {"type": "t"}, []
+    )
+    assert page["metadata"]["count_exact"] is True
+    assert len(counts()) == 1
+
+    for _ in range(2):
+        page = await storage.find(
+            {**COMMON, "count": "cached"}, {}, {"type": "t"}, []
+        )
+        assert page["metadata"]["count"] == 3
+    assert len(counts()) == 2
+    await storage.find({**COMMON, "count": "cached"}, {}, {"type": "u"}, [])
+    assert len(counts()) == 3
+
+
+def test_invalid_export_filters_are_rejected():
+    db = FakeDatabase()
+    db["items"] = FakeCollection(
+        [{"_id": "1", "name": "a", "des": "d", "type": "t"}]
+    )
+    router = CRUDRouter(
+        collection="items",
+        model=ItemModel,
+        prefix="/item",
+        storage_cls=lambda _, model, collection: MongoStorage(
+            db, model, collection
+        ),
+        filters=item_query_params,
+        search={"name": "text"},
+    )
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+
+    response = client.get(
+        "/item/export", params={"name__contains": "a", "name__icontains": "b"}
+    )
+    assert response.status_code == 400
+    assert "only one text search" in response.json()["detail"]
+    response = client.get("/item/export")
+    assert response.status_code == 200
+    assert [json.loads(line)["_id"] for line in response.iter_lines()] == [
+        "1"
+    ]
+    response = client.get("/item/export", params={"name": "none"})
+    assert (response.status_code, response.text) == (200, "")
+
+
+async def test_facet_counts_with_bson_encoding():
+    db = FakeDatabase()
+    router = CRUDRouter(
+        collection="items",
+        model=ItemModel,
+        prefix="/item",
+        storage_cls=lambda _, model, collection: MongoStorage(
+            db, model, collection, encoding="bson"
+        ),
+        facet_settings={"fields": ["type", "created"]},
+    )
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+
+    (doc,) = client.post(
+        "/item/", json=[{"name": "a", "des": "d", "type": "t"}]
+    ).json()
+    # Stored natively, counted like the export lines
+    assert not isinstance(db["items"].docs[0]["created"], str)
+    response = client.patch("/item/", json=[{"_id": doc["_id"], "type": "u"}])
+    assert response.status_code == 200
+    counters = router.facet_counts.slices[()]
+    assert counters["type"] == {"u": 1}
+    assert list(counters["created"].values()) == [1]
+
+    report = await router.reconcile_facets()
+    assert report["drifted_slices"] == 0
+
+
+async def test_buffered_creates_follow_the_storage_settings():
+    db = FakeDatabase()
+    storage = MongoStorage(
+        db,
+        ItemModel,
+        "items",
+        batch_size=2,
+        ordered=False,
+        write_buffer={"max_items": 100},
+    )
+    items = [ItemModel(name=f"name {i}", des="d", type="t") for i in range(5)]
+    docs = await storage.create(items)
+    assert [doc["_id"] for doc in db["items"].docs] == [
+        doc["_id"] for doc in docs
+    ]
+    assert storage.write_coalescer.ordered is False
+    assert storage.write_coalescer.stats["writes"] == 3
@@ -0,0 +1,144 @@
+import pytest
+
+from fastcrud.storage.planner import plan_find
+from fastcrud.storage.relations import LOOKUP_FIELD
+from fastcrud.utils import encode_cursor
+from tests.unit.conftest import COMMON
+
+
+def test_plan_offset_page():
+    plan = plan_find(
+        {**COMMON, "ordering": "-rank", "offset": 20},
+        {"type": "a", "rank__gte": 2, "name": None},
+        [],
+    )
+    match = {"$match": {"$and": [{"type": "a"}, {"rank": {"$gte": 2}}]}}
+    assert plan.match == [match]
+    assert plan.page == [
+        match,
+        {"$sort": {"rank": -1}},
+        {"$skip": 20},
+        {"$limit": 10},
+    ]
+    assert plan.count == [match, {"$count": "count"}]
+    assert plan.facets is None
+
+
+def test_plan_without_filters():
+    plan = plan_find(COMMON, {"type": None}, [])
+    assert plan.match == []
+    assert plan.page == [{"$limit": 10}]
+    assert plan.count == [{"$count": "count"}]
+
+
+def test_plan_cursor_page():
+    cursor = encode_cursor([3, "uid"])
+    plan = plan_find(
+        {
+            **COMMON,
+            "ordering": "rank",
+            "cursor": cursor,
+            "pagination": "cursor",
+        },
+        {},
+        [],
+    )
+    assert plan.ordering == {"rank": 1, "_id": 1}
+    stage, sort, limit = plan.page
+    assert "$match" in stage
+    assert sort == {"$sort": {"rank": 1, "_id": 1}}
+    # One extra document tells whether there is a next page
+    assert limit == {"$limit": 11}
+
+
+def test_plan_cursor_mismatch():
+    cursor = encode_cursor([3])
+    with pytest.raises(ValueError, match="does not match ordering"):
+        plan_find(
+            {
+                **COMMON,
+                "ordering": "rank",
+                "cursor": cursor,
+                "pagination": "cursor",
+            },
+            {},
+            [],
+        )
+
+
+def test_plan_facets():
+    plan = plan_find(COMMON, {"type": "a"}, ["type"])
+    assert plan.facets == [
+        {"$match": {"$and": [{"type": "a"}]}},
+        {"$facet": {"type": [{"$sortByCount": "$type"}]}},
+    ]
+
+
+def test_plan_projection_keeps_cursor_fields():
+    plan = plan_find(
+        {
+            **COMMON,
+            "fields": ["name"],
+            "ordering": "rank",
+            "pagination": "cursor",
+        },
+        {},
+        [],
+    )
+    assert plan.projection == {"name": 1, "rank": 1}
+    assert plan.page[-1] == {"$project": {"name": 1, "rank": 1}}
+
+
+def test_plan_capped_count():
+    plan = plan_find({**COMMON, "count": "capped", "count_cap": 100}, {}, [])
+    assert plan.count == [{"$limit": 101}, {"$count": "count"}]
+    assert plan.count_metadata(101) == {"count": 100, "count_exact": False}
+    assert plan.count_metadata(50) == {"count": 50, "count_exact": True}
+
+
+def test_plan_expand_strategy():
+    relations = {"owner": {"collection": "users", "fields": ["name"]}}
+    plan = plan_find(
+        {**COMMON, "expand": ["owner"]}, {}, [], relations=relations
+    )
+    assert plan.expand_strategy == "lookup"
+    assert plan.page[-1] == {
+        "$lookup": {
+            "from": "users",
+            "localField": "owner",
+            "foreignField": "_id",
+            "as": f"{LOOKUP_FIELD}.owner",
+            "pipeline": [{"$project": {"name": 1}}],
+        }
+    }
+
+    plan = plan_find(
+        {**COMMON, "expand": ["owner"], "limit": 100},
+        {},
+        [],
+        relations=relations,
+    )
+    assert plan.expand_strategy == "batch"
+    assert "$lookup" not in plan.page[-1]
+
+
+def test_plan_unknown_expand():
+    with pytest.raises(ValueError, match="cannot expand: owner"):
+        plan_find({**COMMON, "expand": ["owner"]}, {}, [])
+
+
+def test_plan_single_text_search():
+    search = {"name": "text", "des": "text"}
+    plan = plan_find(COMMON, {"name__icontains": 'a "b"'}, [], search)
+    (clause,) = plan.match[0]["$match"]["$and"]
+    assert clause == {"$text": {"$search": '"a \\"b\\""'}}
+    with pytest.raises(ValueError, match="only one text search"):
+        plan_find(
+            COMMON, {"name__contains": "a", "des__icontains": "b"}, [], search
+        )
+
+
+def test_plan_explain():
+    explanation = plan_find(COMMON, {"type": "a"}, []).explain()
+    assert explanation["pagination"] == "offset"
+    assert explanation["page"][-1] == {"$limit": 10}
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from fastcrud.singleflight import SingleFlight
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_identical_calls_are_coalesced():
+    single_flight = SingleFlight()
+    calls = []
+    release = asyncio.Event()
+
+    async def load(uid):
+        calls.append(uid)
+        await release.wait()
+        return {"_id": uid}
+
+    waiting = [
+        asyncio.ensure_future(single_flight.do(("get", uid), load, uid))
+        for uid in ("a", "a", "b")
+    ]
+    await asyncio.sleep(0)
+    assert single_flight.stats["in_flight"] == 2
+    release.set()
+    assert await asyncio.gather(*waiting) == [
+        {"_id": "a"},
+        {"_id": "a"},
+        {"_id": "b"},
+    ]
+    assert calls == ["a", "b"]
+    assert single_flight.stats == {
+        "calls": 3,
+        "coalesced": 1,
+        "ratio": 1 / 3,
+        "in_flight": 0,
+    }
+    # Finished calls are not reused
+    assert await single_flight.do(("get", "a"), load, "a") == {"_id": "a"}
+    assert calls == ["a", "b", "a"]
+
+
+async def test_errors_are_shared():
+    single_flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def fail():
+        await release.wait()
+        raise LookupError("missing")
+
+    waiting = [
+        asyncio.ensure_future(single_flight.do("key", fail)) for _ in range(2)
+    ]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiting, return_exceptions=True)
+    assert [type(result) for result in results] == [LookupError] * 2
+
+
+async def test_cancelled_caller_does_not_cancel_the_call():
+    single_flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def load():
+        await release.wait()
+        return "value"
+
+    first = asyncio.ensure_future(single_flight.do("key", load))
+    second = asyncio.ensure_future(single_flight.do("key", load))
+    await asyncio.sleep(0)
+    first.cancel()
+    release.set()
+    assert await second == "value"
+    assert first.cancelled()
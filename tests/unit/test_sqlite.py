@@ -0,0 +1,74 @@
+import pytest
+
+from demo.dependencies import item_query_params
+from fastcrud.core import BaseCrudModel
+from fastcrud.storage.indexes import filter_parameters
+from fastcrud.storage.sqlite import (
+    SQLiteStorage,
+    array_fields,
+    compile_query,
+)
+from tests.unit.conftest import COMMON, Product, find
+
+
+class Counter(BaseCrudModel):
+    page: int
+    count: int
+
+
+def test_compile_query():
+    assert compile_query(
+        {"$and": [{"type": "a"}, {"rank": {"$gte": 2, "$lt": 4}}]}
+    ) == (
+        "(json_extract(doc, '$.type') = ? AND "
+        "json_extract(doc, '$.rank') >= ? AND "
+        "json_extract(doc, '$.rank') < ?)",
+        ["a", 2, 4],
+    )
+    assert compile_query({"rank": None, "_id": {"$ne": None}}) == (
+        "json_extract(doc, '$.rank') IS NULL AND id IS NOT NULL",
+        [],
+    )
+    assert compile_query({"tags": {"$nin": ["p"]}}, {"tags"}) == (
+        "NOT EXISTS (SELECT 1 FROM json_each(doc, '$.tags') "
+        "WHERE value IN (?))",
+        ["p"],
+    )
+    with pytest.raises(ValueError, match="invalid field"):
+        compile_query({"rank') OR 1=1 --": 1})
+
+
+def test_array_fields():
+    assert array_fields(Product) == {"tags"}
+
+
+@pytest.mark.asyncio
+async def test_filter_fields_are_indexed():
+    storage = SQLiteStorage(None, Product, "products")
+    storage.compile_filters(
+        [
+            "tags",
+            "rank__gte",
+            "name__contains",
+            *filter_parameters(item_query_params),
+        ]
+    )
+    assert storage.indexes == ["created", "updated", "rank", "name", "des"]
+    explanation = await storage.explain(
+        COMMON, {}, {"rank__gte": 2, "name": "a"}, []
+    )
+    (plan,) = explanation["sql"]["page"]["plan"]
+    assert "USING INDEX" in plan
+
+
+@pytest.mark.asyncio
+async def test_facets_named_like_statements():
+    storage = SQLiteStorage(None, Counter, "counters")
+    await storage.create(
+        [Counter(page=index % 2, count=1) for index in range(3)]
+    )
+    page = await find(storage, facets=["page", "count"])
+    assert page["page"] == [{"_id": 0, "count": 2}, {"_id": 1, "count": 1}]
+    assert page["count"] == [{"_id": 1, "count": 3}]
+    assert page["metadata"]["count"] == 3
+    assert len(page["results"]) == 3
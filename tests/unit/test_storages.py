@@ -0,0 +1,209 @@
+"""Storages answer like MongoDB, see :class:`MemoryStorage`."""
+import json
+
+import pytest
+from fastapi.exceptions import HTTPException
+
+from fastcrud.utils import create_in_db_model, create_update_model
+from tests.unit.conftest import Product, find, walk
+
+pytestmark = pytest.mark.asyncio
+
+
+def names(page: dict | list) -> list[str]:
+    results = page["results"] if isinstance(page, dict) else page
+    return [doc["name"] for doc in results]
+
+
+@pytest.mark.parametrize(
+    "filters, expected",
+    [
+        ({"type": "a"}, ["alpha", "gamma", "epsilon"]),
+        ({"type__in": "b,c"}, ["Beta", "delta", "a.b"]),
+        ({"type__nin": "b,c"}, ["alpha", "gamma", "epsilon"]),
+        ({"rank__gt": 3}, ["gamma", "epsilon", "a.b"]),
+        ({"rank__gte": 2, "rank__lt": 4}, ["alpha", "delta"]),
+        ({"tags": "p"}, ["alpha", "delta"]),
+        ({"tags__in": "p,r"}, ["alpha", "delta", "epsilon"]),
+        ({"tags__nin": "q"}, ["gamma", "epsilon", "a.b"]),
+        ({"meta__k__gte": 2}, ["delta"]),
+        ({"name__contains": "a.b"}, ["a.b"]),
+        ({"name__contains": "eta"}, ["Beta"]),
+        ({"name__icontains": "BETA"}, ["Beta"]),
+        ({"type": "a", "rank__lte": 4}, ["alpha", "epsilon"]),
+        ({"type": "z"}, []),
+    ],
+)
+async def test_filters(storage, products, filters, expected):
+    page = await find(storage, ordering="_id", **filters)
+    assert sorted(names(page)) == sorted(expected)
+    assert page["metadata"]["count"] == len(expected)
+
+
+async def test_ordering_and_offset(storage, products):
+    page = await find(storage, ordering="-rank")
+    assert names(page) == ["a.b", "gamma", "epsilon", "alpha", "delta", "Beta"]
+    page = await find(storage, ordering="rank", limit=2, offset=2)
+    assert names(page) == ["alpha", "epsilon"]
+    assert page["metadata"]["count"] == 6
+
+
+@pytest.mark.parametrize(
+    "ordering, expected",
+    [
+        ("rank", ["Beta", "delta", "alpha", "epsilon", "gamma", "a.b"]),
+        (
+            "type,-rank",
+            ["gamma", "epsilon", "alpha", "a.b", "Beta", "delta"],
+        ),
+    ],
+)
+async def test_cursor_walk(storage, products, ordering, expected):
+    assert names(await walk(storage, ordering=ordering, limit=2)) == expected
+
+
+async def test_cursor_walk_with_filters(storage, products):
+    results = await walk(storage, ordering="-rank", limit=1, type="a")
+    assert names(results) == ["gamma", "epsilon", "alpha"]
+
+
+async def test_facets(storage, products):
+    page = await find(storage, facets=["type"], limit=1)
+    assert page["type"] == [
+        {"_id": "a", "count": 3},
+        {"_id": "b", "count": 2},
+        {"_id": "c", "count": 1},
+    ]
+    page = await find(storage, facets=["type"], rank__gt=3)
+    assert page["type"] == [
+        {"_id": "a", "count": 2},
+        {"_id": "b", "count": 1},
+    ]
+
+
+async def test_capped_count(storage, products):
+    page = await find(storage, count="capped", count_cap=2)
+    assert page["metadata"]["count"] == 2
+    assert page["metadata"]["count_exact"] is False
+
+
+async def test_fields(storage, products):
+    page = await find(storage, fields=["name"], ordering="rank", limit=1)
+    (result,) = page["results"]
+    assert result == {"_id": result["_id"], "name": "Beta"}
+    with pytest.raises(HTTPException) as err:
+        await find(storage, fields=["unknown"])
+    assert err.value.status_code == 400
+
+
+async def test_get_many(storage, products):
+    uids = [products[1]["_id"], "missing", products[0]["_id"]]
+    items = await storage.get_many(uids)
+    assert [item and item.name for item in items] == ["Beta", None, "alpha"]
+
+
+async def test_update(storage, products):
+    update_model = create_update_model(Product)
+    report = await storage.update(
+        [
+            update_model(_id=products[0]["_id"], rank=10),
+            update_model(_id="missing", rank=10),
+        ]
+    )
+    assert report["matched_count"] == 1
+    assert [item["status"] for item in report["items"]] == ["ok", "not_found"]
+    item = await storage.get(products[0]["_id"])
+    assert (item.name, item.rank) == ("alpha", 10)
+    page = await find(storage, rank__gt=5)
+    assert sorted(names(page)) == ["a.b", "alpha"]
+
+
+async def test_update_replaces_top_level_fields(storage, products):
+    update_model = create_update_model(Product)
+    await storage.update(
+        [update_model(_id=products[0]["_id"], meta={"j": 2}, tags=[])]
+    )
+    item = await storage.get(products[0]["_id"])
+    assert (item.meta, item.tags, item.rank) == ({"j": 2}, [], 3)
+    await storage.update([update_model(_id=products[0]["_id"], meta=None)])
+    assert (await storage.get(products[0]["_id"])).meta is None
+
+
+async def test_replace(storage, products):
+    db_model = create_in_db_model(Product)
+    report = await storage.replace(
+        [db_model(_id=products[0]["_id"], name="omega", type="z")]
+    )
+    assert report["matched_count"] == 1
+    item = await storage.get(products[0]["_id"])
+    assert (item.name, item.type, item.rank) == ("omega", "z", None)
+    # The creation date is not replaced
+    assert item.created == Product(**products[0]).created
+    assert names(await find(storage, type="z")) == ["omega"]
+
+
+async def test_delete(storage, products):
+    report = await storage.delete([products[0]["_id"], "missing"])
+    assert report == {"deleted_count": 1}
+    with pytest.raises(HTTPException) as err:
+        await storage.get(products[0]["_id"])
+    assert err.value.status_code == 404
+    assert (await find(storage))["metadata"]["count"] == 5
+
+
+async def test_export(storage, products):
+    lines = [
+        line
+        async for line in storage.export(
+            {}, {"type": "a"}, ordering="rank", batch_size=2
+        )
+    ]
+    assert [json.loads(line)["name"] for line in lines] == [
+        "alpha",
+        "epsilon",
+        "gamma",
+    ]
+
+
+@pytest.mark.parametrize("ordering", ["rank", "-rank", "type,rank"])
+async def test_cursor_walk_with_nulls(storage, products, ordering):
+    await storage.create(
+        [Product(name=f"null {index}", type="a") for index in range(3)]
+    )
+    expected = names(
+        await find(storage, ordering=f"{ordering},_id", limit=100)
+    )
+    assert len(expected) == 9
+    for limit in (1, 2, 4):
+        results = await walk(storage, ordering=ordering, limit=limit)
+        assert names(results) == expected
+
+
+async def test_export_with_nulls(storage, products):
+    await storage.create(
+        [Product(name=f"null {index}", type="a") for index in range(3)]
+    )
+    for ordering in ("rank", "-rank"):
+        lines = [
+            line
+            async for line in storage.export(
+                {}, {}, ordering=ordering, batch_size=2
+            )
+        ]
+        assert len(lines) == 9
+
+
+async def test_nulls_sort_first(storage, products):
+    await storage.create([Product(name="null", type="a")])
+    assert names(await find(storage, ordering="rank"))[0] == "null"
+    assert names(await find(storage, ordering="-rank"))[-1] == "null"
+
+
+async def test_list_facets(storage, products):
+    page = await find(storage, facets=["tags"])
+    assert sorted(page["tags"], key=lambda facet: facet["_id"]) == [
+        {"_id": [], "count": 2},
+        {"_id": ["p", "q"], "count": 2},
+        {"_id": ["q"], "count": 1},
+        {"_id": ["r"], "count": 1},
+    ]
@@ -0,0 +1,98 @@
+import base64
+from datetime import datetime, timezone
+
+import pytest
+
+from fastcrud.utils import (
+    build_search_parameter,
+    decode_cursor,
+    encode_cursor,
+    ngrams,
+    normalize_parameter,
+    project_document,
+)
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        ["alpha", 3, 1.5, True, None, "uid"],
+        [datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc), "uid"],
+        [datetime(2024, 1, 2, 3, 4, 5), "uid"],
+    ],
+)
+def test_cursor_round_trip(values):
+    cursor = encode_cursor(values)
+    assert isinstance(cursor, str)
+    assert decode_cursor(cursor) == values
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b"{}",
+        b"null",
+        b'[{"$regex": "."}, "uid"]',
+        b'[["a"], "uid"]',
+        b'[{"$date": {"$gt": 1}}, "uid"]',
+    ],
+)
+def test_invalid_cursor_values(payload):
+    with pytest.raises(ValueError, match="invalid cursor"):
+        decode_cursor(base64.urlsafe_b64encode(payload).decode())
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "e30=", "bnVsbA=="])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError, match="invalid cursor"):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize(
+    "parameter, expected",
+    [
+        ("name", ("name", None)),
+        ("rank__gte", ("rank", "$gte")),
+        ("tags__in", ("tags", "$in")),
+        ("name__icontains", ("name", "icontains")),
+        ("meta__k", ("meta.k", None)),
+        ("meta__k__lt", ("meta.k", "$lt")),
+    ],
+)
+def test_normalize_parameter(parameter, expected):
+    assert normalize_parameter(parameter) == expected
+
+
+def test_search_parameter_is_escaped():
+    assert build_search_parameter("name", "contains", "a.b", "regex") == {
+        "name": {"$regex": r"a\.b"}
+    }
+    assert build_search_parameter("name", "icontains", "a", "prefix") == {
+        "name": {"$regex": "^a", "$options": "i"}
+    }
+    assert build_search_parameter("name", "contains", 'say "hi"', "text") == {
+        "$text": {"$search": '"say \\"hi\\""'}
+    }
+
+
+def test_ngram_search_parameter():
+    assert ngrams("Alpha") == ["alp", "lph", "pha"]
+    assert build_search_parameter("name", "contains", "lph", "ngram") == {
+        "$and": [
+            {"_ngrams.name": {"$all": ["lph"]}},
+            {"name": {"$regex": "lph"}},
+        ]
+    }
+    # Values shorter than an n-gram fall back to the regex
+    assert build_search_parameter("name", "contains", "lp", "ngram") == {
+        "name": {"$regex": "lp"}
+    }
+
+
+def test_project_document():
+    doc = {"_id": "1", "name": "a", "meta": {"k": 1, "j": 2}, "rank": 3}
+    assert project_document(doc, {"name": 1, "meta.k": 1}) == {
+        "_id": "1",
+        "name": "a",
+        "meta": {"k": 1},
+    }